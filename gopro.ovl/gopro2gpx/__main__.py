@@ -1,3 +1,5 @@
+import sys
+
 from .gopro2gpx import main
 
-main()
\ No newline at end of file
+sys.exit(main())
@@ -0,0 +1,162 @@
+#
+# Binary columnar export of the decoded telemetry (telemetry.decodeAll: GPS5,
+# GPS9, ACCL, GYRO, TMPC with GPSU, GPSF and GPSP), so other tools load it
+# without parsing the GPMF or the GPX again.
+#
+#   npz:     one file of named arrays (gps5_lat, accl_values...)
+#   npy:     a directory with one .npy per array, np.load(mmap_mode = 'r')
+#            maps them without reading
+#   parquet: one file per table (pyarrow)
+#   arrow:   one Arrow IPC file per table, memory mappable (pyarrow)
+#
+# The tables are the samples (<stream>) and the payloads (<stream>_payloads)
+# of each stream, each with its time column: seconds of the video for the
+# samples (GPS9: their UTC) and the payloads. The DVNM and the STNM of the
+# streams go in the metadata (metadata.json, or the metadata of the schema).
+#
+# Released under GNU GENERAL PUBLIC LICENSE v3. (Use at your own risk)
+#
+
+import json
+import os
+
+import numpy as np
+
+from . import telemetry
+
+try:
+    import pyarrow
+    import pyarrow.feather
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+FORMATS = ('npz', 'npy', 'parquet', 'arrow')
+ARROW_FORMATS = ('parquet', 'arrow')
+STREAMS = ('gps5', 'gps9', 'accl', 'gyro', 'tmpc')
+
+# columns with one value per payload, the others have one per sample
+PAYLOAD_COLUMNS = { 'gps5': ('counts', 'gpsu', 'fix', 'dop') }
+
+
+def unavailable(formats):
+    "the formats of formats that can't be written here: parquet and arrow without pyarrow"
+    return [ f for f in formats if f in ARROW_FORMATS and pyarrow is None ]
+
+
+def telemetryColumns(tree, track = None):
+    """
+    the decoded streams of the gpmftree.GpmfTree as named arrays (see
+    telemetry.decodeAll) and their metadata
+    """
+    columns = telemetry.decodeAll(tree, track)
+    metadata = {
+        'device': str(columns.pop('device')),
+        'streams': telemetry.streamNames(tree),
+        'time': "seconds from the first frame of the video, gps9_time and gps5_gpsu: UTC"
+    }
+    return columns, metadata
+
+
+def tables(columns):
+    """
+    the columns as tables of 1-D arrays by name: <stream> with the samples
+    and <stream>_payloads with the payloads, 3 axis values split in _x _y _z
+    """
+    result = {}
+    for stream in STREAMS:
+        if f"{stream}_counts" not in columns:
+            continue
+        per_payload = PAYLOAD_COLUMNS.get(stream, ('counts',))
+        samples = {}
+        payloads = {}
+        for name, values in columns.items():
+            prefix, _, column = name.partition('_')
+            if prefix != stream:
+                continue
+            table = payloads if column in per_payload else samples
+            if values.ndim == 2:
+                for axis, suffix in enumerate('xyz'):
+                    table[f"{column}_{suffix}"] = values[:, axis]
+            else:
+                table[column] = values
+        if 'time' in samples:
+            # time of the first sample of each payload, NaN (NaT) when empty
+            counts = payloads['counts']
+            used = counts > 0
+            payloads['time'] = np.full(len(counts), np.nan).astype(samples['time'].dtype)
+            payloads['time'][used] = samples['time'][(np.cumsum(counts) - counts)[used]]
+        result[stream] = samples
+        result[f"{stream}_payloads"] = payloads
+    return result
+
+
+def writeNPZ(base, columns, metadata):
+    path = f"{base}.npz"
+    np.savez(path, metadata = np.array(json.dumps(metadata)), **columns)
+    return [ path ]
+
+
+def writeNPY(base, columns, metadata):
+    os.makedirs(base, exist_ok = True)
+    for name, values in columns.items():
+        np.save(os.path.join(base, f"{name}.npy"), values)
+    with open(os.path.join(base, "metadata.json"), "w") as fd:
+        json.dump(metadata, fd)
+    return [ base ]
+
+
+def writeArrow(base, columns, metadata, format):
+    if pyarrow is None:
+        raise ImportError(f"the {format} export needs pyarrow")
+    files = []
+    for name, table in tables(columns).items():
+        arrow = pyarrow.table(table).replace_schema_metadata({ 'gopro2gpx': json.dumps(metadata) })
+        path = f"{base}.{name}.{format}"
+        if format == 'parquet':
+            pyarrow.parquet.write_table(arrow, path)
+        else:
+            pyarrow.feather.write_feather(arrow, path, compression = 'uncompressed')
+        files.append(path)
+    return files
+
+
+def exportTelemetry(tree, base, formats, track = None):
+    """
+    write the decoded telemetry of the gpmftree.GpmfTree to base.<format>
+    (base.<table>.<format> for parquet and arrow, the directory base for
+    npy) for every format of formats. Returns the file names
+    """
+    for f in formats:
+        if f not in FORMATS:
+            raise ValueError(f"unknown telemetry format {f}, use some of {FORMATS}")
+    missing = unavailable(formats)
+    if missing:
+        raise ImportError(f"the {' and '.join(missing)} export needs pyarrow")
+    columns, metadata = telemetryColumns(tree, track)
+    files = []
+    for f in formats:
+        if f == 'npz':
+            files += writeNPZ(base, columns, metadata)
+        elif f == 'npy':
+            files += writeNPY(base, columns, metadata)
+        else:
+            files += writeArrow(base, columns, metadata, f)
+    return files
+
+
+def load(path, mmap = True):
+    """
+    the columns and the metadata written by writeNPZ (path.npz) or writeNPY
+    (the directory path, memory mapped if mmap)
+    """
+    if os.path.isdir(path):
+        columns = {}
+        for name in sorted(os.listdir(path)):
+            if name.endswith('.npy'):
+                columns[name[:-4]] = np.load(os.path.join(path, name), mmap_mode = 'r' if mmap else None)
+        with open(os.path.join(path, "metadata.json")) as fd:
+            return columns, json.load(fd)
+    with np.load(path, allow_pickle = False) as npz:
+        columns = { name: npz[name] for name in npz.files }
+    return columns, json.loads(str(columns.pop('metadata')))
@@ -0,0 +1,62 @@
+#
+# Export of a GPS track to several formats (gpshelper.WRITERS: gpx, kml, csv,
+# geojson) in one pass: every chunk of the track is formatted once and
+# written to all the open files, each with its own simplification.
+#
+# Released under GNU GENERAL PUBLIC LICENSE v3. (Use at your own risk)
+#
+
+import contextlib
+
+from . import gpshelper
+from . import simplify
+
+FORMATS = tuple(gpshelper.WRITERS)
+BUFFER_SIZE = 1 << 20
+
+
+def select(columns, keep):
+    "the rows of the pointColumns chunk columns where keep (a bool array) is set"
+    rows = keep.nonzero()[0].tolist()
+    return { name: [ values[i] for i in rows ] for name, values in columns.items() }
+
+
+def export(points, base, formats, start_time = None, trk_name = "exercise", tolerances = None, method = 'dp', chunk_size = 4096):
+    """
+    write the points (a TrackArray or GPSPoints) to base.<format>
+    for every format of formats. tolerances: for simplify, in m by format,
+    none or 0 for every point. Returns the file names, none for a track
+    without points
+    """
+    for f in formats:
+        if f not in gpshelper.WRITERS:
+            raise ValueError(f"unknown export format {f}, use some of {FORMATS}")
+    if not isinstance(points, gpshelper.TrackArray):
+        points = list(points)
+    if not len(points):
+        return []
+    if start_time is None:
+        start_time = points[0].time
+
+    masks = {}
+    for f in formats:
+        tolerance = (tolerances or {}).get(f)
+        if tolerance:
+            if isinstance(points, gpshelper.TrackArray):
+                masks[f] = simplify.simplifyMask(points.latitude, points.longitude, tolerance, method)
+            else:
+                masks[f] = simplify.simplifyMask([ p.latitude for p in points ], [ p.longitude for p in points ], tolerance, method)
+
+    files = { f: f"{base}.{f}" for f in formats }
+    with contextlib.ExitStack() as stack:
+        writers = { f: gpshelper.WRITERS[f](stack.enter_context(open(name, "w", buffering = BUFFER_SIZE)), start_time, trk_name)
+                    for f, name in files.items() }
+        first = 0
+        for columns in gpshelper.pointColumns(points, chunk_size):
+            count = len(columns['time'])
+            for f, writer in writers.items():
+                writer.write(select(columns, masks[f][first:first + count]) if f in masks else columns)
+            first += count
+        for writer in writers.values():
+            writer.close()
+    return list(files.values())
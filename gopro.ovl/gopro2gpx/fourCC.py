@@ -9,6 +9,8 @@
 import collections
 import copy
 from datetime import datetime
+import functools
+import re
 import struct
 
 maptype = { 'c': 'c',
@@ -20,7 +22,14 @@ maptype = { 'c': 'c',
 			'l': 'l',
 			'B': 'B',
 			'f': 'f',
-			'J': 'Q'
+			'J': 'Q',
+			'j': 'q',
+			'b': 'b',
+			'd': 'd',
+			'F': '4s',
+			'G': '16s',
+			'q': 'l',
+			'Q': 'q'
 	}
 
 
@@ -31,11 +40,35 @@ def map_type(type):
 	return(ctype)
 
 
+# bound of the caches below, the formats and labels of a file are a few dozens.
+# The decoders are cached by label (labelDecoder), the struct formats of the
+# records apart, by format string (compiled, type_format): records with the
+# same label but another type, size, repeat or TYPE share the decoder and
+# only look up their format
+CACHE_SIZE = 256
+
+
+@functools.lru_cache(maxsize = CACHE_SIZE)
+def compiled(fmt):
+	"the struct.Struct for fmt, built once"
+	return struct.Struct(fmt)
+
+
+@functools.lru_cache(maxsize = CACHE_SIZE)
+def type_format(typedef):
+	"""
+	struct format of a complex TYPE definition, like 'JlllSSSSBB' or 'f[4]L'
+	"""
+	typedef = re.sub(r'(.)\[(\d+)\]', lambda m: m.group(1) * int(m.group(2)), typedef)
+	return '>' + "".join([map_type(ord(x)) for x in typedef ])
+
+
 XYZData = collections.namedtuple('XYZData', "y x z")
 UNITData = collections.namedtuple("UNITData", "lat lon alt speed speed3d")
 KARMAUNIT10Data = collections.namedtuple("KARMAUNIT10Data", "A  Ah J degC V1 V2 V3 V4 s p1")
 KARMAUNIT15Data = collections.namedtuple("KARMAUNIT15Data", "A  Ah J degC V1 V2 V3 V4 s p1 e1 e2 e3 e4 p2")
 GPSData = collections.namedtuple("GPSData", "lat lon alt speed speed3d")
+GPS9Data = collections.namedtuple("GPS9Data", "lat lon alt speed speed3d days secs dop fix")
 KARMAGPSData = collections.namedtuple("KARMAGPSData", "tstamp lat lon alt speed speed3d unk1 unk2 unk3 unk4")
 SYSTData = collections.namedtuple("SYSTData", "seconds miliseconds")
 
@@ -49,7 +82,7 @@ class LabelBase:
 		if not klvdata.rawdata:
 			return None
 		stype = map_type(klvdata.type)
-		s = struct.Struct('>' + stype)
+		s = compiled('>' + stype)
 		data, = s.unpack_from(klvdata.rawdata)
 		return(data)
 
@@ -62,7 +95,7 @@ class LabelEmpty(LabelBase):
 	def Build(self, klvdata):
 		if not klvdata.rawdata:
 			return None
-		return klvdata.rawdata[0:10]
+		return bytes(klvdata.rawdata[0:10])
 
 
 class Label_TypecString(LabelBase):
@@ -72,7 +105,7 @@ class Label_TypecString(LabelBase):
 		LabelBase.__init__(self)
 
 	def Build(self, klvdata):
-		return(klvdata.rawdata.decode('utf-8', errors = 'replace').strip('\0'))
+		return(str(klvdata.rawdata, 'utf-8', errors = 'replace').strip('\0'))
 
 
 class Label_TypeUTimeStamp(LabelBase):
@@ -81,9 +114,15 @@ class Label_TypeUTimeStamp(LabelBase):
 	def __init__(self):
 		LabelBase.__init__(self)
 
+	pattern = re.compile(r'(\d\d)(\d\d)(\d\d)(\d\d)(\d\d)(\d\d)\.(\d{1,6})')
+
 	def Build(self, klvdata):
-		s = klvdata.rawdata.decode('utf-8', errors = 'replace')
-		# 'yymmddhhmmss.ffffff'
+		s = str(klvdata.rawdata, 'utf-8', errors = 'replace')
+		# 'yymmddhhmmss.ffffff', without strptime for the usual form
+		m = self.pattern.fullmatch(s)
+		if m:
+			f = [ int(x) for x in m.groups() ]
+			return datetime(f[0] + (2000 if f[0] < 69 else 1900), f[1], f[2], f[3], f[4], f[5], int(m.group(7).ljust(6, '0')))
 		fmt = '%y%m%d%H%M%S.%f'
 		return datetime.strptime(s, fmt)
 
@@ -100,6 +139,15 @@ class LabelTSMP(LabelBase):
 		LabelBase.__init__(self)
 
 
+class LabelSTMP(LabelBase):
+	"""
+	microsecond timestamp of the first sample of the payload
+	"""
+
+	def __init__(self):
+		LabelBase.__init__(self)
+
+
 class LabelDVNM(Label_TypecString):
 
 	def __init__(self):
@@ -134,7 +182,7 @@ class LabelSCAL(LabelBase):
 		# if more than 1 item in repeat, return a list (GPS data)
 		stype = map_type(klvdata.type)
 		fmt = '>' + stype * klvdata.repeat
-		s = struct.Struct(fmt)
+		s = compiled(fmt)
 		data = s.unpack_from(klvdata.rawdata)
 		return(data)
 
@@ -150,7 +198,7 @@ class LabelXYZData(LabelBase):
 
 		# we need to process the SCAL value to measure properly the DATA
 		stype = map_type(klvdata.type)
-		s = struct.Struct('>' + stype * 3)
+		s = compiled('>' + stype * 3)
 		data = XYZData._make(s.unpack_from(klvdata.rawdata))
 		return(data)
 
@@ -231,7 +279,7 @@ class LabelUNIT(LabelBase):
 		# 5 fields of length 3
 		stype = map_type(klvdata.type)
 		fmt = '>' + ((str(klvdata.size) + 's') * klvdata.repeat)
-		s = struct.Struct(fmt)
+		s = compiled(fmt)
 		data_tuple = s.unpack_from(klvdata.rawdata)
 
 		# if len(data_tuple) ==15:
@@ -263,16 +311,40 @@ class LabelGPS5(LabelBase):
 			# empty point
 			data = [ GPSData(0, 0, 0, 0, 0) ]
 		else:
-			data = []
-			for r in range(klvdata.repeat):
-				stype = map_type(klvdata.type)
-				s = struct.Struct('>' + stype * 5)
-				data_item = GPSData._make(s.unpack_from(klvdata.rawdata[r * 4 * 5:(r + 1) * 4 * 5]))
-				data.append(data_item)
+			stype = map_type(klvdata.type)
+			s = compiled('>' + stype * 5)
+			data = [ GPSData._make(item) for item in s.iter_unpack(klvdata.rawdata[0:klvdata.repeat * s.size]) ]
+		return(data)
+
+
+class LabelComplex(LabelBase):
+	"""
+	complex type (?) payload, described by the TYPE record of its STRM.
+	One tuple per repeat
+	"""
+	default_type = None
+
+	def __init__(self):
+		LabelBase.__init__(self)
+
+	def record_struct(self, klvdata):
+		typedef = klvdata.typedef or self.default_type
+		if not typedef:
+			return None
+		return compiled(type_format(typedef))
+
+	def Build(self, klvdata):
+		s = self.record_struct(klvdata)
+		if not klvdata.rawdata or s is None or s.size != klvdata.size:
+			return None
+		data = list(s.iter_unpack(klvdata.rawdata[0:klvdata.repeat * s.size]))
+		if klvdata.repeat == 1:
+			return data[0]
 		return(data)
 
 
-class LabelGPRI(LabelBase):
+class LabelGPRI(LabelComplex):
+	default_type = 'JlllSSSSBB'
 
 	def __init__(self):
 		LabelBase.__init__(self)
@@ -287,27 +359,47 @@ class LabelGPRI(LabelBase):
 		GPRI ? 30 4 {b'\x00\x00\x00\x00\tI\xb4\xde\x13\xbe'} |b'\x00\x00\x00\x00\tI\xb4\xde\x13\xbe'| [
 
 		"""
-		karma_type = 'JlllSSSSBB'
-		s_karma_type = "".join([map_type(ord(x)) for x in karma_type ])
-
 		if not klvdata.rawdata:
 			# empty point
 			data = GPSData(0, 0, 0, 0, 0)
 		else:
-			stype = map_type(klvdata.type)
-			s = struct.Struct('>' + s_karma_type)
+			s = self.record_struct(klvdata)
+			if s.size != klvdata.size or len(klvdata.rawdata) < s.size:
+				# doesn't match its TYPE
+				return bytes(klvdata.rawdata[0:klvdata.size * klvdata.repeat])
 			data_tuple = s.unpack_from(klvdata.rawdata)
 			data = KARMAGPSData._make(data_tuple)
 		return(data)
 
 
-class LabelSYST(LabelBase):
+class LabelGPS9(LabelComplex):
+	"""
+	GPS 10Hz for HERO11+, with the time, precision and fix of every sample:
+	TYPE c 1 9 {lllllllSS}
+	SCAL l 4 9 {(10000000, 10000000, 1000, 1000, 100, 1, 1000, 100, 1)}
+	GPS9 ? 32 10: lat lon alt speed2d speed3d, days since 2000, seconds since
+	midnight, DOP x100, fix
+	"""
+	default_type = 'lllllllSS'
+
+	def __init__(self):
+		LabelComplex.__init__(self)
+
+	def Build(self, klvdata):
+		s = self.record_struct(klvdata)
+		if not klvdata.rawdata or s.size != klvdata.size:
+			return []
+		return [ GPS9Data._make(item) for item in s.iter_unpack(klvdata.rawdata[0:klvdata.repeat * s.size]) ]
+
+
+class LabelSYST(LabelComplex):
 	"""
 	UTC time and data from GPS, 1Hz n/a
 	"""
+	default_type = 'JJ'
 
 	def __init__(self):
-		Label_TypeUTimeStamp.__init__(self)
+		LabelComplex.__init__(self)
 
 	def Build(self, klvdata):
 		"""
@@ -320,11 +412,10 @@ class LabelSYST(LabelBase):
 		if not klvdata.rawdata:
 			data = SYSTData(0, 0)
 		else:
-			karma_type = 'JJ'
-			s_karma_type = "".join([map_type(ord(x)) for x in karma_type ])
-			stype = map_type(klvdata.type)
-
-			s = struct.Struct('>' + s_karma_type)
+			s = self.record_struct(klvdata)
+			if s.size != klvdata.size or len(klvdata.rawdata) < s.size:
+				# doesn't match its TYPE
+				return bytes(klvdata.rawdata[0:klvdata.size * klvdata.repeat])
 			data_tuple = s.unpack_from(klvdata.rawdata)
 			data = SYSTData._make(data_tuple)
 		return(data)
@@ -336,6 +427,12 @@ class LabelTMPC(LabelBase):
 		LabelBase.__init__(self)
 
 
+# labels that give the context of the data inside a STRM (scale, timing,
+# names, units, complex types). Kept when parsing only some fourCCs.
+context_labels = {
+	"STMP", "TSMP", "STNM", "SIUN", "UNIT", "SCAL", "TYPE", "ORIN", "ORIO", "MTRX", "TICK"
+}
+
 skip_labels = [
 	# "TIMO", "YAVG", "ISOE", "FACE", "SHUT", "WBAL", "WRGB", "UNIF", "FCNM",
 	# "FWVS", "KBAT", "ATTD",	"GLPI",	"VFRH",	"BPOS",	"ATTR",	"SIMU",	"ESCS",	"SCPR",	"LNED",	"CYTS",	"CSEN"
@@ -364,14 +461,14 @@ labels = {
 		"STNM": LabelSTNM,
 		"ISOG": LabelEmpty,
 		"SHUT": LabelEmpty,
-		"TYPE": LabelEmpty,
+		"TYPE": Label_TypecString,
 		"FACE": LabelEmpty,
 		"FCNM": LabelEmpty,
 		"ISOE": LabelEmpty,
 		"WBAL": LabelEmpty,
 		"WRGB": LabelEmpty,
 		"MAGN": LabelEmpty,
-		"STMP": LabelEmpty,
+		"STMP": LabelSTMP,
 		"STPS": LabelEmpty,
 		"SROT": LabelEmpty,
 		"TIMO": LabelEmpty,
@@ -438,15 +535,45 @@ labels = {
 		"DISP": LabelEmpty,  # Disparity track (360 modes)
 
 		# gopro 11
-		"GPS9": LabelEmpty
+		"GPS9": LabelGPS9
 }
 
 
+def unknown(klvdata):
+	return False
+
+
+@functools.lru_cache(maxsize = CACHE_SIZE)
+def instance(label):
+	"the one instance of the label class, they don't keep any state"
+	return label()
+
+
+@functools.lru_cache(maxsize = CACHE_SIZE)
+def labelDecoder(fourCC, typed):
+	"the Build method for fourCC, typed: a complex (?) payload with a TYPE"
+	label = labels.get(fourCC)
+	if label is None:
+		return unknown
+	if label is LabelEmpty and typed:
+		label = LabelComplex
+	return instance(label).Build
+
+
+def Decoder(klvdata):
+	"""
+	the Build method that decodes klvdata, from the registry. A complex (?)
+	payload of a label without its own decoder is read with its STRM TYPE
+	"""
+	return labelDecoder(klvdata.fourCC, klvdata.type == 0x3f and bool(klvdata.typedef))
+
+
 def Manage(klvdata):
-	if klvdata.fourCC in labels.keys():
-		return labels[klvdata.fourCC]().Build(klvdata)
-	else:
-		issue_url = "https://github.com/juanmcasillas/gopro2gpx/issues/new"
-		print("Warning. fourCC Label '%s' not found. Please summit a issue to: %s" % (klvdata.fourCC, issue_url))
-		return False
+	return Decoder(klvdata)(klvdata)
+
+
+def Report(fourCC):
+	"tell about a label without decoder, once per file (see gpmf.scanStream)"
+	issue_url = "https://github.com/juanmcasillas/gopro2gpx/issues/new"
+	print("Warning. fourCC Label '%s' not found. Please summit a issue to: %s" % (fourCC, issue_url))
 
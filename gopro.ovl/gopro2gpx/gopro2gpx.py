@@ -7,17 +7,120 @@
 # Released under GNU GENERAL PUBLIC LICENSE v3. (Use at your own risk)
 #
 
+import argparse
+import collections
+import collections.abc
+import concurrent.futures
 import datetime
+import json
+import os
 import sys
 
+import numpy as np
+
 from gpmf import goproovl
 
+from . import columnar
+from . import export
 from . import fourCC
 from . import gpmf
+from . import gpmfindex
+from . import gpmftree
 from . import gpshelper
+from . import mp4reader
+from . import simplify
+from . import telemetry
+from . import telemetrycache
+from . import timing
+
+# the labels read by BuildGPSPoints, besides the context ones (SCAL, TSMP...)
+# that scanStream keeps in every STRM it reads
+GPS_LABELS = { "DVNM", "TMPC", "GPSU", "GPSF", "GPS5", "GPS9", "SYST", "GPRI", "GPSP" }
+
+# the samples of one GPS5, GPS9 or GPRI payload, as columns: the scaled lat
+# lon alt speed speed3d (N x 5), if the sample is empty, its fix and dop (-1
+# when unknown), its time as datetime64[us] (NaT until gps5Times for GPS5),
+# the TMPC of the payload and the position of the record in the data
+GPSPayload = collections.namedtuple("GPSPayload", "values empty fix dop time tmpc record")
+
+# a GPS5/GPS9 speed over this (m/s) is a glitch
+SPEED_LIMIT = 35
+
+
+def gps5Payload(d, SCAL, GPSFIX, GPSP, TMPC, record):
+    "GPSPayload of the GPS5 record d (see telemetry.gps5Values), an empty payload holds one empty sample"
+    if d.rawdata:
+        raw, values = telemetry.gps5Values([ d ], [ d.repeat ], telemetry.scale(SCAL, 5)[None])
+    else:
+        raw = values = np.zeros((1, 5))
+    n = len(raw)
+    empty = (raw[:, 0] == 0) & (raw[:, 1] == 0) & (raw[:, 2] == 0)
+    time = np.full(n, np.datetime64('NaT'), dtype = 'datetime64[us]')
+    return GPSPayload(values, empty, np.full(n, GPSFIX), np.full(n, -1 if GPSP is None else GPSP), time, TMPC, record)
+
+
+def gps9Payload(d, SCAL, TMPC, record):
+    "GPSPayload of the GPS9 record d (see telemetry.gps9Values), no samples when it isn't lllllllSS"
+    n = d.repeat if d.rawdata and d.size == telemetry.GPS9_DTYPE.itemsize else 0
+    records, values, time = telemetry.gps9Values([ d ], [ n ], telemetry.scale(SCAL, 9)[None])
+    empty = (records['lat'] == 0) & (records['lon'] == 0) & (records['alt'] == 0)
+    return GPSPayload(values, empty, records['fix'].astype(np.int64), records['dop'].astype(np.int64), time, TMPC, record)
+
+
+def filterGPS(columns, skip = True, skipDop = True, dopLimit = 500):
+    """
+    apply the filters of BuildGPSPoints to the concatenated GPSPayload
+    columns, in the same order: empty, fix < 3, dop > dopLimit, speed over
+    SPEED_LIMIT. Returns the mask of the samples that pass them and the counts
+    """
+    empty = columns.empty
+    badfix = ~empty & (columns.fix < 3)
+    rejected = empty | badfix if skip else empty.copy()
+    baddop = ~rejected & (columns.dop > dopLimit)
+    if skipDop:
+        rejected |= baddop
+    badspeed = ~rejected & (columns.values[:, 3] > SPEED_LIMIT)
 
+    stats = {
+        'ok': int(np.count_nonzero(~rejected & ~badspeed)),
+        'badfix': int(np.count_nonzero(badfix)),
+        'badfixskip': int(np.count_nonzero(badfix)) if skip else 0,
+        'empty': int(np.count_nonzero(empty)),
+        'baddop': int(np.count_nonzero(baddop)),
+        'baddopskip': int(np.count_nonzero(baddop)) if skipDop else 0,
+        'badspeep': int(np.count_nonzero(badspeed))
+    }
+    return ~rejected & ~badspeed, stats
 
-def BuildGPSPoints(data, skip = True, skipDop = True, dopLimit = 500):
+
+def gps5Times(payloads, gps5, track = None):
+    """
+    set the time of the GPS5 samples: every sample on the clock of the
+    telemetry (see timing: MP4 sample table, STMP and TSMP), moved to UTC
+    by the line fitted on the GPSU of the payloads. gps5 holds the (position
+    in payloads, offset, sample count, STMP, TSMP, DEVC number, GPSU) of each
+    GPS5 payload
+    """
+    positions, offsets, counts, stmp, tsmp, devc, gpsu = zip(*gps5)
+    counts = np.array(counts, dtype = np.int64)
+    starts = timing.payloadStarts(offsets, stmp, devc, track)
+    duration = track.durations[timing.mp4Samples(offsets[-1:], track)[0]] if track is not None else None
+    clock = timing.sampleClock(starts, timing.sampleNumbers(counts, tsmp), counts, duration)
+
+    utc = np.array([ np.datetime64('NaT') if u is None else np.datetime64(u, 'us') for u in gpsu ], dtype = 'datetime64[us]')
+    a, b = timing.utcFit(starts, utc)
+    if np.isnan(a).all():
+        # no GPSU, no time
+        return
+    payload = np.repeat(np.arange(len(counts)), counts)
+    us = np.round(a[payload] + b[payload] * clock * 1e6).astype(np.int64).astype('datetime64[us]')
+    first = np.cumsum(counts) - counts
+    for i, position in enumerate(positions):
+        if counts[i]:
+            payloads[position] = payloads[position]._replace(time = us[first[i]:first[i] + counts[i]])
+
+
+def BuildGPSPoints(data, skip = True, skipDop = True, dopLimit = 500, track = None, anchor = None):
     """
     Data comes UNSCALED so we have to do: Data / Scale.
     Do a finite state machine to process the labels.
@@ -27,25 +130,23 @@ def BuildGPSPoints(data, skip = True, skipDop = True, dopLimit = 500):
      - GPSU     GPS Time
      - GPS5     GPS Data
      - GPSP     GPS Precision
+     - GPS9     GPS Data with time, precision and fix of each sample (HERO11+).
+                When present, GPS5 is ignored
+    The state machine only runs once per payload; the samples of all the
+    payloads are filtered at once, as columns (see filterGPS).
+    The GPS5 samples are timed by STMP/TSMP, or the MP4 sample table of the
+    gpmd track when given (mp4reader.MetadataTrack), see gps5Times
+    Returns the points as a gpshelper.TrackArray, the start time and the
+    device name. If anchor is a list, the record the start time was read
+    from (GPSU, or the GPS9 of the first point) is added to it
     """
 
-    points = []
     start_time = None
     SCAL = fourCC.XYZData(1.0, 1.0, 1.0)
     GPSU = None
     TMPC = None
     SYST = fourCC.SYSTData(0, 0)
 
-    stats = {
-        'ok': 0,
-        'badfix': 0,
-        'badfixskip': 0,
-        'empty': 0,
-        'baddop': 0,
-        'baddopskip': 0,
-        'badspeep': 0
-    }
-
     # GPSP is 100x DoP
     # https://en.wikipedia.org/wiki/Dilution_of_precision_(navigation)
     # Default value is 9999 (no lock). GoPro say that under 500 is good.
@@ -59,9 +160,16 @@ def BuildGPSPoints(data, skip = True, skipDop = True, dopLimit = 500):
 
     GPSP = None  # no lock
     GPSFIX = 0  # no lock.
+    STMP = -1
     TSMP = 0
+    DEVC = -1
     DVNM = "Unknown"
-    for d in data:
+    has_gps9 = any(d.fourCC == 'GPS9' for d in data)
+    payloads = []
+    gps5 = []
+    start_record = None
+    karma = { 'empty': 0, 'badfix': 0, 'badfixskip': 0 }
+    for i, d in enumerate(data):
         if d.fourCC == 'SCAL':
             SCAL = d.data
         elif d.fourCC == "DVNM":
@@ -73,143 +181,467 @@ def BuildGPSPoints(data, skip = True, skipDop = True, dopLimit = 500):
             goproovl.print_log(f"GPSU {d.data}")
             if start_time is None:
                 start_time = GPSU
+                start_record = i
         elif d.fourCC == 'GPSF':
             if d.data != GPSFIX:
                 goproovl.print_log("GPSFIX change to %s [%s]" % (d.data, fourCC.LabelGPSF.xlate[d.data]))
             GPSFIX = d.data
 
+        elif d.fourCC == 'DEVC':
+            DEVC += 1
+        elif d.fourCC == 'STRM':
+            STMP = -1
+            TSMP = 0
+        elif d.fourCC == 'STMP':
+            STMP = d.data
         elif d.fourCC == 'TSMP':
-            if TSMP == 0:
-                TSMP = d.data
-            else:
-                TSMP = d.data - TSMP
-
-        elif d.fourCC == 'GPS5':
-            # we have to use the REPEAT value.
-            # gopro has a 18 Hz sample of writting the GPS5 value, so use it to compute delta
-            # goproovl.print_log("len", len(d.data))
-            t_delta = 1 / len(d.data)
-            sample_count = 0
-            for item in d.data:
-
-                if item.lon == item.lat == item.alt == 0:
-                    goproovl.print_log("Warning: Skipping empty point")
-                    stats['empty'] += 1
-                    continue
-
-                if GPSFIX < 3:
-                    stats['badfix'] += 1
-                    if skip:
-                        goproovl.print_log("Warning: Skipping point due GPSFIX<3")
-                        stats['badfixskip'] += 1
-                        continue
+            TSMP = d.data
 
-                if GPSP is not None and GPSP > dopLimit:
-                    stats["baddop"] += 1
-                    if skipDop:
-                        goproovl.print_log("Warning: skipping point due to GPSP>limit. GPSP: %s, limit: %s" % (GPSP, dopLimit))
-                        stats["baddopskip"] += 1
-                        continue
-
-                retdata = [ float(x) / float(y) for x, y in zip(item._asdict().values() , list(SCAL)) ]
-
-                gpsdata = fourCC.GPSData._make(retdata)
-                if gpsdata.speed > 35:
-                    stats["badspeep"] += 1
-                    goproovl.print_log(f"Warning: Skipping point due to speed {gpsdata.speed} > 35 m/s")
-                    continue
+        elif d.fourCC == 'GPS5' and not has_gps9:
+            # gopro has a 18 Hz sample of writting the GPS5 value, timed
+            # after the loop, with all the payloads
+            gps5.append((len(payloads), d.offset, d.repeat if d.rawdata else 0, STMP, TSMP, max(DEVC, 0), GPSU))
+            payloads.append(gps5Payload(d, SCAL, GPSFIX, GPSP, TMPC, i))
 
-                p = gpshelper.GPSPoint(gpsdata.lat, gpsdata.lon, gpsdata.alt, GPSU + datetime.timedelta(seconds = sample_count * t_delta), gpsdata.speed, TMPC, GPSP)
-                if points and p.time < points[-1].time:
-                    goproovl.print_log(f"Warning: p.time < points[-1].time {p.time} < {points[-1].time}  len(points): {len(points)}")
-                else:
-                    points.append(p)
-                stats['ok'] += 1
-                sample_count += 1
+        elif d.fourCC == 'GPS9':
+            payloads.append(gps9Payload(d, SCAL, TMPC, i))
 
         elif d.fourCC == 'SYST':
-            data = [ float(x) / float(y) for x, y in zip(d.data._asdict().values() , list(SCAL)) ]
-            if data[0] != 0 and data[1] != 0:
-                SYST = fourCC.SYSTData._make(data)
+            if isinstance(d.data, bytes):
+                # doesn't match its TYPE, see fourCC.LabelSYST
+                continue
+            scaled = [ float(x) / float(y) for x, y in zip(d.data._asdict().values() , list(SCAL)) ]
+            if scaled[0] != 0 and scaled[1] != 0:
+                SYST = fourCC.SYSTData._make(scaled)
 
         elif d.fourCC == 'GPRI':
-            # KARMA GPRI info
+            # KARMA GPRI info, one sample per record
 
+            if isinstance(d.data, bytes):
+                # doesn't match its TYPE, see fourCC.LabelGPRI
+                continue
             if d.data.lon == d.data.lat == d.data.alt == 0:
-                goproovl.print_log("Warning: Skipping empty point")
-                stats['empty'] += 1
+                karma['empty'] += 1
                 continue
 
             if GPSFIX == 0:
-                stats['badfix'] += 1
+                karma['badfix'] += 1
                 if skip:
-                    goproovl.print_log("Warning: Skipping point due GPSFIX==0")
-                    stats['badfixskip'] += 1
+                    karma['badfixskip'] += 1
                     continue
 
-            data = [ float(x) / float(y) for x, y in zip(d.data._asdict().values() , list(SCAL)) ]
-            gpsdata = fourCC.KARMAGPSData._make(data)
+            scaled = [ float(x) / float(y) for x, y in zip(d.data._asdict().values() , list(SCAL)) ]
+            gpsdata = fourCC.KARMAGPSData._make(scaled)
 
             if SYST.seconds != 0 and SYST.miliseconds != 0:
-                goproovl.print_log("XX", SYST.miliseconds)
-                p = gpshelper.GPSPoint(gpsdata.lat, gpsdata.lon, gpsdata.alt, datetime.fromtimestamp(SYST.miliseconds), gpsdata.speed)
-                points.append(p)
-                stats['ok'] += 1
+                time = np.datetime64(datetime.datetime.fromtimestamp(SYST.miliseconds), 'us')
+                payloads.append(GPSPayload(np.array([ gpsdata[1:6] ]), np.zeros(1, dtype = bool), np.full(1, 3), np.full(1, -1),
+                                           np.full(1, time), TMPC, i))
 
         elif d.fourCC == 'GPSP':
             if GPSP != d.data:
                 goproovl.print_log("GPSP change to %s [%s]" % (d.data, fourCC.LabelGPSP.xlate(d.data)))
             GPSP = d.data
 
+    if gps5:
+        gps5Times(payloads, gps5, track)
+    counts = np.array([ len(p.empty) for p in payloads ], dtype = np.int64)
+    columns = GPSPayload(
+        np.concatenate([ p.values for p in payloads ]) if payloads else np.empty((0, 5)),
+        np.concatenate([ p.empty for p in payloads ] + [ np.empty(0, dtype = bool) ]),
+        np.concatenate([ p.fix for p in payloads ] + [ np.empty(0, dtype = np.int64) ]),
+        np.concatenate([ p.dop for p in payloads ] + [ np.empty(0, dtype = np.int64) ]),
+        np.concatenate([ p.time for p in payloads ] + [ np.empty(0, dtype = 'datetime64[us]') ]),
+        np.repeat([ np.nan if p.tmpc is None else p.tmpc for p in payloads ], counts),
+        np.repeat([ p.record for p in payloads ], counts))
+
+    # no GPSU at all, no time for the GPS5 samples
+    notime = np.isnat(columns.time)
+    columns = columns._replace(empty = columns.empty | notime)
+    passed, stats = filterGPS(columns, skip, skipDop, dopLimit)
+    for key, count in karma.items():
+        stats[key] += count
+
+    times = columns.time[passed].astype(np.int64)
+    if has_gps9 and passed.any():
+        # the first GPS9 time, unless a GPSU came before it
+        first = np.argmax(passed)
+        if start_record is None or start_record > columns.record[first]:
+            start_time = times[0].astype('datetime64[us]').item()
+            start_record = int(columns.record[first])
+    if anchor is not None and start_time is not None and start_record is not None:
+        anchor.append(data[start_record])
+
+    # drop the samples going back in time
+    forward = times >= np.maximum.accumulate(np.concatenate([ times[0:1], times[:-1] ]))
+    stats['badtime'] = int(np.count_nonzero(~forward))
+    dop = columns.dop[passed][forward].astype(np.float32)
+    dop[dop < 0] = np.nan
+    values = columns.values[passed][forward]
+    points = gpshelper.TrackArray(times[forward].astype('datetime64[us]'), values[:, 0], values[:, 1], values[:, 2], values[:, 3],
+                                  columns.tmpc[passed][forward], dop)
+
     goproovl.print_log("-- stats -----------------")
     total_points = 0
     for i in stats.keys():
-        total_points += stats[i]
+        if i != 'badtime':
+            total_points += stats[i]
     goproovl.print_log("Device: %s" % DVNM)
     goproovl.print_log("- Ok:              %5d" % stats['ok'])
     goproovl.print_log("- GPSFIX=0 (bad):  %5d (skipped: %d)" % (stats['badfix'], stats['badfixskip']))
     goproovl.print_log("- GPSP>%4d (bad): %5d (skipped: %d)" % (dopLimit, stats['baddop'], stats['baddopskip']))
+    goproovl.print_log("- Speed>%d (bad):   %5d" % (SPEED_LIMIT, stats['badspeep']))
+    goproovl.print_log("- Time back (ok):  %5d (skipped)" % stats['badtime'])
     goproovl.print_log("- Empty (No data): %5d" % stats['empty'])
     goproovl.print_log("Total points:      %5d" % total_points)
     goproovl.print_log("--------------------------")
     return(points, start_time, DVNM)
 
 
-def main_core(gopro_binary, input_file, out_file_base, lfd):
-    points = []
-    start_time = None
-    goproovl.lfd = lfd
+def exportPoints(points, out_file_base, formats, start_time, trk_name, tolerances, method):
+    "the points to out_file_base/gpmf.<format> for the formats, see export"
+    for name in export.export(points, f"{out_file_base}/gpmf", formats, start_time, trk_name, tolerances, method):
+        goproovl.print_log(f"Wrote {name}")
 
-    data = gpmf.parseStream(gopro_binary, 0)
 
-    with open(f"{out_file_base}/gpmf.klv", "w") as fd:
-        for row in data:
-            fd.write(str(row) + "\n")
+def parseTelemetry(gopro_binary, filename):
+    """
+    the records of the GPS track (GPS_LABELS) in the telemetry gopro_binary
+    of filename: bytes, a map, or chunks of them (see gpmf.parseChunks).
+    Damaged parts are skipped, and logged
+    """
+    skipped = []
+    if isinstance(gopro_binary, collections.abc.Iterator):
+        data = [ klv for block in gpmf.parseChunks(gopro_binary, 0, GPS_LABELS, skipped) for klv in block ]
+    else:
+        data = gpmf.parseStream(gopro_binary, 0, GPS_LABELS, skipped = skipped)
+    for start, stop in skipped:
+        goproovl.print_log(f"Warning: damaged telemetry in {filename}, skipped bytes {start}-{stop} ({stop - start} bytes)")
+    return data
+
+
+def convertTelemetry(data, gopro_binary, track, base, formats = ('kml',), tolerances = None, method = 'dp', telemetry_formats = (),
+                     klv_dump = False, klv_index = False, telemetry_base = None, binary_file = None):
+    """
+    GPS points of the records data (see parseTelemetry) of the telemetry
+    gopro_binary, written to base.<format> for the formats (see export), its
+    streams to telemetry_base (default base) in the telemetry_formats (see
+    columnar). klv_index saves the telemetry as base.bin, unless it is the
+    file binary_file already, and the gpmfindex of its records as base.idx.
+    klv_dump writes the records as text in base.klv (large and slow, for
+    debugging). gopro_binary None: binary_file is mapped if needed. track is
+    the sample table of the MP4 of the telemetry, None without one.
+    Returns the names of the files written, the points and the UTC time of
+    the first frame of the video (the time of the first point without
+    track), None without points
+    """
+    files = []
+    if gopro_binary is None and (telemetry_formats or klv_index):
+        gopro_binary = gpmf.GpmfFileReader(None).mapRawTelemetryFromBinary(binary_file)
+    if klv_index:
+        path = f"{base}.bin"
+        if binary_file is None or not os.path.exists(path) or not os.path.samefile(binary_file, path):
+            # gpmfindex looks for the telemetry next to its index
+            with open(path, "wb") as fd:
+                fd.write(gopro_binary)
+            files.append(path)
+        gpmfindex.writeIndex(gpmfindex.indexPath(path), gpmfindex.buildIndex(gopro_binary, skipped = []), gpmfindex.sourceStamp(path))
+        files.append(gpmfindex.indexPath(path))
+    if klv_dump:
+        with open(f"{base}.klv", "w") as fd:
+            for row in data:
+                fd.write(str(row) + "\n")
+        files.append(f"{base}.klv")
+
+    anchor = []
+    points, start_time, device_name = BuildGPSPoints(data, track = track, anchor = anchor)
+    if telemetry_formats:
+        tree = gpmftree.buildTree(gopro_binary, skipped = [])
+        files += columnar.exportTelemetry(tree, telemetry_base or base, telemetry_formats, track)
+    if len(points) == 0:
+        return files, points, None
+
+    files += export.export(points, base, formats, start_time, device_name, tolerances, method)
+    if track is not None and anchor:
+        # the overlay starts with the video, not with the first GPS time
+        start_time = videoStart(start_time, anchor[0], track)
+    return files, points, start_time
 
-    points, start_time, device_name = BuildGPSPoints(data)
 
+def main_core(gopro_binary, input_file, out_file_base, lfd, formats = ('kml',), tolerances = None, method = 'dp', telemetry_formats = (),
+              klv_dump = False, klv_index = False):
+    """
+    GPS points of the telemetry gopro_binary of input_file: bytes, or the
+    chunks goproovl.read_metadata saves to out_file_base/gpmf.bin as they
+    are read. Written to out_file_base/gpmf.<format> and the streams to
+    out_file_base/telemetry, see convertTelemetry.
+    Returns the points and the UTC time of the first frame of the video, on
+    the clock of its gpmd track (the time of the first point without it)
+    """
+    goproovl.lfd = lfd
+    data = parseTelemetry(gopro_binary, input_file)
+    binary_file = None
+    if isinstance(gopro_binary, collections.abc.Iterator):
+        gopro_binary, binary_file = None, f"{out_file_base}/gpmf.bin"
+
+    # the telemetry is the gpmd track of input_file, its samples in order
+    track = mp4reader.readSampleTable(input_file)
+    files, points, start_time = convertTelemetry(data, gopro_binary, track, f"{out_file_base}/gpmf", formats, tolerances, method,
+                                                 telemetry_formats, klv_dump, klv_index, f"{out_file_base}/telemetry", binary_file)
+    for name in files:
+        goproovl.print_log(f"Wrote {name}")
     if len(points) == 0:
-        goproovl.print_log(f"Can't create file. No GPS info in {input_file}. Exitting")
-        sys.exit(0)
+        goproovl.print_log(f"Can't create file. No GPS info in {input_file}")
+    return points, start_time
+
+
+def videoStart(start_time, anchor, track):
+    """
+    UTC time of the first frame of the video: start_time, read from the
+    anchor record (see BuildGPSPoints), minus the time of the MP4 sample
+    of track holding that record
+    """
+    sample = timing.mp4Samples([ anchor.offset ], track)[0]
+    return start_time - datetime.timedelta(seconds = float(track.times[sample]))
+
+
+def readChapter(filename, cache = None):
+    """
+    GPS points of the whole chapter (GHxx file), read straight from the MP4,
+    the UTC time of its first frame and its video duration.
+    With a telemetrycache.TelemetryCache they come from it when the file is
+    cached, else the decoded telemetry is stored there with them
+    """
+    if cache is not None:
+        columns = cache.load(filename)
+        if columns is not None:
+            goproovl.print_log(f"Telemetry of {filename} read from the cache")
+            video_start = None if np.isnat(columns['video_start']) else columns['video_start'].item()
+            return gpshelper.TrackArray.fromColumns(columns), video_start, float(columns['duration'])
+
+    gopro_binary, track = mp4reader.readTelemetry(filename)
+    if gopro_binary is None:
+        goproovl.print_log(f"No GPS info in {filename}")
+        return gpshelper.TrackArray(), None, 0
+    duration = float(track.times[-1] + track.durations[-1]) if len(track.times) else 0
+
+    skipped = []
+    data = gpmf.parseStream(gopro_binary, 0, GPS_LABELS, skipped = skipped)
+    for start, stop in skipped:
+        goproovl.print_log(f"Warning: damaged telemetry in {filename}, skipped bytes {start}-{stop}")
+    anchor = []
+    points, start_time, device_name = BuildGPSPoints(data, track = track, anchor = anchor)
+
+    video_start = None
+    if points and not anchor:
+        goproovl.print_log(f"No GPS time (GPSU, GPS9) in {filename}, its points are left out")
+        points = gpshelper.TrackArray()
+    elif points:
+        video_start = videoStart(start_time, anchor[0], track)
+
+    if cache is not None:
+        columns = telemetry.decodeAll(gpmftree.buildTree(gopro_binary, skipped = []), track)
+        columns.update(points.columns())
+        columns['video_start'] = np.array(video_start or 'NaT', dtype = 'datetime64[us]')
+        columns['duration'] = np.array(duration)
+        cache.store(filename, columns)
+
+    return points, video_start, duration
+
+
+def chapterPoints(filename, begin = 0, end = 0, cache_dir = None):
+    """
+    GPS points of one chapter between begin and end seconds of its video
+    (end 0: up to the end). Runs in a worker process of submitChapters.
+    Returns the points, the UTC time of the first frame and the video duration
+    """
+    cache = telemetrycache.TelemetryCache(cache_dir) if cache_dir else None
+    points, video_start, duration = readChapter(filename, cache)
+    if not points:
+        return points, None, duration
+
+    keep = points.time >= np.datetime64(video_start + datetime.timedelta(seconds = begin))
+    if end:
+        keep &= points.time < np.datetime64(video_start + datetime.timedelta(seconds = end))
+    return points[keep], video_start, duration
 
-    kml = gpshelper.generate_KML(points)
-    with open(f"{out_file_base}/gpmf.kml", "w") as fd:
-        fd.write(kml)
 
-    # csv = gpshelper.generate_CSV(points)
-    # with open("%s.csv" % config.outputfile , "w+") as fd:
-    #    fd.write(csv)
-    #
-    # gpx = gpshelper.generate_GPX(points, start_time, trk_name = device_name)
-    # with open(f"{out_file_base}/gpmf.gpx", "w") as fd:
-    #     fd.write(gpx)
+def submitChapters(executor, chapters, cache_dir = None):
+    "start chapterPoints of every (filename, begin, end) of chapters in executor"
+    return [ executor.submit(chapterPoints, filename, begin, end, cache_dir) for filename, begin, end in chapters ]
+
+
+def stitchChapters(chapters, results):
+    """
+    put the points of the chapters on the timeline of the video made by
+    concatenating their [begin, end) parts: a chapter starts where the
+    previous one ends
+    """
+    tracks = []
+    start_time = None
+    offset = 0
+    for (filename, begin, end), (chapter_points, video_start, duration) in zip(chapters, results):
+        if video_start is not None:
+            if start_time is None:
+                start_time = video_start + datetime.timedelta(seconds = begin)
+            shift = start_time + datetime.timedelta(seconds = offset - begin) - video_start
+            if shift:
+                goproovl.print_log(f"{filename}: shifting points {shift.total_seconds():.3f} s to the concatenated timeline")
+            tracks.append(chapter_points.shift(shift))
+        offset += (min(end, duration) if end else duration) - begin
+    return gpshelper.TrackArray.concatenate(tracks), start_time
+
+
+def main_chapters(chapters, futures, out_file_base, lfd, formats = ('kml',), tolerances = None, method = 'dp'):
+    """
+    as main_core, with the points of every chapter read in parallel (see
+    submitChapters) instead of the telemetry of the concatenated video
+    """
+    goproovl.lfd = lfd
+    try:
+        results = [ f.result() for f in futures ]
+    except BaseException:
+        # don't wait for the chapters left
+        for f in futures:
+            f.cancel()
+        raise
+    points, start_time = stitchChapters(chapters, results)
+
+    if len(points) == 0:
+        goproovl.print_log(f"Can't create file. No GPS info in {[ c[0] for c in chapters ]}")
+        return points, None
+
+    exportPoints(points, out_file_base, formats, start_time, "exercise", tolerances, method)
 
     return points, start_time
 
 
-def main():
-    main_core()
+def initWorker(log = None):
+    """
+    logs of a process converting files: to stderr, and to the file log. The
+    stdout of the command is left for the NDJSON points, so everything the
+    worker prints (print_log, the warnings of gpmf and fourCC) goes to stderr
+    """
+    sys.stdout = sys.stderr
+    goproovl.lfd = open(log or os.devnull, "a")
+
+
+def outputBases(filenames, outdir = None):
+    """
+    base of the output files of each file of filenames: its name without
+    extension, next to it or in outdir. In outdir, files with the same name
+    keep their path from the directory common to all the files
+    (100GOPRO/GX010001, 101GOPRO/GX010001)
+    """
+    if not outdir:
+        return [ os.path.splitext(f)[0] for f in filenames ]
+    names = [ os.path.splitext(os.path.basename(f))[0] for f in filenames ]
+    if len(set(names)) == len(names):
+        return [ os.path.join(outdir, name) for name in names ]
+    paths = [ os.path.abspath(f) for f in filenames ]
+    common = os.path.commonpath([ os.path.dirname(p) for p in paths ])
+    return [ os.path.join(outdir, os.path.splitext(os.path.relpath(p, common))[0]) for p in paths ]
+
+
+def convertFile(filename, base, formats, tolerance = 0, method = 'dp', telemetry_formats = (), klv_index = False, klv_dump = False, points_back = False):
+    """
+    GPS points of the MP4 video or telemetry file (.bin) filename, written
+    to base.<format> for the formats, see convertTelemetry. Runs in a worker
+    process of main. Returns the names of the files written, the number of
+    points and the points if points_back. Raises ValueError when filename
+    has no telemetry
+    """
+    os.makedirs(os.path.dirname(base) or os.curdir, exist_ok = True)
+    if os.path.splitext(filename)[1].lower() == '.bin':
+        gopro_binary = gpmf.GpmfFileReader(None).mapRawTelemetryFromBinary(filename)
+        track, binary_file = None, filename
+    else:
+        gopro_binary, track = mp4reader.readTelemetry(filename)
+        binary_file = None
+        if gopro_binary is None:
+            raise ValueError(f"no GoPro metadata track in {filename}")
+
+    data = parseTelemetry(gopro_binary, filename)
+    if not data:
+        raise ValueError(f"no GPMF telemetry in {filename}")
+    tolerances = { f: tolerance for f in formats }
+    files, points, _ = convertTelemetry(data, gopro_binary, track, base, formats, tolerances, method, telemetry_formats,
+                                        klv_dump, klv_index, binary_file = binary_file)
+    if len(points) == 0:
+        goproovl.print_log(f"No GPS points in {filename}")
+    return files, len(points), points if points_back else None
+
+
+# keys of the NDJSON points, besides file
+NDJSON_FIELDS = ('time', 'lat', 'lon', 'ele', 'speed', 'temp', 'dop')
+
+
+def writeNDJSON(fd, filename, points, chunk_size = 4096):
+    "the points as one JSON object per line, unknown values as null"
+    for columns in gpshelper.pointColumns(points, chunk_size):
+        lines = []
+        for values in zip(columns['time'], columns['latitude'], columns['longitude'], columns['elevation'],
+                          columns['speed'], columns['temperature'], columns['dop']):
+            row = dict(zip(NDJSON_FIELDS, values), file = filename)
+            lines.append(json.dumps({ k: None if v != v else v for k, v in row.items() }) + "\n")
+        fd.write("".join(lines))
+    fd.flush()
+
+
+def positive(text):
+    "argparse type of the counts: an int, 1 or more"
+    value = int(text)
+    if value < 1:
+        raise argparse.ArgumentTypeError(f"{text} is less than 1")
+    return value
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(prog = "python -m gopro2gpx", description = "GPS track and telemetry of GoPro videos, without the overlay video")
+    parser.add_argument("files", help = "MP4 videos or telemetry files (.bin)", nargs = "+")
+    parser.add_argument("-o", "--outdir", help = "output directory (default: the one of each file)")
+    parser.add_argument("-f", "--format", help = "formats of the tracks (default gpx), none with -f alone", nargs = "*", choices = export.FORMATS, default = [ 'gpx' ])
+    parser.add_argument("-t", "--tolerance", help = "simplify the tracks within this many m (default 0, every point)", type = float, default = 0.0)
+    parser.add_argument("--simplify", help = "simplification: Douglas-Peucker or Visvalingam-Whyatt", choices = simplify.METHODS, default = 'dp')
+    parser.add_argument("--telemetry", help = "binary columnar export of all the telemetry streams", nargs = "+", choices = columnar.FORMATS, default = [])
+    parser.add_argument("--index", help = "save the telemetry (.bin) and the index of its records (.idx), see gpmfindex", action = "store_true")
+    parser.add_argument("--klv", help = "write the telemetry records of the GPS track as text (.klv, large)", action = "store_true")
+    parser.add_argument("--ndjson", help = "write the points to stdout, one JSON object per line, all of a file once it is converted", action = "store_true")
+    parser.add_argument("-j", "--jobs", help = "files converted at the same time (default: the number of CPUs)", type = positive, default = os.cpu_count())
+    parser.add_argument("--log", help = "log file, besides stderr")
+    args = parser.parse_args(argv)
+    if columnar.unavailable(args.telemetry):
+        parser.error(f"--telemetry {' '.join(columnar.unavailable(args.telemetry))} needs pyarrow, which isn't installed")
+
+    bases = outputBases(args.files, args.outdir)
+    clashes = sorted({ f for f, base in zip(args.files, bases) if bases.count(base) > 1 })
+    if clashes:
+        parser.error(f"these files would be written over each other: {' '.join(clashes)}")
+
+    output = sys.stdout
+    options = (args.format, args.tolerance, args.simplify, args.telemetry, args.index, args.klv, args.ndjson)
+
+    failed = 0
+    log = goproovl.lfd
+    with open(args.log or os.devnull, "a") as goproovl.lfd:
+        try:
+            with concurrent.futures.ProcessPoolExecutor(max_workers = args.jobs, initializer = initWorker, initargs = (args.log,)) as executor:
+                futures = { executor.submit(convertFile, filename, base, *options): filename for filename, base in zip(args.files, bases) }
+                for future in concurrent.futures.as_completed(futures):
+                    filename = futures[future]
+                    try:
+                        files, count, points = future.result()
+                    except Exception as e:
+                        goproovl.print_log(f"{filename}: {type(e).__name__}: {e}", sys.stderr)
+                        failed += 1
+                        continue
+                    goproovl.print_log(f"{filename}: {count} points, {' '.join(files) or 'nothing written'}", sys.stderr)
+                    if points is not None:
+                        writeNDJSON(output, filename, points)
+        finally:
+            goproovl.lfd = log
+    return 1 if failed else 0
 
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
@@ -11,11 +11,13 @@
 #   https://docs.python.org/3/library/struct.html
 #   https://github.com/stilldavid/gopro-utils/blob/master/telemetry/reader.go
 
-import array
+import mmap
 import os
 import struct
 import sys
 
+from . import fourCC
+from . import mp4reader
 from . klvdata import KLVData
 
 
@@ -26,12 +28,22 @@ class GpmfFileReader:
         self.ffmtools = ffmpegtools
 
     def readRawTelemetryFromMP4(self, filename):
-        """read data the metadata track from video. Requires FFMPEG wrapper.
+        """read data the metadata track from video. The gpmd track is read straight from the file
+        (see mp4reader), the FFMPEG wrapper is only needed when it can't be found that way.
         """
 
         if not os.path.exists(filename):
             raise FileNotFoundError("Can't open %s" % filename)
 
+        metadata_raw, track = mp4reader.readTelemetry(filename)
+        if metadata_raw is not None:
+            if self.verbose:
+                print("Working on file %s gpmd track (%d samples)" % (filename, len(track.sizes)))
+            return metadata_raw
+
+        if self.ffmtools is None:
+            raise Exception("File %s doesn't have any metadata" % filename)
+
         track_number, info = self.ffmtools.getMetadataTrack(filename)
         if not track_number:
             raise Exception("File %s doesn't have any metadata" % filename)
@@ -58,20 +70,161 @@ class GpmfFileReader:
 
         return metadata_raw
 
+    def mapRawTelemetryFromBinary(self, filename):
+        """map the binary file in memory (read only) instead of reading it. The parser works on it
+        through memoryviews, so the data is read by the page cache and never copied.
+        Close the map once the records parsed from it are not used any more
+        """
+        if not os.path.exists(filename):
+            raise FileNotFoundError("Can't open %s" % filename)
+
+        if self.verbose:
+            print("Mapping binary file %s" % filename)
+
+        with open(filename, 'rb') as fd:
+            if os.fstat(fd.fileno()).st_size == 0:
+                return b''
+            metadata_raw = mmap.mmap(fd.fileno(), 0, access = mmap.ACCESS_READ)
+
+        return metadata_raw
+
 
-def parseStream(data_raw, verbose = 0):
+def streamHasLabel(view, offset, end, fourccs):
     """
-    main code that reads the points
+    look only at the headers of the records between offset and end (the
+    body of a STRM) and tell if any of them is one of fourccs (as bytes).
+    A damaged header tells yes: the STRM is scanned as a whole, and the
+    recovery of scanStream deals with it
     """
-    data = array.array('b')
-    data.frombytes(data_raw)
+    unpack = KLVData.header.unpack_from
+    while offset + 8 <= end:
+        key, type, size, repeat = unpack(view, offset)
+        if key in fourccs or not validHeader(key, type, size, repeat, end - offset):
+            return True
+        offset += 8 + ((size * repeat + 3) & ~3)
+    return False
 
+
+# record types of the format, 0 is nested
+valid_types = frozenset(b'bBcdfFGjJlLqQsSU?') | { 0 }
+label_chars = frozenset(b'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789 ._')
+# biggest nested record taken as valid: a DEVC holds about a second of
+# telemetry, some tens of KB, a damaged header can claim up to 16 MB
+MAX_NESTED_SIZE = 1 << 22
+
+
+def validHeader(key, type, size, repeat, room):
+    """
+    check a header read from damaged telemetry: label and type that can
+    exist, and a payload that fits in room (bytes left in its container).
+    Nested records can only be DEVC or STRM, up to MAX_NESTED_SIZE
+    """
+    if type not in valid_types or not label_chars.issuperset(key):
+        return False
+    if type == 0:
+        return key in (b'DEVC', b'STRM') and size * repeat <= MAX_NESTED_SIZE
+    return 8 + ((size * repeat + 3) & ~3) <= room
+
+
+def scanStream(data_raw, fourccs = None, names = None, skipped = None, jumped = None):
+    """
+    walk the telemetry through a single memoryview, with the precompiled
+    header struct, without copying anything.
+    yields (offset, fourCC, type, size, repeat, payload) for every record,
+    nested ones (DEVC, STRM) included. payload is a memoryview slice of the
+    padded data, None for nested or empty records.
+    if fourccs is given, a STRM without any of them (context labels aside:
+    every STRM has them) is jumped over, and
+    inside the others only fourccs and the context labels are yielded. The
+    offsets of the STRMs jumped over are added to jumped, if a list.
+    names caches the decoded labels (unknown ones are reported when added),
+    pass the same dict to scan several parts of one file.
+    if skipped is a list, damaged telemetry is recovered: a bad header makes
+    the scan jump to the next DEVC label and the (start, end) of the bytes
+    left behind is added to skipped. A nested record cut by the end of the
+    data keeps the records that are complete.
+    """
+    view = memoryview(data_raw).cast('B')
+    unpack = KLVData.header.unpack_from
+    if names is None:
+        names = {}
+    end = len(view)
     offset = 0
+    strm_end = 0
+    if fourccs is not None:
+        keep = set(fourccs) | fourCC.context_labels
+        # every STRM has context labels, only the others tell what it carries
+        wanted = { f.encode() for f in set(fourccs) - fourCC.context_labels }
+    recover = skipped is not None
+    ends = [ end ]  # containers, only when recovering
+    find = None
+
+    while offset < end:
+        if recover:
+            while len(ends) > 1 and offset >= ends[-1]:
+                ends.pop()
+            if end - offset < 8 or not validHeader(*unpack(view, offset), ends[-1] - offset):
+                if find is None:
+                    find = data_raw.find if hasattr(data_raw, 'find') else bytes(view).find
+                found = find(b'DEVC', offset + 1)
+                if found < 0:
+                    found = end
+                skipped.append((offset, found))
+                offset = found
+                del ends[1:]
+                continue
+
+        key, type, size, repeat = unpack(view, offset)
+        name = names.get(key)
+        if name is None:
+            name = names[key] = key.decode()
+            if name not in fourCC.labels:
+                fourCC.Report(name)
+
+        offset_data = offset + 8
+        if type == 0:
+            # nested, the children follow the header
+            if recover:
+                ends.append(min(offset_data + size * repeat, ends[-1]))
+            if fourccs is not None and name == 'STRM':
+                strm_end = offset_data + size * repeat
+                if recover:
+                    strm_end = ends[-1]
+                if not streamHasLabel(view, offset_data, strm_end, wanted):
+                    if jumped is not None:
+                        jumped.append(offset)
+                    offset = strm_end
+                    continue
+            yield offset, name, type, size, repeat, None
+            offset = offset_data
+            continue
+
+        padded_length = (size * repeat + 3) & ~3
+        if fourccs is None or offset >= strm_end or name in keep:
+            payload = view[offset_data:offset_data + padded_length] if padded_length else None
+            yield offset, name, type, size, repeat, payload
+        offset = offset_data + padded_length
+
+
+def parseStream(data_raw, verbose = 0, fourccs = None, names = None, skipped = None):
+    """
+    main code that reads the points.
+    fourccs limits the records to these labels and the context of their
+    STRM (see scanStream). The payloads are decoded on first access to data.
+    Giving a skipped list recovers damaged telemetry (see scanStream)
+    """
     klvlist = []
+    typedef = None
 
-    while offset < len(data):
+    for record in scanStream(data_raw, fourccs, names, skipped):
 
-        klv = KLVData(data, offset)
+        klv = KLVData.fromScan(*record)
+        if klv.fourCC == 'STRM':
+            typedef = None
+        elif klv.fourCC == 'TYPE':
+            typedef = klv.data
+        elif klv.type == 0x3f:  # '?'
+            klv.typedef = typedef
         if not klv.skip():
             klvlist.append(klv)
             if verbose == 3:
@@ -83,9 +236,90 @@ def parseStream(data_raw, verbose = 0):
                 # unknown label
                 pass
 
-        offset += 8
-        if klv.type != 0:
-            offset += klv.padded_length
-            # print(">offset:%d length:%d padded:%d" % (offset, length, padded_length))
-
     return(klvlist)
+
+
+class StreamParser:
+    """
+    incremental parser: feed it the telemetry in chunks of any size (as read
+    from the ffmpeg pipe) and get the records of every complete top level
+    block (DEVC) as soon as its last byte arrives. Only the unfinished block
+    is buffered. The payloads of the returned records are copied out of the
+    buffer, so they don't keep it alive.
+    Giving a skipped list recovers damaged telemetry, as parseStream does.
+    """
+
+    def __init__(self, verbose = 0, fourccs = None, skipped = None):
+        self.verbose = verbose
+        self.fourccs = fourccs
+        self.skipped = skipped
+        self.buffer = bytearray()
+        self.consumed = 0
+        self.names = {}
+
+    def parseBlock(self, block, offset):
+        "records of block, found at offset of the buffer"
+        base = self.consumed + offset
+        skipped = None if self.skipped is None else []
+        klvlist = parseStream(block, self.verbose, self.fourccs, self.names, skipped)
+        for klv in klvlist:
+            klv.offset += base
+            if klv.rawdata is not None:
+                klv.rawdata = bytes(klv.rawdata)
+        if skipped:
+            self.skipped.extend((base + start, base + end) for start, end in skipped)
+        return klvlist
+
+    def feed(self, chunk):
+        "add chunk, yield the list of records of each block completed by it"
+        self.buffer += chunk
+        unpack = KLVData.header.unpack_from
+        buffer = self.buffer
+        offset = 0
+
+        while len(buffer) - offset >= 8:
+            key, type, size, repeat = unpack(buffer, offset)
+            if self.skipped is not None and (key != b'DEVC' or not validHeader(key, type, size, repeat, 8)):
+                # look for the next block, keep what can be the start of its label
+                found = buffer.find(b'DEVC', offset + 1)
+                if found < 0:
+                    found = len(buffer) - 3
+                self.skipped.append((self.consumed + offset, self.consumed + found))
+                offset = found
+                continue
+            length = 8 + ((size * repeat + 3) & ~3)
+            if len(buffer) - offset < length:
+                break
+            block = bytes(buffer[offset:offset + length])
+            yield self.parseBlock(block, offset)
+            offset += length
+
+        del buffer[:offset]
+        self.consumed += offset
+
+    def close(self):
+        """
+        the stream is over, tell if it was cut inside a block. Returns the
+        complete records of that block when recovering, else an empty list
+        """
+        klvlist = []
+        if self.buffer:
+            print("Warning, %d bytes of truncated telemetry at offset %d" % (len(self.buffer), self.consumed))
+            if self.skipped is not None:
+                klvlist = self.parseBlock(bytes(self.buffer), 0)
+            self.consumed += len(self.buffer)
+            self.buffer.clear()
+        return klvlist
+
+
+def parseChunks(chunks, verbose = 0, fourccs = None, skipped = None):
+    """
+    parse the telemetry given as an iterable of byte chunks, yield the list
+    of records of each block as soon as it is complete
+    """
+    parser = StreamParser(verbose, fourccs, skipped)
+    for chunk in chunks:
+        yield from parser.feed(chunk)
+    klvlist = parser.close()
+    if klvlist:
+        yield klvlist
@@ -0,0 +1,181 @@
+#
+# Compact index of the records of a GPMF telemetry file (gpmf.bin): offset,
+# fourCC, type, size and repeat of every record, nested ones included, saved
+# as a numpy array, followed by the size and modification time of the
+# telemetry file it was built from, so a stale index is rebuilt. The viewer decodes and prints only the chosen records,
+# instead of a text dump of everything (gpmf.klv).
+#
+#   python -m gopro2gpx.gpmfindex gpmf.bin [--index gpmf.idx] [--fourcc GPS5 GPSU]
+#                                 [--records FIRST:LAST] [--offsets START:END] [--raw]
+#
+# Released under GNU GENERAL PUBLIC LICENSE v3. (Use at your own risk)
+#
+
+import argparse
+import os
+
+import numpy as np
+
+from . import gpmf
+from . klvdata import KLVData
+
+# one row per record, in file order
+INDEX_DTYPE = np.dtype([
+    ('offset', '<u8'),  # of the header
+    ('fourCC', 'S4'),
+    ('type', 'u1'),  # 0 for the nested records (DEVC, STRM)
+    ('size', '<u2'),
+    ('repeat', '<u4')
+])
+
+
+def buildIndex(data_raw, skipped = None):
+    "the index of every record of the telemetry, skipped as in gpmf.scanStream"
+    rows = [ (offset, fourCC.encode(), type, size, repeat)
+             for offset, fourCC, type, size, repeat, _ in gpmf.scanStream(data_raw, skipped = skipped) ]
+    return np.array(rows, dtype = INDEX_DTYPE)
+
+
+def indexPath(filename):
+    "where the index of the telemetry file filename goes: gpmf.bin -> gpmf.idx"
+    return os.path.splitext(filename)[0] + '.idx'
+
+
+def sourceStamp(filename):
+    "size and modification time (ns) of the telemetry file, saved with its index"
+    stat = os.stat(filename)
+    return (stat.st_size, stat.st_mtime_ns)
+
+
+def writeIndex(path, index, source = None):
+    "save the index, then the sourceStamp source of its telemetry file if given"
+    with open(path, 'wb') as fd:
+        np.save(fd, index)
+        if source is not None:
+            np.save(fd, np.array(source, dtype = '<i8'))
+
+
+def indexSource(path):
+    "the sourceStamp saved after the index, None if there is none"
+    with open(path, 'rb') as fd:
+        version = np.lib.format.read_magic(fd)
+        read = np.lib.format.read_array_header_1_0 if version == (1, 0) else np.lib.format.read_array_header_2_0
+        shape, _, dtype = read(fd)
+        # over the index, without reading it
+        fd.seek(int(np.prod(shape)) * dtype.itemsize, os.SEEK_CUR)
+        try:
+            return tuple(np.load(fd).tolist())
+        except (EOFError, ValueError):
+            return None
+
+
+def readIndex(path):
+    return np.load(path, mmap_mode = 'r')
+
+
+def depths(index):
+    "nesting level of every record: 0 for DEVC, 1 for STRM..."
+    result = np.zeros(len(index), dtype = np.int32)
+    ends = []
+    for i, (offset, _, type, size, repeat) in enumerate(index.tolist()):
+        while ends and offset >= ends[-1]:
+            ends.pop()
+        result[i] = len(ends)
+        if type == 0:
+            ends.append(offset + 8 + size * repeat)
+    return result
+
+
+def streamTypes(index):
+    "position in the index of the TYPE record of the STRM of every record, -1 if none"
+    result = np.full(len(index), -1, dtype = np.int64)
+    current = -1
+    strm_end = 0
+    for i, (offset, fourCC, type, size, repeat) in enumerate(index.tolist()):
+        if offset >= strm_end:
+            current = -1
+        if fourCC == b'STRM':
+            strm_end = offset + 8 + size * repeat
+        elif fourCC == b'TYPE':
+            current = i
+        result[i] = current
+    return result
+
+
+def select(index, fourccs = None, records = None, offsets = None):
+    """
+    positions in the index of the records with one of fourccs, numbered
+    between records (first, last) and starting between offsets (start, end),
+    both ends included, None for no limit
+    """
+    keep = np.ones(len(index), dtype = bool)
+    if fourccs:
+        keep &= np.isin(index['fourCC'], [ f.encode() for f in fourccs ])
+    if records:
+        first, last = records
+        positions = np.arange(len(index))
+        keep &= (positions >= (first or 0)) & (positions <= (len(index) if last is None else last))
+    if offsets:
+        start, end = offsets
+        keep &= (index['offset'] >= (start or 0)) & (index['offset'] <= (np.iinfo(np.uint64).max if end is None else end))
+    return np.flatnonzero(keep)
+
+
+def record(view, row, typedef = None):
+    """
+    the KLVData of the index row, its payload read from view. typedef is
+    the TYPE of its STRM, for a complex (?) record
+    """
+    offset, fourCC, type, size, repeat = row
+    length = size * repeat
+    payload = view[offset + 8:offset + 8 + ((length + 3) & ~3)] if type and length else None
+    klv = KLVData.fromScan(offset, fourCC.decode(), type, size, repeat, payload)
+    if type == 0x3f:  # '?'
+        klv.typedef = typedef
+    return klv
+
+
+def describe(klv, raw = False):
+    "one line for the record: the decoded data, and the hex payload if raw"
+    if raw:
+        return str(klv)
+    stype = chr(klv.type) if klv.type else 'null'
+    data = '' if klv.type == 0 else " %s" % (klv.data,)
+    return "%s %s %d x %d%s" % (klv.fourCC, stype, klv.size, klv.repeat, data)
+
+
+def parseRange(text):
+    "'A:B', 'A:', ':B' or 'A' as (A, B), None for a missing end"
+    first, _, last = text.partition(':') if ':' in text else (text, None, text)
+    return (int(first, 0) if first else None, int(last, 0) if last else None)
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = "show records of a GPMF telemetry file")
+    parser.add_argument("file", help = "telemetry file (gpmf.bin)")
+    parser.add_argument("--index", help = "its index, built and saved there when missing or out of date (default: the file with .idx)")
+    parser.add_argument("--fourcc", help = "only these records", nargs = "+")
+    parser.add_argument("--records", help = "only the records numbered FIRST:LAST", type = parseRange)
+    parser.add_argument("--offsets", help = "only the records starting at START:END", type = parseRange)
+    parser.add_argument("--raw", help = "print the payloads in hex too", action = "store_true")
+    args = parser.parse_args(argv)
+
+    data = gpmf.GpmfFileReader(None).mapRawTelemetryFromBinary(args.file)
+    path = args.index or indexPath(args.file)
+    source = sourceStamp(args.file)
+    if os.path.exists(path) and indexSource(path) == source:
+        index = readIndex(path)
+    else:
+        index = buildIndex(data, skipped = [])
+        writeIndex(path, index, source)
+
+    view = memoryview(data)
+    level = depths(index)
+    types = streamTypes(index)
+    for i in select(index, args.fourcc, args.records, args.offsets):
+        typedef = record(view, index[types[i]].tolist()).data if types[i] >= 0 else None
+        print("%8d %10d %s%s" % (i, index['offset'][i], "  " * level[i], describe(record(view, index[i].tolist(), typedef), args.raw)))
+
+
+if __name__ == "__main__":
+    main()
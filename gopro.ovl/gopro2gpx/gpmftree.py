@@ -0,0 +1,161 @@
+#
+# DEVC -> STRM -> samples view of the GPMF telemetry, with an offset index
+# to reach the streams without walking every record.
+#
+# Released under GNU GENERAL PUBLIC LICENSE v3. (Use at your own risk)
+#
+
+import bisect
+
+import numpy as np
+
+from . import gpmf
+from . klvdata import KLVData
+
+# one row per STRM holding samples
+INDEX_DTYPE = np.dtype([
+    ('fourCC', 'S4'),  # label of the samples (GPS5, ACCL...)
+    ('devc', '<u4'),  # DEVC number
+    ('strm', '<u2'),  # STRM number inside the DEVC
+    ('offset', '<u8'),  # offset of the samples payload in the telemetry
+    ('type', 'u1'),
+    ('size', '<u2'),
+    ('repeat', '<u4'),  # sample count
+    ('tsmp', '<u8'),  # total samples so far (TSMP), 0 if not present
+    ('stmp', '<i8')  # timestamp of the first sample in us (STMP), -1 if not present
+])
+
+
+class GpmfStream:
+    """
+    a STRM: the context records (SCAL, TSMP, STMP, GPSU...) by fourCC and
+    the record with the samples, the last one of the STRM
+    """
+
+    def __init__(self, devc, index):
+        self.devc = devc
+        self.index = index
+        self.klvs = {}
+        self.samples = None
+
+    def add(self, klv):
+        if klv.type == 0x3f:  # '?', described by the TYPE of the STRM
+            klv.typedef = self.get('TYPE')
+        self.klvs[klv.fourCC] = klv
+        self.samples = klv
+
+    @property
+    def fourCC(self):
+        return self.samples.fourCC if self.samples else None
+
+    def get(self, fourCC, default = None):
+        "decoded data of the context record fourCC"
+        klv = self.klvs.get(fourCC)
+        if klv is None:
+            return default
+        return klv.data
+
+
+class GpmfDevice:
+    """
+    a DEVC: its own records (DVID, DVNM...) and its streams
+    """
+
+    def __init__(self, index):
+        self.index = index
+        self.klvs = {}
+        self.streams = []
+
+    def get(self, fourCC, default = None):
+        klv = self.klvs.get(fourCC)
+        if klv is None:
+            return default
+        return klv.data
+
+
+class GpmfTree:
+
+    def __init__(self, devices):
+        self.devices = devices
+        self.nodes = [ s for d in devices for s in d.streams if s.samples is not None ]
+        self.index = np.array([ self.indexRow(s) for s in self.nodes ], dtype = INDEX_DTYPE)
+
+    def indexRow(self, stream):
+        klv = stream.samples
+        tsmp = stream.get('TSMP', 0)
+        stmp = stream.get('STMP', -1)
+        return (klv.fourCC.encode(), stream.devc, stream.index, klv.offset + 8, klv.type, klv.size, klv.repeat, tsmp, stmp)
+
+    def stream(self, devc, strm):
+        "STRM strm of DEVC devc, numbered as in the telemetry"
+        for stream in self.devices[devc].streams:
+            if stream.index == strm:
+                return stream
+        raise IndexError(f"no STRM {strm} in DEVC {devc}")
+
+    def rows(self, fourCC):
+        "positions in the index (and in nodes) of the streams with fourCC samples"
+        return np.flatnonzero(self.index['fourCC'] == fourCC.encode())
+
+    def streams(self, fourCC):
+        "all the streams with fourCC samples, in stream order"
+        return [ self.nodes[i] for i in self.rows(fourCC) ]
+
+    def payloads(self, fourCC):
+        "all the fourCC sample records, in stream order"
+        return [ self.nodes[i].samples for i in self.rows(fourCC) ]
+
+
+def buildTree(data_raw, fourccs = None, skipped = None):
+    """
+    build the DEVC -> STRM -> samples tree from the telemetry. The records are
+    not decoded here (see KLVData.data). fourccs and skipped work as in
+    gpmf.parseStream. The STRMs left out by fourccs still count in the
+    numbering, so a stream has the same number whatever the filter
+    """
+    devices = []
+    device = None
+    stream = None
+    devc_start = 0
+    devc_end = 0
+    strm_end = 0
+    jumped = []
+
+    for record in gpmf.scanStream(data_raw, fourccs, skipped = skipped, jumped = jumped):
+        offset, fourCC, type, size, repeat, payload = record
+
+        if stream is not None and offset >= strm_end:
+            stream = None
+        if device is not None and offset >= devc_end:
+            device = None
+
+        if fourCC == 'DEVC':
+            device = GpmfDevice(len(devices))
+            devices.append(device)
+            devc_start = offset
+            devc_end = offset + 8 + size * repeat
+            continue
+
+        if device is None:
+            # records out of any DEVC
+            device = GpmfDevice(len(devices))
+            devices.append(device)
+            devc_start = devc_end
+            devc_end = len(data_raw)
+
+        if fourCC == 'STRM':
+            before = bisect.bisect_left(jumped, offset) - bisect.bisect_left(jumped, devc_start)
+            stream = GpmfStream(device.index, len(device.streams) + before)
+            device.streams.append(stream)
+            strm_end = offset + 8 + size * repeat
+            continue
+
+        klv = KLVData.fromScan(*record)
+        if klv.skip():
+            continue
+        if stream is not None:
+            stream.add(klv)
+        else:
+            device.klvs[fourCC] = klv
+
+    return GpmfTree(devices)
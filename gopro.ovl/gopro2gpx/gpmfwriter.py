@@ -0,0 +1,179 @@
+#
+# GPMF encoder, to write synthetic telemetry for tests and benchmarks: one
+# DEVC per second with the configured streams (GPS5, GPS9, ACCL, GYRO, TMPC),
+# alone or as the gpmd track of a minimal MP4 (see mp4reader).
+#
+# Released under GNU GENERAL PUBLIC LICENSE v3. (Use at your own risk)
+#
+
+import datetime
+import math
+import struct
+
+import numpy as np
+
+from . klvdata import KLVData
+
+
+def klv(fourCC, type, size, repeat, payload = b''):
+    "one record, payload padded to 32 bits"
+    header = KLVData.header.pack(fourCC.encode(), ord(type) if type else 0, size, repeat)
+    return header + payload + b'\0' * (-len(payload) % 4)
+
+
+def nested(fourCC, children):
+    "a DEVC or STRM holding the records of children"
+    body = b''.join(children)
+    return KLVData.header.pack(fourCC.encode(), 0, 4, len(body) // 4) + body
+
+
+def string(fourCC, text):
+    data = text.encode()
+    return klv(fourCC, 'c', 1, len(data), data)
+
+
+def value(fourCC, type, fmt, *values):
+    data = struct.pack('>' + fmt * len(values), *values)
+    return klv(fourCC, type, struct.calcsize('>' + fmt), len(values), data)
+
+
+def box(kind, *children):
+    "an MP4 box holding children"
+    payload = b''.join(children)
+    return struct.pack('>L4s', 8 + len(payload), kind.encode()) + payload
+
+
+def table(kind, fmt, rows):
+    "an MP4 full box (version 0) table: entry count, then rows of fmt"
+    return box(kind, struct.pack('>LL', 0, len(rows)), b''.join([ struct.pack('>' + fmt, *row) for row in rows ]))
+
+
+def mp4(samples, duration = 1.0, timescale = 1000, video = b''):
+    """
+    a minimal MP4 with samples as its gpmd track, each lasting duration s
+    and stored after video (bytes standing for the interleaved video)
+    """
+    ftyp = box('ftyp', b'mp41', bytes(4), b'mp41')
+    offsets = []
+    offset = len(ftyp) + 8
+    for sample in samples:
+        offsets.append(offset + len(video))
+        offset += len(video) + len(sample)
+    mdat = box('mdat', *[ video + sample for sample in samples ])
+
+    delta = round(duration * timescale)
+    stbl = box('stbl',
+               box('stsd', struct.pack('>LL', 0, 1), box('gpmd', bytes(6), struct.pack('>H', 1))),
+               table('stts', 'LL', [ (len(samples), delta) ] if samples else []),
+               table('stsc', 'LLL', [ (1, 1, 1) ]),
+               box('stsz', struct.pack('>LLL', 0, 0, len(samples)), b''.join([ struct.pack('>L', len(s)) for s in samples ])),
+               table('stco', 'L', [ (o,) for o in offsets ]))
+    mdhd = box('mdhd', struct.pack('>LLLLLL', 0, 0, 0, timescale, delta * len(samples), 0))
+    return ftyp + mdat + box('moov', box('trak', box('mdia', mdhd, box('minf', stbl))))
+
+
+class GpmfWriter:
+    """
+    synthetic telemetry: a drive at speed m/s from (lat, lon), climbing
+    slowly, sampled at the given rates (0 leaves the stream out).
+    GPS5 goes with the 1 Hz GPSU/GPSF/GPSP, GPS9 carries its own time
+    """
+
+    def __init__(self, gps5_rate = 18, gps9_rate = 0, accl_rate = 200, gyro_rate = 200, tmpc = True,
+                 start = datetime.datetime(2023, 5, 1, 10, 0, 0), lat = 47.0, lon = 15.0, speed = 10.0,
+                 device = "Hero8 Black"):
+        self.gps5_rate = gps5_rate
+        self.gps9_rate = gps9_rate
+        self.accl_rate = accl_rate
+        self.gyro_rate = gyro_rate
+        self.tmpc = tmpc
+        self.start = start
+        self.lat = lat
+        self.lon = lon
+        self.speed = speed
+        self.device = device
+        self.samples = { 'GPS5': 0, 'GPS9': 0, 'ACCL': 0, 'GYRO': 0 }
+
+    def position(self, t):
+        "lat, lon, alt of the track at t seconds (t an array)"
+        metres = self.speed * t
+        lat = self.lat + metres * math.cos(0.3) / 111320
+        lon = self.lon + metres * math.sin(0.3) / (111320 * math.cos(math.radians(self.lat)))
+        return lat, lon, 300 + t * 0.1
+
+    def stream(self, fourCC, second, rate, children):
+        "STRM with the timing records of second"
+        self.samples[fourCC] += rate
+        stmp = value('STMP', 'J', 'Q', second * 1000000)
+        tsmp = value('TSMP', 'L', 'L', self.samples[fourCC])
+        return nested('STRM', [ stmp, tsmp ] + children)
+
+    def gps5(self, second):
+        t = second + np.arange(self.gps5_rate) / self.gps5_rate
+        lat, lon, alt = self.position(t)
+        scal = (10000000, 10000000, 1000, 1000, 100)
+        speed = np.full(len(t), self.speed)
+        samples = np.round(np.column_stack([lat, lon, alt, speed, speed]) * scal).astype('>i4')
+        gpsu = (self.start + datetime.timedelta(seconds = second)).strftime('%y%m%d%H%M%S.000')
+        return self.stream('GPS5', second, self.gps5_rate, [
+            string('STNM', "GPS (Lat., Long., Alt., 2D speed, 3D speed)"),
+            value('GPSF', 'L', 'L', 3),
+            klv('GPSU', 'U', 16, 1, gpsu.encode()),
+            value('GPSP', 'S', 'H', 150),
+            klv('UNIT', 'c', 3, 5, b'degdegm\0\0m/sm/s'),
+            value('SCAL', 'l', 'l', *scal),
+            klv('GPS5', 'l', 20, self.gps5_rate, samples.tobytes())
+        ])
+
+    def gps9(self, second):
+        t = second + np.arange(self.gps9_rate) / self.gps9_rate
+        lat, lon, alt = self.position(t)
+        scal = (10000000, 10000000, 1000, 1000, 100, 1, 1000, 100, 1)
+        time = self.start + datetime.timedelta(seconds = second)
+        days = (time - datetime.datetime(2000, 1, 1)).days
+        secs = (time - datetime.datetime.combine(time.date(), datetime.time())).total_seconds() + t - second
+        records = np.zeros(len(t), dtype = [ ('f', '>i4', 7), ('dop', '>u2'), ('fix', '>u2') ])
+        speed = np.full(len(t), self.speed)
+        records['f'] = np.round(np.column_stack([lat, lon, alt, speed, speed, np.full(len(t), days), secs]) * scal[0:7])
+        records['dop'] = 150
+        records['fix'] = 3
+        return self.stream('GPS9', second, self.gps9_rate, [
+            string('STNM', "GPS (Lat., Long., Alt., 2D, 3D, days, secs, DOP, fix)"),
+            string('TYPE', 'lllllllSS'),
+            value('SCAL', 'l', 'l', *scal),
+            klv('GPS9', '?', 32, self.gps9_rate, records.tobytes())
+        ])
+
+    def xyz(self, fourCC, second, rate, name, units, scal):
+        t = second + np.arange(rate) / rate
+        samples = np.column_stack([np.sin(t), np.cos(t), np.sin(2 * t)]) * 1000
+        return self.stream(fourCC, second, rate, [
+            string('STNM', name),
+            string('SIUN', units),
+            value('SCAL', 's', 'h', scal),
+            klv(fourCC, 's', 6, rate, samples.astype('>i2').tobytes())
+        ])
+
+    def devc(self, second):
+        "the DEVC of second"
+        streams = []
+        if self.accl_rate:
+            streams.append(self.xyz('ACCL', second, self.accl_rate, "Accelerometer", 'm/s2', 418))
+        if self.gyro_rate:
+            streams.append(self.xyz('GYRO', second, self.gyro_rate, "Gyroscope", 'rad/s', 939))
+        if self.gps5_rate:
+            streams.append(self.gps5(second))
+        if self.gps9_rate:
+            streams.append(self.gps9(second))
+        if self.tmpc:
+            streams.append(nested('STRM', [ string('STNM', "Camera temperature"), value('TMPC', 'f', 'f', 41.5) ]))
+        return nested('DEVC', [ value('DVID', 'L', 'L', 1), string('DVNM', self.device) ] + streams)
+
+    def chunks(self, seconds):
+        "the telemetry of seconds seconds, one DEVC at a time"
+        for second in range(seconds):
+            yield self.devc(second)
+
+    def write(self, seconds):
+        "the telemetry of seconds seconds"
+        return b''.join(self.chunks(seconds))
@@ -7,9 +7,15 @@
 #
 
 from datetime import datetime
+import io
+import itertools
+import json
+import math
 import os
 import time
 
+import numpy as np
+
 
 class GPSPoint:
 
@@ -32,6 +38,87 @@ class GPSPoint:
         self.left_torque_effectiveness = 0
 
 
+class TrackArray:
+    """
+    GPS track as columns instead of one GPSPoint per sample: time is
+    datetime64[us], latitude, longitude, elevation and speed float64,
+    temperature and dop float32 (NaN when unknown). Indexing with an int or
+    iterating gives GPSPoints, made on demand; indexing with a slice, a mask
+    or an index array gives a TrackArray
+    """
+    dtypes = {
+        'time': 'datetime64[us]',
+        'latitude': np.float64,
+        'longitude': np.float64,
+        'elevation': np.float64,
+        'speed': np.float64,
+        'temperature': np.float32,
+        'dop': np.float32
+    }
+
+    def __init__(self, time = (), latitude = (), longitude = (), elevation = (), speed = (), temperature = (), dop = ()):
+        self.time = np.asarray(time, dtype = self.dtypes['time'])
+        self.latitude = np.asarray(latitude, dtype = np.float64)
+        self.longitude = np.asarray(longitude, dtype = np.float64)
+        self.elevation = np.asarray(elevation, dtype = np.float64)
+        self.speed = np.asarray(speed, dtype = np.float64)
+        self.temperature = np.asarray(temperature, dtype = np.float32)
+        self.dop = np.asarray(dop, dtype = np.float32)
+
+    @classmethod
+    def fromColumns(cls, columns):
+        "track from a dict of arrays by column name (see columns)"
+        return cls(*[ columns[name] for name in cls.dtypes ])
+
+    @classmethod
+    def fromPoints(cls, points):
+        "track from GPSPoints, a None temperature or dop is stored as NaN"
+        def values(name):
+            return [ np.nan if getattr(p, name) is None else getattr(p, name) for p in points ]
+        return cls([ p.time for p in points ], *[ values(name) for name in list(cls.dtypes)[1:] ])
+
+    @classmethod
+    def concatenate(cls, tracks):
+        return cls(*[ np.concatenate([ getattr(t, name) for t in tracks ] + [ np.empty(0, dtype = dtype) ])
+                      for name, dtype in cls.dtypes.items() ])
+
+    def columns(self):
+        "the arrays by column name"
+        return { name: getattr(self, name) for name in self.dtypes }
+
+    def __len__(self):
+        return len(self.time)
+
+    def __getitem__(self, index):
+        if isinstance(index, (int, np.integer)):
+            return self.point(index)
+        return TrackArray(*[ getattr(self, name)[index] for name in self.dtypes ])
+
+    def point(self, i):
+        "GPSPoint i"
+        temperature = self.temperature[i]
+        dop = self.dop[i]
+        return GPSPoint(float(self.latitude[i]), float(self.longitude[i]), float(self.elevation[i]), self.time[i].item(), float(self.speed[i]),
+                        None if np.isnan(temperature) else float(temperature), None if np.isnan(dop) else int(dop))
+
+    def __iter__(self):
+        temperature = [ None if t != t else t for t in self.temperature.tolist() ]
+        dop = [ None if d != d else int(d) for d in self.dop.tolist() ]
+        for values in zip(self.latitude.tolist(), self.longitude.tolist(), self.elevation.tolist(),
+                          self.time.tolist(), self.speed.tolist(), temperature, dop):
+            yield GPSPoint(*values)
+
+    def points(self):
+        "the whole track as a list of GPSPoints"
+        return list(self)
+
+    def shift(self, delta):
+        "the same track, delta (a timedelta) later"
+        track = self[:]
+        track.time = self.time + np.timedelta64(delta)
+        return track
+
+
 def UTCTime(timedata):
     #
     # time comes: 2014-05-30 20:11:27.200
@@ -52,98 +139,40 @@ def CSVTime(timedata):
     return csvtime
 
 
-def generate_GPX(points, start_time = None, trk_name = "exercise"):
-
-    """
-    Creates a GPX in 1.1 Format
-    """
-
-    if start_time is None:
-        start_time = points[0].time
-
-    xml = '<?xml version="1.0" encoding="UTF-8"?>\r\n'
-    gpx_attr = [
-                'xmlns="http://www.topografix.com/GPX/1/1"' ,
-                'xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"' ,
-                'xmlns:wptx1="http://www.garmin.com/xmlschemas/WaypointExtension/v1"' ,
-                'xmlns:gpxtrx="http://www.garmin.com/xmlschemas/GpxExtensions/v3"' ,
-                'xmlns:gpxtpx="http://www.garmin.com/xmlschemas/TrackPointExtension/v2"' ,
-                'xmlns:gpxx="http://www.garmin.com/xmlschemas/GpxExtensions/v3"' ,
-                'xmlns:trp="http://www.garmin.com/xmlschemas/TripExtensions/v1"' ,
-                'xmlns:adv="http://www.garmin.com/xmlschemas/AdventuresExtensions/v1"' ,
-                'xmlns:prs="http://www.garmin.com/xmlschemas/PressureExtension/v1"' ,
-                'xmlns:tmd="http://www.garmin.com/xmlschemas/TripMetaDataExtensions/v1"' ,
-                'xmlns:vptm="http://www.garmin.com/xmlschemas/ViaPointTransportationModeExtensions/v1"' ,
-                'xmlns:ctx="http://www.garmin.com/xmlschemas/CreationTimeExtension/v1"' ,
-                'xmlns:gpxacc="http://www.garmin.com/xmlschemas/AccelerationExtension/v1"',
-        'xmlns:gpxpx="http://www.garmin.com/xmlschemas/PowerExtension/v1"',
-        'xmlns:vidx1="http://www.garmin.com/xmlschemas/VideoExtension/v1"',
-
-                'creator="Garmin Desktop App"' ,
-                'version="1.1"' ,
-                'xsi:schemaLocation="http://www.topografix.com/GPX/1/1 http://www.topografix.com/GPX/1/1/gpx.xsd http://www.garmin.com/xmlschemas/WaypointExtension/v1 http://www8.garmin.com/xmlschemas/WaypointExtensionv1.xsd http://www.garmin.com/xmlschemas/TrackPointExtension/v2 http://www.garmin.com/xmlschemas/TrackPointExtensionv2.xsd http://www.garmin.com/xmlschemas/GpxExtensions/v3 http://www8.garmin.com/xmlschemas/GpxExtensionsv3.xsd http://www.garmin.com/xmlschemas/ActivityExtension/v1 http://www8.garmin.com/xmlschemas/ActivityExtensionv1.xsd http://www.garmin.com/xmlschemas/AdventuresExtensions/v1 http://www8.garmin.com/xmlschemas/AdventuresExtensionv1.xsd http://www.garmin.com/xmlschemas/PressureExtension/v1 http://www.garmin.com/xmlschemas/PressureExtensionv1.xsd http://www.garmin.com/xmlschemas/TripExtensions/v1 http://www.garmin.com/xmlschemas/TripExtensionsv1.xsd http://www.garmin.com/xmlschemas/TripMetaDataExtensions/v1 http://www.garmin.com/xmlschemas/TripMetaDataExtensionsv1.xsd http://www.garmin.com/xmlschemas/ViaPointTransportationModeExtensions/v1 http://www.garmin.com/xmlschemas/ViaPointTransportationModeExtensionsv1.xsd http://www.garmin.com/xmlschemas/CreationTimeExtension/v1 http://www.garmin.com/xmlschemas/CreationTimeExtensionsv1.xsd http://www.garmin.com/xmlschemas/AccelerationExtension/v1 http://www.garmin.com/xmlschemas/AccelerationExtensionv1.xsd http://www.garmin.com/xmlschemas/PowerExtension/v1 http://www.garmin.com/xmlschemas/PowerExtensionv1.xsd http://www.garmin.com/xmlschemas/VideoExtension/v1 http://www.garmin.com/xmlschemas/VideoExtensionv1.xsd"'
-                ]
-
-  	# BASECAMP:
-  	# - doesn't support hr=0
-  	# - doesn't support tags:
-  	# <gpxtpx:speed>1.0</gpxtpx:speed>
-    # <gpxtpx:distance>0</gpxtpx:distance>
-
-    xml += "<gpx " + " ".join(gpx_attr) + ">\r\n"
-
-    xml += "<metadata>\r\n"
-    xml += "  <time>%s</time>\r\n" % UTCTime(start_time)
-    xml += "</metadata>\r\n"
-    xml += "<trk>\r\n"
-    xml += "  <name>%s</name>\r\n" % trk_name
-    xml += "<trkseg>\r\n"
-
-    #
-    # add the points
-    #
-
-    #  <trkpt lat="40.327363333" lon="-3.760243333">
-    #    <time>2014-06-26T18:40:45Z</time>
-    #    <fix>2d</fix>
-    #    <sat>7</sat>
-    #  </trkpt>
-
-    for p in points:
-        pts = f'	<trkpt lat="{p.latitude}" lon="{p.longitude}">\r\n'
-        pts += f'		<ele>{p.elevation}</ele>\r\n'
-        pts += f'		<time>{UTCTime(p.time)}</time>\r\n'
-        pts += f'		<extensions>\r\n'
-        pts += f'			<gpxtpx:temp>{p.temperature}</gpxtpx:temp>\r\n'
-        pts += f'			<gpxtpx:dop>{p.dop}</gpxtpx:dop>\r\n'
-        pts += f'			<gpxtpx:TrackPointExtension>\r\n'
-        pts += f'				<gpxtpx:hr>{p.hr}</gpxtpx:hr>\r\n'
-        pts += f'				<gpxtpx:cad>{p.cad}</gpxtpx:cad>\r\n'
-        pts += f'				<gpxtpx:speed>{p.speed}</gpxtpx:speed>\r\n'
-        pts += f'				<gpxtpx:distance>{p.distance}</gpxtpx:distance>\r\n'
-        pts += '			</gpxtpx:TrackPointExtension>\r\n'
-    	# pts += '		<power>{power}</power>\r\n'
-        pts += f'		</extensions>\r\n'
-        pts += f'	</trkpt>\r\n'
-
-        xml += pts
-
-    xml += "</trkseg>\r\n"
-    xml += "</trk>\r\n"
-    xml += "</gpx>\r\n"
-
-    return xml
-
-
-def generate_KML(gps_points):
-    """
-
-    use this for color
-    http://www.zonums.com/gmaps/kml_color/
-
-    """
-
-    kml_template = """<?xml version="1.0" encoding="UTF-8"?>
+GPX_ATTRIBUTES = [
+    'xmlns="http://www.topografix.com/GPX/1/1"' ,
+    'xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"' ,
+    'xmlns:wptx1="http://www.garmin.com/xmlschemas/WaypointExtension/v1"' ,
+    'xmlns:gpxtrx="http://www.garmin.com/xmlschemas/GpxExtensions/v3"' ,
+    'xmlns:gpxtpx="http://www.garmin.com/xmlschemas/TrackPointExtension/v2"' ,
+    'xmlns:gpxx="http://www.garmin.com/xmlschemas/GpxExtensions/v3"' ,
+    'xmlns:trp="http://www.garmin.com/xmlschemas/TripExtensions/v1"' ,
+    'xmlns:adv="http://www.garmin.com/xmlschemas/AdventuresExtensions/v1"' ,
+    'xmlns:prs="http://www.garmin.com/xmlschemas/PressureExtension/v1"' ,
+    'xmlns:tmd="http://www.garmin.com/xmlschemas/TripMetaDataExtensions/v1"' ,
+    'xmlns:vptm="http://www.garmin.com/xmlschemas/ViaPointTransportationModeExtensions/v1"' ,
+    'xmlns:ctx="http://www.garmin.com/xmlschemas/CreationTimeExtension/v1"' ,
+    'xmlns:gpxacc="http://www.garmin.com/xmlschemas/AccelerationExtension/v1"',
+    'xmlns:gpxpx="http://www.garmin.com/xmlschemas/PowerExtension/v1"',
+    'xmlns:vidx1="http://www.garmin.com/xmlschemas/VideoExtension/v1"',
+
+    'creator="Garmin Desktop App"' ,
+    'version="1.1"' ,
+    'xsi:schemaLocation="http://www.topografix.com/GPX/1/1 http://www.topografix.com/GPX/1/1/gpx.xsd http://www.garmin.com/xmlschemas/WaypointExtension/v1 http://www8.garmin.com/xmlschemas/WaypointExtensionv1.xsd http://www.garmin.com/xmlschemas/TrackPointExtension/v2 http://www.garmin.com/xmlschemas/TrackPointExtensionv2.xsd http://www.garmin.com/xmlschemas/GpxExtensions/v3 http://www8.garmin.com/xmlschemas/GpxExtensionsv3.xsd http://www.garmin.com/xmlschemas/ActivityExtension/v1 http://www8.garmin.com/xmlschemas/ActivityExtensionv1.xsd http://www.garmin.com/xmlschemas/AdventuresExtensions/v1 http://www8.garmin.com/xmlschemas/AdventuresExtensionv1.xsd http://www.garmin.com/xmlschemas/PressureExtension/v1 http://www.garmin.com/xmlschemas/PressureExtensionv1.xsd http://www.garmin.com/xmlschemas/TripExtensions/v1 http://www.garmin.com/xmlschemas/TripExtensionsv1.xsd http://www.garmin.com/xmlschemas/TripMetaDataExtensions/v1 http://www.garmin.com/xmlschemas/TripMetaDataExtensionsv1.xsd http://www.garmin.com/xmlschemas/ViaPointTransportationModeExtensions/v1 http://www.garmin.com/xmlschemas/ViaPointTransportationModeExtensionsv1.xsd http://www.garmin.com/xmlschemas/CreationTimeExtension/v1 http://www.garmin.com/xmlschemas/CreationTimeExtensionsv1.xsd http://www.garmin.com/xmlschemas/AccelerationExtension/v1 http://www.garmin.com/xmlschemas/AccelerationExtensionv1.xsd http://www.garmin.com/xmlschemas/PowerExtension/v1 http://www.garmin.com/xmlschemas/PowerExtensionv1.xsd http://www.garmin.com/xmlschemas/VideoExtension/v1 http://www.garmin.com/xmlschemas/VideoExtensionv1.xsd"'
+    ]
+
+# BASECAMP:
+# - doesn't support hr=0
+# - doesn't support tags:
+# <gpxtpx:speed>1.0</gpxtpx:speed>
+# <gpxtpx:distance>0</gpxtpx:distance>
+
+#  <trkpt lat="40.327363333" lon="-3.760243333">
+#    <time>2014-06-26T18:40:45Z</time>
+#    <fix>2d</fix>
+#    <sat>7</sat>
+#  </trkpt>
+KML_TEMPLATE = """<?xml version="1.0" encoding="UTF-8"?>
     <kml xmlns="http://www.opengis.net/kml/2.2"> <Document>
     <name>Demo</name>
     <description>Description Demo</description>
@@ -173,26 +202,214 @@ def generate_KML(gps_points):
     </kml>
     """
 
-    lines = []
-    for p in gps_points:
-        s = "%s,%s,%s" % (p.longitude, p.latitude, p.elevation)
-        lines.append(s)
+CSV_TEMPLATE = """DashWare GPX CSV File
+Time,Latitude,Longitude,Elevation,AirTemp,HeartRate,Cadence,Power,Roll,Pitch
+%s"""
 
-    coords = os.linesep.join(lines)
-    kml = kml_template % coords
-    return(kml)
+GPX_POINT = (
+    '	<trkpt lat="{}" lon="{}">\r\n'
+    '		<ele>{}</ele>\r\n'
+    '		<time>{}</time>\r\n'
+    '		<extensions>\r\n'
+    '			<gpxtpx:temp>{}</gpxtpx:temp>\r\n'
+    '			<gpxtpx:dop>{}</gpxtpx:dop>\r\n'
+    '			<gpxtpx:TrackPointExtension>\r\n'
+    '				<gpxtpx:hr>{}</gpxtpx:hr>\r\n'
+    '				<gpxtpx:cad>{}</gpxtpx:cad>\r\n'
+    '				<gpxtpx:speed>{}</gpxtpx:speed>\r\n'
+    '				<gpxtpx:distance>{}</gpxtpx:distance>\r\n'
+    '			</gpxtpx:TrackPointExtension>\r\n'
+    # '		<power>{power}</power>\r\n'
+    '		</extensions>\r\n'
+    '	</trkpt>\r\n'
+)
 
 
-def generate_CSV(gps_points):
-    csv_template = """DashWare GPX CSV File
-Time,Latitude,Longitude,Elevation,AirTemp,HeartRate,Cadence,Power,Roll,Pitch
-%s"""
+def UTCTimes(times):
+    "UTCTime of every datetime64 of times, in one numpy call"
+    return [ t + 'Z' for t in np.datetime_as_string(np.asarray(times, dtype = 'datetime64[us]'), unit = 'us').tolist() ]
 
-    lines = []
-    for p in gps_points:
-        s = "%s,%s,%s,%s,%s" % (CSVTime(p.time), p.latitude, p.longitude, p.elevation, ',,,,,')
-        lines.append(s)
 
-    coords = os.linesep.join(lines)
-    csv = csv_template % coords
-    return(csv)
+# the values of a GPX_POINT
+POINT_COLUMNS = ('latitude', 'longitude', 'elevation', 'time', 'temperature', 'dop', 'hr', 'cad', 'speed', 'distance')
+
+
+def pointColumns(points, chunk_size = 4096):
+    """
+    the points (a TrackArray or GPSPoints) as dicts of lists by column, the
+    GPSPoint attributes with the time as UTCTimes, chunk_size points at a time
+    """
+    if isinstance(points, TrackArray):
+        for first in range(0, len(points), chunk_size):
+            track = points[first:first + chunk_size]
+            zeros = [ 0 ] * len(track)
+            yield {
+                'latitude': track.latitude.tolist(),
+                'longitude': track.longitude.tolist(),
+                'elevation': track.elevation.tolist(),
+                'time': UTCTimes(track.time),
+                'temperature': [ None if t != t else t for t in track.temperature.tolist() ],
+                'dop': [ None if d != d else int(d) for d in track.dop.tolist() ],
+                'hr': zeros,
+                'cad': zeros,
+                'speed': track.speed.tolist(),
+                'distance': zeros
+            }
+        return
+
+    points = iter(points)
+    while True:
+        chunk = list(itertools.islice(points, chunk_size))
+        if not chunk:
+            return
+        columns = { name: [ getattr(p, name) for p in chunk ] for name in POINT_COLUMNS }
+        columns['time'] = UTCTimes(columns['time'])
+        yield columns
+
+
+def startTime(points):
+    "time of the first point and the points, to be read again if an iterator"
+    if isinstance(points, TrackArray):
+        return points.time[0].item(), points
+    points = iter(points)
+    first = next(points)
+    return first.time, itertools.chain([ first ], points)
+
+
+class GPXWriter:
+    "GPX in 1.1 Format written to fd, one chunk of pointColumns at a time"
+
+    def __init__(self, fd, start_time, trk_name = "exercise"):
+        self.fd = fd
+        fd.write('<?xml version="1.0" encoding="UTF-8"?>\r\n')
+        fd.write("<gpx " + " ".join(GPX_ATTRIBUTES) + ">\r\n")
+        fd.write("<metadata>\r\n")
+        fd.write("  <time>%s</time>\r\n" % UTCTime(start_time))
+        fd.write("</metadata>\r\n")
+        fd.write("<trk>\r\n")
+        fd.write("  <name>%s</name>\r\n" % trk_name)
+        fd.write("<trkseg>\r\n")
+
+    def write(self, columns):
+        self.fd.write("".join(GPX_POINT.format(*values) for values in zip(*[ columns[name] for name in POINT_COLUMNS ])))
+
+    def close(self):
+        self.fd.write("</trkseg>\r\n")
+        self.fd.write("</trk>\r\n")
+        self.fd.write("</gpx>\r\n")
+
+
+class KMLWriter:
+    """
+    KML_TEMPLATE written to fd, one chunk of pointColumns at a time
+
+    use this for color
+    http://www.zonums.com/gmaps/kml_color/
+    """
+    template = KML_TEMPLATE
+    line = "{longitude},{latitude},{elevation}"
+
+    def __init__(self, fd, start_time = None, trk_name = None):
+        self.fd = fd
+        self.separator = ""
+        self.head, self.tail = self.template.split("%s")
+        fd.write(self.head)
+
+    def lines(self, columns):
+        return (self.line.format(longitude = lon, latitude = lat, elevation = ele)
+                for lon, lat, ele in zip(columns['longitude'], columns['latitude'], columns['elevation']))
+
+    def write(self, columns):
+        lines = os.linesep.join(self.lines(columns))
+        if lines:
+            self.fd.write(self.separator + lines)
+            self.separator = os.linesep
+
+    def close(self):
+        self.fd.write(self.tail)
+
+
+class CSVWriter(KMLWriter):
+    "DashWare CSV written to fd, one chunk of pointColumns at a time"
+    template = CSV_TEMPLATE
+
+    def lines(self, columns):
+        # the CSVTime of the UTCTimes
+        return ("%s,%s,%s,%s,%s" % (t[:10].replace('-', '/') + ' ' + t[11:23], lat, lon, ele, ',,,,,')
+                for t, lat, lon, ele in zip(columns['time'], columns['latitude'], columns['longitude'], columns['elevation']))
+
+
+def jsonNumber(value):
+    "value as a JSON number, null when it isn't finite (a NaN elevation)"
+    return str(value) if math.isfinite(value) else "null"
+
+
+class GeoJSONWriter:
+    """
+    GeoJSON Feature with the track as a LineString written to fd, one chunk
+    of pointColumns at a time. The times of the points are kept for its
+    coordTimes property, written at the end
+    """
+
+    def __init__(self, fd, start_time, trk_name = "exercise"):
+        self.fd = fd
+        self.times = []
+        self.separator = ""
+        self.properties = { 'name': trk_name, 'time': UTCTime(start_time) }
+        fd.write('{"type": "Feature", "geometry": {"type": "LineString", "coordinates": [\n')
+
+    def write(self, columns):
+        if not columns['time']:
+            return
+        self.fd.write(self.separator + ",\n".join(f"[{jsonNumber(lon)}, {jsonNumber(lat)}, {jsonNumber(ele)}]"
+                                                   for lon, lat, ele in zip(columns['longitude'], columns['latitude'], columns['elevation'])))
+        self.separator = ",\n"
+        self.times.extend(columns['time'])
+
+    def close(self):
+        self.properties['coordTimes'] = self.times
+        self.fd.write('\n]}, "properties": ' + json.dumps(self.properties) + '}\n')
+
+
+WRITERS = { 'gpx': GPXWriter, 'kml': KMLWriter, 'csv': CSVWriter, 'geojson': GeoJSONWriter }
+
+
+def write(writer, points, chunk_size = 4096):
+    "all the points to the writer, and close it"
+    for columns in pointColumns(points, chunk_size):
+        writer.write(columns)
+    writer.close()
+
+
+def write_GPX(fd, points, start_time = None, trk_name = "exercise", chunk_size = 4096):
+    """
+    Writes a GPX in 1.1 Format to the file object fd, chunk_size points at
+    a time. points is a TrackArray or an iterable of GPSPoints, which is
+    read only once
+    """
+    if start_time is None:
+        start_time, points = startTime(points)
+    write(GPXWriter(fd, start_time, trk_name), points, chunk_size)
+
+
+def generate_GPX(points, start_time = None, trk_name = "exercise"):
+
+    """
+    Creates a GPX in 1.1 Format, as a string (see write_GPX)
+    """
+
+    fd = io.StringIO()
+    write_GPX(fd, points, start_time, trk_name)
+    return fd.getvalue()
+
+
+def generate_KML(gps_points):
+    fd = io.StringIO()
+    write(KMLWriter(fd), gps_points)
+    return fd.getvalue()
+
+
+def generate_CSV(gps_points):
+    fd = io.StringIO()
+    write(CSVWriter(fd), gps_points)
+    return fd.getvalue()
@@ -6,6 +6,7 @@
 # Released under GNU GENERAL PUBLIC LICENSE v3. (Use at your own risk)
 #
 
+import functools
 import struct
 
 from . import fourCC
@@ -17,21 +18,45 @@ class KLVData:
             Data: 32-bit aligned, padded with 0
     """
     binary_format = '>4sBBH'
+    header = struct.Struct(binary_format)  # unsigned bytes!
+    # TYPE definition of the STRM, for the complex (?) payloads
+    typedef = None
 
     def __init__(self, data, offset):
 
-        s = struct.Struct(KLVData.binary_format)  # unsigned bytes!
-        self.fourCC, self.type, self.size, self.repeat = s.unpack_from(data, offset = offset)
+        self.fourCC, self.type, self.size, self.repeat = KLVData.header.unpack_from(data, offset = offset)
         self.fourCC = self.fourCC.decode()
+        self.offset = offset
 
         self.type = int(self.type)
         self.length = self.size * self.repeat
         self.padded_length = self.pad(self.length)
 
-        # read now the data, in raw format
+        # read now the data, in raw format. The label is processed on
+        # first access to data
         self.rawdata = self.readRawData(data, offset)
-        # process the label, if found
-        self.data = fourCC.Manage(self)
+
+    @classmethod
+    def fromScan(cls, offset, key, type, size, repeat, payload):
+        """
+        build the record from a header already unpacked by gpmf.scanStream.
+        payload is kept as the memoryview slice given by the scanner (no copy)
+        """
+        self = cls.__new__(cls)
+        self.fourCC = key
+        self.type = type
+        self.size = size
+        self.repeat = repeat
+        self.offset = offset
+        self.length = size * repeat
+        self.padded_length = (self.length + 3) & ~3
+        self.rawdata = payload
+        return self
+
+    @functools.cached_property
+    def data(self):
+        "process the label, if found"
+        return fourCC.Manage(self)
 
     def __str__(self):
 
@@ -42,7 +67,7 @@ class KLVData:
         if self.rawdata:
             rawdata = self.rawdata
             rawdata = ' '.join(format(x, '02x') for x in rawdata)
-            rawdatas = self.rawdata[0:10]
+            rawdatas = bytes(self.rawdata[0:10])
         else:
             rawdata = 'null'
             rawdatas = 'null'
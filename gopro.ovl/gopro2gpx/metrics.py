@@ -0,0 +1,91 @@
+#
+# Values derived from a gpshelper.TrackArray, computed once over its columns:
+# bearing, vertical speed, cumulative distance and smoothed speed and
+# elevation. Missing points (NaN latitude, as resample gives them) are
+# skipped.
+#
+# Released under GNU GENERAL PUBLIC LICENSE v3. (Use at your own risk)
+#
+
+import collections
+
+import numpy as np
+
+EARTH_RADIUS = 6371008.8  # mean radius, m
+
+# one value per point of the track, NaN when it can't be computed:
+# bearing in degrees from north, vertical speed in m/s, distance from the
+# start in m, speed (m/s) and elevation (m) averaged over the window
+Metrics = collections.namedtuple("Metrics", "bearing vertical_speed distance speed elevation")
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    "great circle distance in m between the points, in degrees"
+    lat1, lon1, lat2, lon2 = (np.radians(x) for x in (lat1, lon1, lat2, lon2))
+    h = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(np.minimum(h, 1)))
+
+
+def bearing(lat1, lon1, lat2, lon2):
+    """
+    direction in degrees (0 north, 90 east) from the first points to the
+    second ones, on the plane tangent at their mean latitude
+    """
+    x = (lon2 - lon1) * np.cos(np.radians((lat1 + lat2) / 2))
+    y = lat2 - lat1
+    return (450 - np.degrees(np.arctan2(y, x))) % 360
+
+
+def neighbours(valid):
+    """
+    for each point the pair to take a difference on: the points before and
+    after it, else the point and the one after or before it. Both the same
+    (no difference) when there is neither
+    """
+    i = np.arange(len(valid))
+    before = np.zeros(len(valid), dtype = bool)
+    after = np.zeros(len(valid), dtype = bool)
+    before[1:] = valid[:-1]
+    after[:-1] = valid[1:]
+    a = np.where(before & valid, i - 1, i)
+    b = np.where(after & valid, i + 1, i)
+    return a, b
+
+
+def smooth(values, window):
+    "centered moving average over window points, ignoring the NaNs"
+    if window <= 1:
+        return values.copy()
+    known = ~np.isnan(values)
+    sums = np.concatenate([ [ 0 ], np.cumsum(np.where(known, values, 0)) ])
+    counts = np.concatenate([ [ 0 ], np.cumsum(known) ])
+    i = np.arange(len(values))
+    lo = np.clip(i - window // 2, 0, len(values))
+    hi = np.clip(i - window // 2 + window, 0, len(values))
+    n = counts[hi] - counts[lo]
+    with np.errstate(invalid = 'ignore', divide = 'ignore'):
+        result = (sums[hi] - sums[lo]) / n
+    result[~known] = np.nan
+    return result
+
+
+def trackMetrics(track, window = 1):
+    "Metrics of the track, speed and elevation averaged over window points"
+    lat, lon, ele = track.latitude, track.longitude, track.elevation
+    valid = ~np.isnan(lat)
+    a, b = neighbours(valid)
+    seconds = (track.time[b] - track.time[a]) / np.timedelta64(1, 's')
+    moved = (a != b) & (seconds > 0)
+
+    direction = np.full(len(track), np.nan)
+    direction[moved] = bearing(lat[a], lon[a], lat[b], lon[b])[moved]
+    vertical_speed = np.full(len(track), np.nan)
+    vertical_speed[moved] = ((ele[b] - ele[a])[moved] / seconds[moved])
+
+    # from one known point to the next one
+    known = np.flatnonzero(valid)
+    steps = haversine(lat[known[:-1]], lon[known[:-1]], lat[known[1:]], lon[known[1:]])
+    distance = np.full(len(track), np.nan)
+    distance[known] = np.concatenate([ [ 0 ], np.cumsum(steps) ])
+
+    return Metrics(direction, vertical_speed, distance, smooth(track.speed, window), smooth(ele, window))
@@ -0,0 +1,179 @@
+#
+# Minimal MP4 (ISO BMFF) reader to find the GoPro metadata track (gpmd) and
+# read its samples straight from the file, without ffmpeg/ffprobe.
+# Walks moov/trak/mdia/minf/stbl and uses stsd, stsc, stco/co64, stsz, stts.
+#
+# Released under GNU GENERAL PUBLIC LICENSE v3. (Use at your own risk)
+#
+
+import collections
+import mmap
+import os
+import struct
+
+import numpy as np
+
+BOX_HEADER = struct.Struct('>L4s')
+LARGE_SIZE = struct.Struct('>Q')
+FULL_BOX = struct.Struct('>B3x')  # version, flags
+U32 = struct.Struct('>L')
+
+# per sample: offset in the file, size, start time and duration in seconds
+MetadataTrack = collections.namedtuple("MetadataTrack", "offsets sizes times durations timescale")
+
+
+def boxes(data, offset, end):
+    """
+    yield (type, payload start, box end) of the boxes between offset and end
+    """
+    while offset + 8 <= end:
+        size, kind = BOX_HEADER.unpack_from(data, offset)
+        header = 8
+        if size == 1:
+            size, = LARGE_SIZE.unpack_from(data, offset + 8)
+            header = 16
+        elif size == 0:
+            size = end - offset
+        if size < header or offset + size > end:
+            # damaged box, stop here
+            return
+        yield kind, offset + header, offset + size
+        offset += size
+
+
+def findBox(data, path, offset, end):
+    "(payload start, end) of the first box at path ('moov/trak'...) or None"
+    for kind in path.split('/'):
+        for box, start, box_end in boxes(data, offset, end):
+            if box == kind.encode():
+                offset, end = start, box_end
+                break
+        else:
+            return None
+    return offset, end
+
+
+def table(data, start, fmt, columns):
+    "entries of a full box table (entry count, then rows of fmt)"
+    count, = U32.unpack_from(data, start + 4)
+    dtype = np.dtype(fmt)
+    return np.frombuffer(data, dtype = dtype, count = count * columns, offset = start + 8).reshape(count, columns).astype(np.int64)
+
+
+def trackFormat(data, stbl):
+    "format of the first sample description of the track (b'gpmd' for GoPro metadata)"
+    stsd = findBox(data, 'stsd', *stbl)
+    if stsd is None:
+        return None
+    # version/flags, entry count, then the first entry: size, format
+    return BOX_HEADER.unpack_from(data, stsd[0] + 8)[1]
+
+
+def timescale(data, mdia):
+    mdhd = findBox(data, 'mdhd', *mdia)
+    version, = FULL_BOX.unpack_from(data, mdhd[0])
+    # version 1 has 64 bit creation/modification times
+    return U32.unpack_from(data, mdhd[0] + (20 if version == 1 else 12))[0]
+
+
+def sampleTable(data, stbl, scale):
+    "MetadataTrack of the stbl box"
+    start, end = findBox(data, 'stsz', *stbl)
+    sample_size, count = struct.unpack_from('>LL', data, start + 4)
+    if sample_size:
+        sizes = np.full(count, sample_size, dtype = np.int64)
+    else:
+        sizes = np.frombuffer(data, dtype = '>u4', count = count, offset = start + 12).astype(np.int64)
+
+    stco = findBox(data, 'stco', *stbl)
+    if stco is not None:
+        chunks = table(data, stco[0], '>u4', 1)[:, 0]
+    else:
+        chunks = table(data, findBox(data, 'co64', *stbl)[0], '>u8', 1)[:, 0]
+
+    # samples per chunk, from the runs of stsc (first chunk, samples, description)
+    stsc = table(data, findBox(data, 'stsc', *stbl)[0], '>u4', 3)
+    per_chunk = np.zeros(len(chunks), dtype = np.int64)
+    for i, (first, samples, _) in enumerate(stsc):
+        last = stsc[i + 1][0] - 1 if i + 1 < len(stsc) else len(chunks)
+        per_chunk[first - 1:last] = samples
+
+    chunk = np.repeat(np.arange(len(chunks)), per_chunk)[0:count]
+    ends = np.cumsum(sizes)
+    starts = ends - sizes
+    first_of_chunk = np.cumsum(per_chunk) - per_chunk
+    offsets = chunks[chunk] + starts - starts[first_of_chunk[chunk]]
+
+    stts = table(data, findBox(data, 'stts', *stbl)[0], '>u4', 2)
+    deltas = np.repeat(stts[:, 1], stts[:, 0])[0:count]
+    times = (np.cumsum(deltas) - deltas) / scale
+
+    return MetadataTrack(offsets, sizes, times, deltas / scale, scale)
+
+
+def metadataTrack(data):
+    """
+    sample table of the GoPro metadata (gpmd) track of the MP4 in data, None
+    if the file doesn't have one
+    """
+    moov = findBox(data, 'moov', 0, len(data))
+    if moov is None:
+        return None
+    for kind, start, end in boxes(data, *moov):
+        if kind != b'trak':
+            continue
+        mdia = findBox(data, 'mdia', start, end)
+        stbl = mdia and findBox(data, 'minf/stbl', *mdia)
+        if stbl is None or trackFormat(data, stbl) != b'gpmd':
+            continue
+        return sampleTable(data, stbl, timescale(data, mdia))
+    return None
+
+
+def mapFile(filename):
+    "read only mmap of filename"
+    with open(filename, 'rb') as fd:
+        return mmap.mmap(fd.fileno(), 0, access = mmap.ACCESS_READ)
+
+
+def readSampleTable(filename):
+    """
+    sample table of the gpmd track of the MP4 filename (see metadataTrack),
+    None if there is no such track or filename isn't an MP4
+    """
+    try:
+        data = mapFile(filename)
+    except (OSError, ValueError):
+        return None
+    try:
+        return metadataTrack(data)
+    except (struct.error, TypeError, ValueError):
+        return None
+    finally:
+        data.close()
+
+
+def readTelemetry(filename):
+    """
+    the gpmd track of the MP4 filename, as the bytes ffmpeg would copy out
+    of it, and its sample table. (None, None) if there is no such track
+    (an empty file, as a failed concat leaves it, included). The samples are interleaved with the video, they are copied once, from
+    the map of the file to the result
+    """
+    if not os.path.exists(filename):
+        raise FileNotFoundError("Can't open %s" % filename)
+
+    try:
+        data = mapFile(filename)
+    except ValueError:
+        # empty, mmap refuses it
+        return None, None
+    try:
+        track = metadataTrack(data)
+        if track is None:
+            return None, None
+        with memoryview(data) as view:
+            telemetry = b''.join([ view[o:o + s] for o, s in zip(track.offsets.tolist(), track.sizes.tolist()) ])
+        return telemetry, track
+    finally:
+        data.close()
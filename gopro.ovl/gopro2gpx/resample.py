@@ -0,0 +1,77 @@
+#
+# Resampling of a gpshelper.TrackArray to any times (1 Hz for the subtitles,
+# the frame rate for the overlays) in one pass over its time column.
+#
+#   nearest: the closest point, missing when it is more than max_gap away
+#   linear:  interpolated between the points around, missing when out of the
+#            track by more than max_gap
+#   gap:     as linear, also missing when the points around are more than
+#            max_gap apart (a hole in the GPS data)
+#
+# Released under GNU GENERAL PUBLIC LICENSE v3. (Use at your own risk)
+#
+
+import numpy as np
+
+from . gpshelper import TrackArray
+
+METHODS = ('nearest', 'linear', 'gap')
+DEFAULT_MAX_GAP = 0.5  # seconds
+
+# interpolated by linear and gap, the others are taken from the nearest point
+LINEAR_COLUMNS = ('latitude', 'longitude', 'elevation', 'speed', 'temperature')
+
+
+def targetTimes(start, duration, rate = 1.0):
+    "datetime64[us] times from start (a datetime) every 1 / rate s for duration s"
+    count = int(round(duration * rate))
+    return np.datetime64(start, 'us') + np.round(np.arange(count) * 1e6 / rate).astype('timedelta64[us]')
+
+
+def resample(track, times, method = 'nearest', max_gap = DEFAULT_MAX_GAP):
+    """
+    the track at times (datetime64), as a TrackArray with those times and
+    the mask of the times with data. The missing ones are NaN. max_gap in
+    seconds, None for no limit
+    """
+    if method not in METHODS:
+        raise ValueError(f"unknown resampling method {method}, use one of {METHODS}")
+    times = np.asarray(times, dtype = 'datetime64[us]')
+    q = times.astype(np.int64)
+    if len(track) == 0:
+        empty = TrackArray(times, *[ np.full(len(times), np.nan) ] * 6)
+        return empty, np.zeros(len(times), dtype = bool)
+
+    t = track.time.astype(np.int64)
+    last = len(t) - 1
+    after = np.clip(np.searchsorted(t, q, side = 'right'), 0, last)
+    before = np.clip(after - 1, 0, last)
+    nearest = np.where(np.abs(q - t[before]) <= np.abs(t[after] - q), before, after)
+    limit = np.inf if max_gap is None else max_gap * 1e6
+
+    if method == 'nearest':
+        valid = np.abs(t[nearest] - q) <= limit
+        columns = { name: getattr(track, name)[nearest] for name in TrackArray.dtypes if name != 'time' }
+    else:
+        inside = (q >= t[0]) & (q <= t[-1])
+        valid = inside | (np.abs(t[nearest] - q) <= limit)
+        if method == 'gap':
+            # a time on a point is never in a hole, the last one included
+            valid &= ~inside | (t[after] - t[before] <= limit) | (q == t[nearest])
+        span = t[after] - t[before]
+        frac = np.where(inside & (span > 0), (q - t[before]) / np.where(span > 0, span, 1), 0.0)
+        columns = {}
+        for name in TrackArray.dtypes:
+            if name == 'time':
+                continue
+            values = getattr(track, name)
+            if name in LINEAR_COLUMNS:
+                # out of the track: the end point (frac 0 on before == after)
+                lo = np.where(inside, values[before], values[nearest])
+                columns[name] = lo + frac * (values[after] - values[before])
+            else:
+                columns[name] = values[nearest]
+
+    for name, values in columns.items():
+        columns[name] = np.where(valid, values, np.nan)
+    return TrackArray(times, **columns), valid
@@ -0,0 +1,103 @@
+#
+# Simplification of a GPS track, keeping its shape within a tolerance in
+# metres, so the KML, the GPX and the track image grow with the turns of the
+# track instead of its duration.
+#
+#   dp: Douglas-Peucker, no point of the track is farther than the tolerance
+#       from the simplified line
+#   vw: Visvalingam-Whyatt, points are dropped while the triangle they make
+#       with their neighbours is smaller than tolerance² / 2 (a triangle
+#       tolerance high on a base tolerance long)
+#
+# Released under GNU GENERAL PUBLIC LICENSE v3. (Use at your own risk)
+#
+
+import numpy as np
+
+from . metrics import EARTH_RADIUS
+
+METHODS = ('dp', 'vw')
+
+
+def project(latitude, longitude):
+    "x, y in m of the points on the plane tangent at their mean latitude"
+    factor = np.cos(np.radians(np.nanmean(latitude))) if len(latitude) else 1.0
+    return np.radians(longitude) * factor * EARTH_RADIUS, np.radians(latitude) * EARTH_RADIUS
+
+
+def segmentDistance(x, y, x0, y0, x1, y1):
+    "distance of the points x, y to the segment from x0, y0 to x1, y1"
+    dx, dy = x1 - x0, y1 - y0
+    length = dx * dx + dy * dy
+    with np.errstate(invalid = 'ignore', divide = 'ignore'):
+        t = np.where(length > 0, np.clip(((x - x0) * dx + (y - y0) * dy) / length, 0, 1), 0)
+    return np.hypot(x - x0 - t * dx, y - y0 - t * dy)
+
+
+def douglasPeucker(x, y, tolerance):
+    "mask of the points kept by Douglas-Peucker, each split a vector operation"
+    keep = np.zeros(len(x), dtype = bool)
+    if not len(x):
+        return keep
+    keep[[0, -1]] = True
+    stack = [ (0, len(x) - 1) ]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        d = segmentDistance(x[first + 1:last], y[first + 1:last], x[first], y[first], x[last], y[last])
+        i = int(np.argmax(d))
+        if d[i] > tolerance:
+            i += first + 1
+            keep[i] = True
+            stack.append((first, i))
+            stack.append((i, last))
+    return keep
+
+
+def visvalingam(x, y, tolerance):
+    """
+    mask of the points kept by Visvalingam-Whyatt. Instead of one point at a
+    time, each round drops every other point of the runs of small triangles,
+    so never two neighbours, and computes the areas again
+    """
+    kept = np.arange(len(x))
+    limit = tolerance * tolerance / 2
+    while len(kept) > 2:
+        xs, ys = x[kept], y[kept]
+        area = np.abs((xs[:-2] - xs[2:]) * (ys[1:-1] - ys[2:]) - (xs[1:-1] - xs[2:]) * (ys[:-2] - ys[2:])) / 2
+        small = area < limit
+        if not small.any():
+            break
+        starts = small & ~np.concatenate([ [ False ], small[:-1] ])
+        run_start = np.flatnonzero(starts)[np.cumsum(starts) - 1]
+        drop = small & ((np.arange(len(small)) - run_start) % 2 == 0)
+        kept = np.concatenate([ kept[:1], kept[1:-1][~drop], kept[-1:] ])
+    keep = np.zeros(len(x), dtype = bool)
+    keep[kept] = True
+    return keep
+
+
+def simplifyMask(latitude, longitude, tolerance, method = 'dp'):
+    """
+    mask of the points (degrees) kept by method within tolerance m, all of
+    them for a tolerance of 0. Points with a NaN latitude are never kept
+    """
+    if method not in METHODS:
+        raise ValueError(f"unknown simplification method {method}, use one of {METHODS}")
+    latitude = np.asarray(latitude, dtype = np.float64)
+    longitude = np.asarray(longitude, dtype = np.float64)
+    valid = ~np.isnan(latitude)
+    if not tolerance:
+        return valid
+    x, y = project(latitude[valid], longitude[valid])
+    keep = np.zeros(len(latitude), dtype = bool)
+    keep[valid] = (douglasPeucker if method == 'dp' else visvalingam)(x, y, tolerance)
+    return keep
+
+
+def simplify(track, tolerance, method = 'dp'):
+    "the points of the gpshelper.TrackArray kept by simplifyMask"
+    if not tolerance:
+        return track
+    return track[simplifyMask(track.latitude, track.longitude, tolerance, method)]
@@ -0,0 +1,246 @@
+#
+# Columnar decoding of the sample streams into numpy arrays. Works on the
+# gpmftree.GpmfTree, one vectorized step per stream instead of one python
+# object per sample.
+#
+# Released under GNU GENERAL PUBLIC LICENSE v3. (Use at your own risk)
+#
+
+import collections
+
+import numpy as np
+
+from . import timing
+
+# per sample: lat lon alt speed speed3d (scaled, float64), the time in seconds
+# and the payload it comes from. per payload: sample counts, GPSU time, GPSF
+# fix and GPSP dop of its STRM (NaT, -1 and -1 when the STRM doesn't carry
+# them)
+GPS5Columns = collections.namedtuple("GPS5Columns", "lat lon alt speed speed3d time payload counts gpsu fix dop")
+
+# per sample: lat lon alt speed speed3d (scaled, float64), time (from the days
+# and seconds of the sample, datetime64[us]), dop (DOP x100) and fix, and the
+# payload it comes from. per payload: sample counts
+GPS9Columns = collections.namedtuple("GPS9Columns", "lat lon alt speed speed3d time dop fix payload counts")
+
+# GPS9 record, TYPE lllllllSS
+GPS9_DTYPE = np.dtype([
+    ('lat', '>i4'),
+    ('lon', '>i4'),
+    ('alt', '>i4'),
+    ('speed', '>i4'),
+    ('speed3d', '>i4'),
+    ('days', '>i4'),
+    ('secs', '>i4'),
+    ('dop', '>u2'),
+    ('fix', '>u2')
+])
+
+GPS9_EPOCH = np.datetime64('2000-01-01T00:00:00', 'us')
+
+# per sample: the raw y x z triples (as stored, -Y X Z order for most
+# cameras), the same scaled by SCAL as float32, the time in seconds and the
+# payload it comes from. per payload: sample counts
+IMUColumns = collections.namedtuple("IMUColumns", "raw values time payload counts")
+
+# per sample: the camera temperature in °C (float32), the time in seconds and
+# the payload it comes from. per payload: sample counts
+TMPCColumns = collections.namedtuple("TMPCColumns", "values time payload counts")
+
+# GPMF type char -> numpy big endian dtype
+dtypes = {
+    'b': 'i1',
+    'B': 'u1',
+    's': '>i2',
+    'S': '>u2',
+    'l': '>i4',
+    'L': '>u4',
+    'f': '>f4',
+    'd': '>f8',
+    'j': '>i8',
+    'J': '>u8'
+}
+
+
+def scale(SCAL, width):
+    "SCAL as width float64 values, a single value applies to all the fields, none means 1"
+    result = np.ones(width)
+    if isinstance(SCAL, tuple):
+        values = SCAL[:width]
+        result[:len(values)] = values
+    elif SCAL is not None:
+        result[:] = SCAL
+    return result
+
+
+def scales(streams, width):
+    "SCAL of each stream as a (len(streams), width) float64 array, see scale"
+    result = np.ones((len(streams), width))
+    for i, stream in enumerate(streams):
+        result[i] = scale(stream.get('SCAL'), width)
+    return result
+
+
+def gpsuTimes(streams):
+    "GPSU ('yymmddhhmmss.fff') of each stream as datetime64[us], NaT if not present"
+    iso = []
+    for stream in streams:
+        klv = stream.klvs.get('GPSU')
+        if klv is None or not klv.rawdata:
+            iso.append('NaT')
+            continue
+        u = str(klv.rawdata, 'ascii', errors = 'replace').strip('\0')
+        iso.append(f"20{u[0:2]}-{u[2:4]}-{u[4:6]}T{u[6:8]}:{u[8:10]}:{u[10:]}")
+    return np.array(iso, dtype = 'datetime64[us]')
+
+
+def sampleCounts(payloads):
+    "number of samples of each payload, 0 for the empty ones"
+    return np.array([ klv.repeat if klv.rawdata else 0 for klv in payloads ], dtype = np.int64)
+
+
+def rawSamples(payloads, counts, dtype, fields):
+    "all the payloads as one (sum(counts), fields) array of dtype"
+    parts = [ np.frombuffer(klv.rawdata, dtype = dtype, count = n * fields) for klv, n in zip(payloads, counts) if n ]
+    if not parts:
+        return np.empty((0, fields), dtype = dtype)
+    return np.concatenate(parts).reshape(-1, fields)
+
+
+def gps5Values(payloads, counts, scal):
+    """
+    the samples of the GPS5 payloads (counts of each): the big endian int32
+    N x 5 array and the same divided by scal, one row (see scales) per payload
+    """
+    raw = rawSamples(payloads, counts, '>i4', 5)
+    return raw, raw / np.repeat(scal, counts, axis = 0)
+
+
+def gps9Values(payloads, counts, scal):
+    """
+    the samples of the GPS9 payloads (counts of each, lllllllSS records): the
+    GPS9_DTYPE records, their lat lon alt speed speed3d as a N x 5 array
+    divided by scal (one row per payload, see scales) and their UTC time as
+    datetime64[us], from the days and seconds of each sample
+    """
+    parts = [ np.frombuffer(klv.rawdata, dtype = GPS9_DTYPE, count = n) for klv, n in zip(payloads, counts) if n ]
+    records = np.concatenate(parts) if parts else np.empty(0, dtype = GPS9_DTYPE)
+    scal = np.repeat(scal, counts, axis = 0)
+    values = np.column_stack([ records[name] / scal[:, i] for i, name in enumerate(GPS9_DTYPE.names[0:5]) ]).reshape(-1, 5)
+    us = records['days'].astype(np.int64) * 86400000000 + np.round(records['secs'] / scal[:, 6] * 1e6).astype(np.int64)
+    return records, values, GPS9_EPOCH + us.astype('timedelta64[us]')
+
+
+def decodeGPS5(tree, track = None):
+    """
+    decode every GPS5 payload of the tree at once: the big endian int32
+    samples as a N x 5 array, divided by the SCAL of their STRM. The times
+    are on the clock of timing.streamClock, as for decodeXYZ
+    """
+    streams = tree.streams('GPS5')
+    payloads = [ s.samples for s in streams ]
+    counts = sampleCounts(payloads)
+
+    _, values = gps5Values(payloads, counts, scales(streams, 5))
+
+    fix = np.array([ s.get('GPSF', -1) for s in streams ], dtype = np.int32)
+    dop = np.array([ s.get('GPSP', -1) for s in streams ], dtype = np.int32)
+    payload = np.repeat(np.arange(len(streams)), counts)
+
+    return GPS5Columns(values[:, 0], values[:, 1], values[:, 2], values[:, 3], values[:, 4], timing.streamClock(streams, track),
+                       payload, counts, gpsuTimes(streams), fix, dop)
+
+
+def decodeGPS9(tree):
+    """
+    decode every GPS9 payload of the tree at once, as GPS5 but with the time,
+    DOP and fix of each sample
+    """
+    streams = [ s for s in tree.streams('GPS9') if s.samples.size == GPS9_DTYPE.itemsize ]
+    payloads = [ s.samples for s in streams ]
+    counts = sampleCounts(payloads)
+
+    records, values, time = gps9Values(payloads, counts, scales(streams, 9))
+    payload = np.repeat(np.arange(len(streams)), counts)
+
+    return GPS9Columns(*values.T, time, records['dop'].astype(np.int32), records['fix'].astype(np.int32), payload, counts)
+
+
+def decodeXYZ(tree, fourCC, track = None):
+    """
+    decode every sample of the 3 axis fourCC stream (ACCL, GYRO...) of the
+    tree, not only the first one of each payload. The times are on the clock
+    of timing.streamClock, the video one with the MP4 sample table track
+    """
+    streams = tree.streams(fourCC)
+    payloads = [ s.samples for s in streams ]
+    counts = sampleCounts(payloads)
+
+    if payloads:
+        dtype = dtypes[chr(payloads[0].type)]
+    else:
+        dtype = dtypes['s']
+    raw = rawSamples(payloads, counts, dtype, 3)
+    values = (raw / np.repeat(scales(streams, 3), counts, axis = 0)).astype(np.float32)
+
+    time = timing.streamClock(streams, track)
+    payload = np.repeat(np.arange(len(streams)), counts)
+    return IMUColumns(raw.astype(raw.dtype.newbyteorder('=')), values, time, payload, counts)
+
+
+def decodeACCL(tree, track = None):
+    "accelerometer samples, m/s2"
+    return decodeXYZ(tree, 'ACCL', track)
+
+
+def decodeGYRO(tree, track = None):
+    "gyroscope samples, rad/s"
+    return decodeXYZ(tree, 'GYRO', track)
+
+
+def decodeTMPC(tree, track = None):
+    "camera temperature samples of the TMPC streams, °C"
+    streams = tree.streams('TMPC')
+    payloads = [ s.samples for s in streams ]
+    counts = sampleCounts(payloads)
+
+    dtype = dtypes[chr(payloads[0].type)] if payloads else dtypes['f']
+    raw = rawSamples(payloads, counts, dtype, 1)
+    values = (raw / np.repeat(scales(streams, 1), counts, axis = 0)).astype(np.float32)[:, 0]
+
+    time = timing.streamClock(streams, track)
+    payload = np.repeat(np.arange(len(streams)), counts)
+    return TMPCColumns(values, time, payload, counts)
+
+
+def streamNames(tree):
+    "STNM of the streams by fourCC of their samples (the first one found)"
+    names = {}
+    for stream in tree.nodes:
+        name = stream.get('STNM')
+        if name and stream.fourCC not in names:
+            names[stream.fourCC] = name
+    return names
+
+
+def decodeAll(tree, track = None):
+    """
+    every stream this module decodes, as a flat dict of named arrays
+    ('gps5_lat', 'accl_values'...) plus 'device', the DVNM of the first DEVC.
+    track is the MP4 sample table used to time the samples
+    """
+    columns = {}
+    streams = {
+        'gps5': lambda tree: decodeGPS5(tree, track),
+        'gps9': decodeGPS9,
+        'accl': lambda tree: decodeACCL(tree, track),
+        'gyro': lambda tree: decodeGYRO(tree, track),
+        'tmpc': lambda tree: decodeTMPC(tree, track)
+    }
+    for prefix, decode in streams.items():
+        if len(tree.rows(prefix.upper())):
+            for name, values in decode(tree)._asdict().items():
+                columns[f"{prefix}_{name}"] = values
+    device = tree.devices[0].get('DVNM') if tree.devices else None
+    columns['device'] = np.array(device or "Unknown")
+    return columns
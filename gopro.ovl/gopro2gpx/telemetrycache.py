@@ -0,0 +1,152 @@
+#
+# On disk cache of the decoded telemetry of the source videos, as npz files of
+# named columns. A source is identified by its path, size, mtime and a hash of
+# a few blocks of its content. The least recently used entries are removed
+# when the cache grows over its size limit. Several processes can use the
+# same cache: files are written whole or not at all, and a file removed by
+# another process, or damaged, is a miss.
+#
+#   python -m gopro2gpx.telemetrycache [--dir DIR] --info | --clear | --invalidate FILE...
+#
+# Released under GNU GENERAL PUBLIC LICENSE v3. (Use at your own risk)
+#
+
+import argparse
+import hashlib
+import os
+import tempfile
+import zipfile
+
+import numpy as np
+
+DEFAULT_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'gopro2gpx')
+DEFAULT_MAX_SIZE = 1024 * 1024 * 1024
+SAMPLE_SIZE = 64 * 1024
+VERSION = 3  # change when the cached columns change
+
+
+def discard(path):
+    "remove path, True unless it was already gone (removed by another process)"
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        return False
+    return True
+
+
+class TelemetryCache:
+
+    def __init__(self, directory = DEFAULT_DIR, max_size = DEFAULT_MAX_SIZE):
+        self.directory = directory
+        self.max_size = max_size
+
+    def key(self, filename):
+        """
+        identity of filename: path, size, mtime and the hash of its first,
+        middle and last blocks
+        """
+        st = os.stat(filename)
+        h = hashlib.blake2b(digest_size = 20)
+        h.update(f"{VERSION}|{os.path.realpath(filename)}|{st.st_size}|{st.st_mtime_ns}".encode())
+        with open(filename, 'rb') as fd:
+            for offset in (0, st.st_size // 2, max(st.st_size - SAMPLE_SIZE, 0)):
+                fd.seek(offset)
+                h.update(fd.read(SAMPLE_SIZE))
+        return h.hexdigest()
+
+    def path(self, filename):
+        return os.path.join(self.directory, self.key(filename) + '.npz')
+
+    def load(self, filename):
+        "the columns cached for filename, None if not there"
+        path = self.path(filename)
+        try:
+            with np.load(path, allow_pickle = False) as npz:
+                columns = { name: npz[name] for name in npz.files }
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, EOFError, zipfile.BadZipFile):
+            # damaged, as a miss
+            discard(path)
+            return None
+        # used now, for the LRU eviction
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        return columns
+
+    def store(self, filename, columns):
+        "cache the named arrays of columns for filename, then keep the cache under max_size"
+        os.makedirs(self.directory, exist_ok = True)
+        path = self.path(filename)
+        # written aside and renamed, readers never see a partial file
+        fd, tmp = tempfile.mkstemp(dir = self.directory, suffix = '.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.savez(f, **columns)
+            os.replace(tmp, path)
+        except BaseException:
+            discard(tmp)
+            raise
+        self.evict()
+
+    def entries(self):
+        "(path, size, last use) of the cached files, oldest first"
+        if not os.path.isdir(self.directory):
+            return []
+        result = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.npz'):
+                path = os.path.join(self.directory, name)
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                result.append((path, st.st_size, st.st_mtime))
+        return sorted(result, key = lambda e: e[2])
+
+    def evict(self):
+        "remove the least recently used files while the cache is over max_size"
+        entries = self.entries()
+        total = sum(e[1] for e in entries)
+        for path, size, _ in entries:
+            if total <= self.max_size:
+                break
+            discard(path)
+            total -= size
+
+    def invalidate(self, filename):
+        "forget filename, True if it was cached"
+        return discard(self.path(filename))
+
+    def clear(self):
+        "remove every cached file"
+        for path, _, _ in self.entries():
+            discard(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description = "telemetry cache of gopro2gpx")
+    parser.add_argument("--dir", help = "cache directory", default = DEFAULT_DIR)
+    group = parser.add_mutually_exclusive_group(required = True)
+    group.add_argument("--info", help = "show the cached files", action = "store_true")
+    group.add_argument("--clear", help = "remove every cached file", action = "store_true")
+    group.add_argument("--invalidate", help = "forget these source videos", nargs = "+", metavar = "FILE")
+    args = parser.parse_args()
+
+    cache = TelemetryCache(args.dir)
+    if args.clear:
+        cache.clear()
+    elif args.invalidate:
+        for filename in args.invalidate:
+            print("%s: %s" % (filename, "removed" if cache.invalidate(filename) else "not cached"))
+    else:
+        entries = cache.entries()
+        for path, size, _ in entries:
+            print("%10d %s" % (size, path))
+        print("%d files, %d bytes" % (len(entries), sum(e[1] for e in entries)))
+
+
+if __name__ == "__main__":
+    main()
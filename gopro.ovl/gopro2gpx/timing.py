@@ -0,0 +1,138 @@
+#
+# One clock for every sample of every stream: the seconds of the video, from
+# its first frame. Each payload is placed by the MP4 sample holding it (or its
+# STMP, or its DEVC number), each sample by its number in the stream (TSMP).
+# The clocks are increasing, so the samples of a video time (PTS) are found by
+# binary search (sampleAt, nearest).
+#
+# Released under GNU GENERAL PUBLIC LICENSE v3. (Use at your own risk)
+#
+
+import numpy as np
+
+
+def mp4Samples(offsets, track):
+    "the MP4 sample of the track holding each telemetry offset"
+    ends = np.cumsum(track.sizes)
+    return np.minimum(np.searchsorted(ends, offsets, side = 'right'), len(ends) - 1)
+
+
+def payloadStarts(offsets, stmp, devc, track = None):
+    """
+    start in seconds of each payload: the time of its MP4 sample in the
+    track, else its STMP (us) when every payload has an increasing one, else
+    its DEVC number (a DEVC holds about one second)
+    """
+    offsets = np.asarray(offsets, dtype = np.int64)
+    stmp = np.asarray(stmp, dtype = np.int64)
+    if track is not None and len(track.sizes):
+        sample = mp4Samples(offsets, track)
+        if len(stmp) and (stmp >= 0).all() and (np.diff(stmp) > 0).all():
+            # STMP is finer than the MP4 samples, keep it on the video clock
+            return track.times[sample[0]] + (stmp - stmp[0]) / 1e6
+        return track.times[sample]
+    if len(stmp) and (stmp >= 0).all() and (np.diff(stmp) > 0).all():
+        return stmp / 1e6
+    return np.asarray(devc, dtype = np.float64)
+
+
+def sampleNumbers(counts, tsmp):
+    """
+    number in the stream of the first sample of each payload: TSMP (total
+    samples, this payload included) minus its count, so lost payloads leave a
+    gap. Counted from the payloads when TSMP is missing or not increasing
+    """
+    counts = np.asarray(counts, dtype = np.int64)
+    tsmp = np.asarray(tsmp, dtype = np.int64)
+    first = tsmp - counts
+    if len(tsmp) and (tsmp > 0).all() and (first >= 0).all() and (np.diff(first) >= counts[:-1]).all():
+        return first - first[0]
+    return np.cumsum(counts) - counts
+
+
+def sampleClock(starts, numbers, counts, duration = None):
+    """
+    time of every sample: linear between the starts of consecutive payloads
+    by sample number. The last payload goes on at the mean rate, or over
+    duration seconds if there is only one
+    """
+    starts = np.asarray(starts, dtype = np.float64)
+    counts = np.asarray(counts, dtype = np.int64)
+    total = int(counts.sum())
+    if total == 0:
+        return np.empty(0)
+
+    used = counts > 0
+    starts, numbers, counts = starts[used], numbers[used], counts[used]
+    ends = np.empty(len(starts))
+    span = np.empty(len(starts))
+    ends[:-1] = starts[1:]
+    span[:-1] = numbers[1:] - numbers[:-1]
+    if len(starts) > 1 and starts[-1] > starts[0]:
+        rate = (numbers[-1] - numbers[0]) / (starts[-1] - starts[0])
+    else:
+        rate = counts[-1] / (duration or 1.0)
+    ends[-1] = starts[-1] + counts[-1] / rate
+    span[-1] = counts[-1]
+
+    period = (ends - starts) / span
+    first = np.cumsum(counts) - counts
+    k = np.arange(total) - np.repeat(first, counts)
+    return np.repeat(starts, counts) + k * np.repeat(period, counts)
+
+
+def streamClock(streams, track = None):
+    "time of every sample of the gpmftree streams, on the clock of the video"
+    counts = np.array([ s.samples.repeat if s.samples.rawdata else 0 for s in streams ], dtype = np.int64)
+    offsets = [ s.samples.offset for s in streams ]
+    stmp = [ s.get('STMP', -1) for s in streams ]
+    tsmp = [ s.get('TSMP', 0) for s in streams ]
+    starts = payloadStarts(offsets, stmp, [ s.devc for s in streams ], track)
+    duration = track.durations[mp4Samples(offsets[-1:], track)[0]] if track is not None and streams else None
+    return sampleClock(starts, sampleNumbers(counts, tsmp), counts, duration)
+
+
+def sampleAt(clock, pts):
+    "index in the clock (see streamClock) of the last sample at or before each pts, -1 before the first one"
+    return np.searchsorted(clock, pts, side = 'right') - 1
+
+
+def nearest(clock, pts):
+    "index in the clock of the sample closest to each pts, -1 for an empty clock"
+    if not len(clock):
+        return np.full(np.shape(pts), -1)
+    after = np.minimum(np.searchsorted(clock, pts), len(clock) - 1)
+    before = np.maximum(after - 1, 0)
+    return np.where(np.abs(clock[before] - pts) <= np.abs(clock[after] - pts), before, after)
+
+
+def utcFit(starts, utc, max_jump = 1.0):
+    """
+    UTC (datetime64[us], NaT when unknown) of the clock, for each payload as
+    the (a, b) of a + b * seconds in us. A line is fitted on the payloads
+    with a UTC (GPSU) between jumps of more than max_jump seconds, as between
+    the cut parts of concatenated videos; the others take the line of the
+    payloads before them. a is NaN when no payload has a UTC
+    """
+    starts = np.asarray(starts, dtype = np.float64)
+    known = np.flatnonzero(~np.isnat(utc))
+    a = np.full(len(starts), np.nan)
+    b = np.ones(len(starts))
+    if not len(known):
+        return a, b
+
+    us = utc[known].astype(np.int64)
+    offsets = us - np.round(starts[known] * 1e6)
+    breaks = np.flatnonzero(np.abs(np.diff(offsets)) > max_jump * 1e6) + 1
+    for segment in np.split(np.arange(len(known)), breaks):
+        first = known[segment[0]] if segment[0] else 0
+        if len(segment) > 1 and starts[known[segment[-1]]] > starts[known[segment[0]]]:
+            slope, _ = np.polyfit(starts[known[segment]], us[segment] - us[segment[0]], 1)
+            slope /= 1e6
+        else:
+            slope = 1.0
+        intercept = np.median(us[segment] - slope * np.round(starts[known[segment]] * 1e6))
+        a[first:] = intercept
+        b[first:] = slope
+    return a, b
+
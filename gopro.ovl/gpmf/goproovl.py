@@ -13,6 +13,7 @@ should work on Windows as well with proper path to ffmpeg.
 """
 
 import argparse
+from concurrent.futures import ProcessPoolExecutor
 import datetime
 import json
 import math
@@ -20,22 +21,32 @@ import os
 from pathlib import Path
 import re
 import shutil
-from subprocess import Popen, PIPE
+import sys
+from subprocess import Popen, PIPE, DEVNULL
 
 from PIL import Image, ImageDraw, ImageFont  # @UnresolvedImport only for PyDev
 import pytz
 from tzwhere import tzwhere  # https://github.com/pegler/pytzwhere/issues/53
 
+from gopro2gpx import columnar
 from gopro2gpx import gopro2gpx
 from gopro2gpx import gpshelper
+from gopro2gpx import metrics
+from gopro2gpx import mp4reader
+from gopro2gpx import resample
+from gopro2gpx import simplify
+from gopro2gpx import telemetrycache
 import numpy as np
 
 FFMPEG = "/usr/bin/ffmpeg"
 FFPROBE = "/usr/bin/ffprobe"
 GPSFREQU = 18
+PIPE_CHUNK = 64 * 1024
 MP4 = 'MP4'
 PNG = '.png'
 MAXEND = 1000
+# the GPX is written from the points of each second, see add_subtitles
+EXPORT_FORMATS = ('kml', 'csv', 'geojson')
 SUBTITLES_PREF = """[Script Info]
 Title: Example Subtitles
 ScriptType: v4.00+
@@ -70,7 +81,7 @@ def time_in_sec(min_sec):
     return seconds
 
 
-def dump_metadata():
+def dump_metadata(gpmf = True):
     global duration_sec
     global ovl_pos_y
     global width
@@ -106,44 +117,46 @@ def dump_metadata():
     if rc != 0:
         exit()
 
-    params = [FFMPEG, '-threads', '16', '-y', '-i', concat_file, '-codec', 'copy', '-map', '0:2', '-f', 'rawvideo', '-']
-    print_log(" ".join(params))
-    (o, e) = Popen(params, stdout = PIPE, stderr = PIPE).communicate()
-    Path(gpmf_file).write_bytes(o)
-    print_log(f"Read gpmf data from {concat_file}")
-    return o
-    # return BytesIO(o)
+    if not gpmf:
+        # telemetry read from the chapters (--parallel)
+        return None
 
+    gpmf_data, track = mp4reader.readTelemetry(concat_file)
+    if gpmf_data is not None:
+        Path(gpmf_file).write_bytes(gpmf_data)
+        print_log(f"Read gpmf data ({len(track.sizes)} samples) from {concat_file}")
+        return gpmf_data
 
-def calc_vertical_speed(step, alt0, alt1):
-    return (alt1 - alt0) / step
+    params = [FFMPEG, '-threads', '16', '-y', '-i', concat_file, '-codec', 'copy', '-map', '0:2', '-f', 'rawvideo', '-']
+    print_log(" ".join(params))
+    process = Popen(params, stdout = PIPE, stderr = DEVNULL)
+    return read_metadata(process)
 
 
-def calc_direction_ift(gps_datum_prev, gps_datum_next, text0, text1):
-    direction = angle_from_coordinate(gps_datum_prev.latitude, gps_datum_prev.longitude, gps_datum_next.latitude, gps_datum_next.longitude)
-    diff_sec = (gps_datum_next.time - gps_datum_prev.time).total_seconds()
-    vertical_speed = calc_vertical_speed(diff_sec, gps_datum_prev.elevation, gps_datum_next.elevation)
-    text0 += f'   {direction:.0f} °'
-    text1 += f'   {vertical_speed:.1f} m/s'
-    return text0, text1
+def read_metadata(process):
+    """
+    yield the gpmf data in chunks while ffmpeg writes it to the pipe, so it is
+    parsed during the extraction, and save it to gpmf_file on the way
+    """
+    with open(gpmf_file, "wb") as gfd:
+        for chunk in iter(lambda: process.stdout.read(PIPE_CHUNK), b''):
+            gfd.write(chunk)
+            yield chunk
+    process.wait()
+    print_log(f"Read gpmf data from {concat_file} returncode: {process.returncode}")
 
 
-def create_subtitle_text(gps_points, start_time, act_sec, sfd):
-    gps_datum_prev = None if act_sec == 0 else gps_points[act_sec - 1]
+def create_subtitle_text(gps_points, derived, start_time, act_sec, sfd):
     gps_datum = gps_points[act_sec]
-    gps_datum_next = None if act_sec + 1 == len(gps_points) else gps_points[act_sec + 1]
     time = start_time + datetime.timedelta(seconds = act_sec)
     if gps_datum and gps_datum.latitude:
-        speed = 3.6 * gps_datum.speed
-        heigh = gps_datum.elevation
+        speed = 3.6 * derived.speed[act_sec]
+        heigh = derived.elevation[act_sec]
         text0 = f'{speed:.0f} km/h'
         text1 = f'{heigh:.0f} m'
-        if gps_datum_prev and gps_datum_prev.latitude and gps_datum_next and gps_datum_next.latitude:
-            text0, text1 = calc_direction_ift(gps_datum_prev, gps_datum_next, text0, text1)
-        elif gps_datum_prev and gps_datum_prev.latitude:
-            text0, text1 = calc_direction_ift(gps_datum_prev, gps_datum, text0, text1)
-        elif gps_datum_next and gps_datum_next.latitude:
-            text0, text1 = calc_direction_ift(gps_datum, gps_datum_next, text0, text1)
+        if not math.isnan(derived.bearing[act_sec]):
+            text0 += f'   {derived.bearing[act_sec]:.0f} °'
+            text1 += f'   {derived.vertical_speed[act_sec]:.1f} m/s'
     else:
         text0 = ''
         text1 = ''
@@ -173,14 +186,6 @@ def create_subtitle_text(gps_points, start_time, act_sec, sfd):
             print(f'Dialogue: 0,{ts0}.00,{ts1}.00,{colorText}{line_nr},,0000,0000,0000,,{text1}', file = sfd)
 
 
-def angle_from_coordinate(lat1, long1, lat2, long2):
-    x = (long2 - long1) * lon_factor
-    y = lat2 - lat1
-    brng = math.degrees(math.atan2(y, x))
-    direction = (450 - brng) % 360
-    return direction
-
-
 def create_list_images(chunk):
     params = list()
     params.append('-i')
@@ -224,25 +229,21 @@ def call_prog(params):
 
 
 def add_subtitles(points, start_time):
-    p_index = 0
-    gps_points = []
-    true_gps_points = []
-    curr_time_rounded = start_time
-    for act_sec in range(round(duration_sec)):
-        p_index, dist_sec_last = get_nearest_gps_datum(points, p_index, curr_time_rounded)
-        point = points[p_index]
-        if dist_sec_last > 0.5:
-            point = None
-        else:
-            true_gps_points.append(point)
-        gps_points.append(point)
-        print(f"{act_sec} {curr_time_rounded} {p_index} {points[p_index].time}")
-        curr_time_rounded = curr_time_rounded + datetime.timedelta(seconds = 1)
+    # one point per second of video, see resample
+    times = resample.targetTimes(start_time, round(duration_sec))
+    track, valid = resample.resample(points, times, args.interpolation, args.max_gap)
+    gps_points = [ point if ok else None for point, ok in zip(track, valid.tolist()) ]
+    true_gps_points = [ point for point in gps_points if point ]
+    derived = metrics.trackMetrics(track, args.smooth)
+    for point, distance in zip(gps_points, derived.distance.tolist()):
+        if point:
+            point.distance = round(distance, 1)
+    print_log(f"GPS data for {len(true_gps_points)} of {len(gps_points)} seconds ({args.interpolation}, max gap {args.max_gap} s)")
     subtitle_file = f'{out_file_base}/{base_name}_subtitle.ass'
     with open(subtitle_file, "w") as sfd:
         print(SUBTITLES_PREF, file = sfd)
         for act_sec in range(len(gps_points)):
-            create_subtitle_text(gps_points, start_time, act_sec, sfd)
+            create_subtitle_text(gps_points, derived, start_time, act_sec, sfd)
 
     subtitle_video = f'{out_file_base}/{base_name}.{MP4}'
     params = [FFMPEG, '-threads', '16', '-y', '-i', concat_file, '-i', subtitle_file, '-map', '0', '-map', '1', '-c', 'copy', '-c:s', 'mov_text', '-metadata:s:s:0', 'language=eng', subtitle_video, '-hide_banner']
@@ -253,19 +254,6 @@ def add_subtitles(points, start_time):
     return subtitle_video, gps_points, true_gps_points
 
 
-def get_nearest_gps_datum(points, p_index, curr_time_rounded):
-    dist_sec_last = abs((points[p_index].time - curr_time_rounded).total_seconds())
-    dist_sec_curr = dist_sec_last
-    while dist_sec_curr <= dist_sec_last:
-        p_index += 1
-        if p_index == len(points):
-            break
-        dist_sec_last = dist_sec_curr
-        dist_sec_curr = abs((points[p_index].time - curr_time_rounded).total_seconds())
-
-    return p_index - 1, dist_sec_last
-
-
 def create_ovl_video(subtitle_video, img_width):
     list_all_images = sorted(Path(img_dir).iterdir())
     video_parts_out = list()
@@ -299,10 +287,18 @@ def create_ovl_video(subtitle_video, img_width):
     concat_video(video_parts_out, f'{out_file_base}/{base_name}_ovl.{MP4}')
 
 
-def print_log(param):
+def print_log(param, stream = None):
+    "param, timestamped, to stream (default stdout) and to the log file lfd"
     string = str(datetime.datetime.now()) + " " + param.replace("\n", "")
-    print(string)
-    print(string, file = lfd, flush = True)
+    print(string, file = stream or sys.stdout)
+    if lfd is not None:
+        print(string, file = lfd, flush = True)
+
+
+def move_if_exists(src, dst):
+    "the --parallel mode doesn't write every gpmf file"
+    if os.path.exists(src):
+        shutil.move(src, dst)
 
 
 def concat_video(video_parts, concat_file_result):
@@ -374,8 +370,15 @@ def cut(begin, end, index, video_file_name):
     return out_video_part_ts
 
 
+def simplify_points(points, tolerance):
+    if not tolerance:
+        return points
+    keep = simplify.simplifyMask([ p.latitude for p in points ], [ p.longitude for p in points ], tolerance, args.simplify)
+    print_log(f"GPX: {keep.sum()} of {len(points)} points ({args.simplify}, {tolerance} m)")
+    return [ p for p, k in zip(points, keep.tolist()) if k ]
+
+
 def get_local_time(points):
-    global lon_factor
     timezone = None
     start_time_local_rounded = None
     for point in points:
@@ -385,8 +388,6 @@ def get_local_time(points):
         timezone_str = tzwhere.tzwhere().tzNameAt(point.latitude, point.longitude)
         if timezone_str:
             timezone = pytz.timezone(timezone_str)
-        if not lon_factor:
-            lon_factor = math.cos(math.radians(point.latitude))
     if timezone:
         local_time = timezone.fromutc(start_time)
         start_time_local_rounded = datetime.datetime.fromtimestamp(round(local_time.timestamp()))
@@ -472,6 +473,7 @@ def add_images(points):
     track_img_size = calc_track_img_size(min_lat, max_lat, min_lon, max_lon, max_track_img_size, buffer)
     img_size = (elev_img_size[0] + track_img_size[0], max(elev_img_size[1], track_img_size[1]))
     img_points = list()
+    on_line = simplify.simplifyMask([ p.latitude if p else math.nan for p in points ], [ p.longitude if p else math.nan for p in points ], args.track_tolerance, args.simplify)
     for act_sec, point in enumerate(points):
         elevation_point = None
         track_point = None
@@ -481,7 +483,8 @@ def add_images(points):
                 elevation_line.append(elevation_point)
                 lat, lon = create_track_point(point, min_lat, max_lat, min_lon, max_lon)
                 track_point = (elev_img_size[0] + buffer + (track_img_size[0] - 2 * buffer) * lon, buffer + (track_img_size[1] - 2 * buffer) * lat)
-                track_line.append(track_point)
+                if on_line[act_sec]:
+                    track_line.append(track_point)
         img_points.append((elevation_point, track_point))
     lines, step, main_step = create_elevation_niveau_lines(min_hight, max_hight, elev_img_size, buffer)
     img = Image.new('RGBA', img_size, (0, 0, 0, 0))
@@ -515,11 +518,30 @@ def parseArgs():
     parser.add_argument("-e", "--end", help = "end time in last video, mm:ss", default = 0)
     parser.add_argument("-r", "--rotate", help = "rotate 180°, boolean", default = False)
     parser.add_argument("-u", "--upovl", help = "overlay left up°, boolean", default = True)
+    parser.add_argument("-p", "--parallel", help = "read the telemetry of every input video in parallel, while they are cut", action = "store_true")
+    parser.add_argument("--cache-dir", help = "telemetry cache of the input videos (--parallel)", default = telemetrycache.DEFAULT_DIR)
+    parser.add_argument("--no-cache", help = "don't use the telemetry cache", action = "store_true")
+    parser.add_argument("--clear-cache", help = "empty the telemetry cache first", action = "store_true")
+    parser.add_argument("--interpolation", help = "GPS data of each second: nearest point, linear or linear without crossing gaps", choices = resample.METHODS, default = 'nearest')
+    parser.add_argument("--max-gap", help = "no GPS data for a second farther than this from the points, in s (default 0.5)", type = float, default = resample.DEFAULT_MAX_GAP)
+    parser.add_argument("--export", help = "formats of the whole GPS track, besides the GPX of one point per second (default kml)", nargs = '+', choices = EXPORT_FORMATS, default = [ 'kml' ])
+    parser.add_argument("--telemetry", help = "binary columnar export of all the telemetry streams (without --parallel)", nargs = '+', choices = columnar.FORMATS, default = [])
+    parser.add_argument("--klv", help = "write the telemetry records of the GPS track as text to gpmf.klv (large, for debugging)", action = "store_true")
+    parser.add_argument("--index", help = "save the index of the telemetry records as gpmf.idx, see gpmfindex", action = "store_true")
+    parser.add_argument("--simplify", help = "simplification of the tracks: Douglas-Peucker or Visvalingam-Whyatt", choices = simplify.METHODS, default = 'dp')
+    parser.add_argument("--kml-tolerance", help = "simplify the KML track within this many m, 0 for every point (default 1)", type = float, default = 1.0)
+    parser.add_argument("--geojson-tolerance", help = "simplify the GeoJSON track within this many m, 0 for every point (default 1)", type = float, default = 1.0)
+    parser.add_argument("--gpx-tolerance", help = "simplify the GPX track within this many m, 0 for every point (default 0)", type = float, default = 0.0)
+    parser.add_argument("--track-tolerance", help = "simplify the line of the track image within this many m, 0 for every point (default 1)", type = float, default = 1.0)
+    parser.add_argument("--smooth", help = "speed and elevation of the subtitles averaged over this many seconds (default 1, no smoothing)", type = int, default = 1)
     # parser.add_argument("-o", "--outdir", help = "output directory", default = '/home/kk/Videos/')
     parser.add_argument("-o", "--outdir", help = "output directory", default = '/run/media/kk/CrucialX9/Videos/')
     parser.add_argument("dir", help = "input directory")
     parser.add_argument("outputname", help = "output name")
     args = parser.parse_args()
+    if columnar.unavailable(args.telemetry):
+        # before the videos are cut
+        parser.error(f"--telemetry {' '.join(columnar.unavailable(args.telemetry))} needs pyarrow, which isn't installed")
 
     return args
 
@@ -537,7 +559,6 @@ if __name__ == "__main__":
     ovl_pos_x = 0
     ovl_pos_y = 0
     width = 0
-    lon_factor = None
     # ovl_pos_y = 2060
     # ovl_pos_y = 1430
     ovl_size = (200, 90)
@@ -574,6 +595,7 @@ if __name__ == "__main__":
             if  m:
                 file_list.append(m.group(1))
 
+        chapters = list()
         for index, video_name in enumerate(file_list):
             video_file_name = f'{args.dir}/{video_name}.{MP4}'
             if index == 0:
@@ -584,11 +606,31 @@ if __name__ == "__main__":
                 end = time_in_sec(args.end)
             else:
                 end = 0
+            chapters.append((video_file_name, begin, end))
+
+        export_tolerances = { 'kml': args.kml_tolerance, 'geojson': args.geojson_tolerance }
+        if args.clear_cache:
+            telemetrycache.TelemetryCache(args.cache_dir).clear()
+            print_log(f"Telemetry cache {args.cache_dir} cleared")
+        if args.parallel:
+            executor = ProcessPoolExecutor()
+            chapter_futures = gopro2gpx.submitChapters(executor, chapters, None if args.no_cache else args.cache_dir)
+
+        for index, (video_file_name, begin, end) in enumerate(chapters):
             video_parts_inp.append(cut(begin, end, index, video_file_name))
 
         concat_video(video_parts_inp, concat_file)
 
-        points, start_time = gopro2gpx.main_core(dump_metadata(), concat_file, out_file_base, lfd)
+        if args.parallel:
+            dump_metadata(gpmf = False)
+            if args.telemetry:
+                print_log("--telemetry is only written without --parallel")
+            try:
+                points, start_time = gopro2gpx.main_chapters(chapters, chapter_futures, out_file_base, lfd, args.export, export_tolerances, args.simplify)
+            finally:
+                executor.shutdown(cancel_futures = True)
+        else:
+            points, start_time = gopro2gpx.main_core(dump_metadata(), concat_file, out_file_base, lfd, args.export, export_tolerances, args.simplify, args.telemetry, args.klv, args.index)
         # points = True  ####################################################
         if points:
             start_time_rounded = datetime.datetime.fromtimestamp(round(start_time.timestamp()))
@@ -596,9 +638,8 @@ if __name__ == "__main__":
             base_name_time = start_time_local_rounded if start_time_local_rounded else start_time_rounded
             base_name = f'{base_name_time.strftime("%Y.%m.%d %H:%M:%S")}_{args.outputname}'
             subtitle_video, gps_points, true_gps_points = add_subtitles(points, start_time_rounded)
-            gpx = gpshelper.generate_GPX(true_gps_points, start_time, trk_name = base_name)
             with open(f"{out_file_base}/gpmf.gpx", "w") as fd:
-                fd.write(gpx)
+                gpshelper.write_GPX(fd, simplify_points(true_gps_points, args.gpx_tolerance), start_time, trk_name = base_name)
             img_width = add_images(gps_points)
             create_ovl_video(subtitle_video, img_width)
             # base_name = '2020.06.12 12:17:59_Stoderzinken'  ####################################################
@@ -607,10 +648,12 @@ if __name__ == "__main__":
             new_dir = f'{args.outdir}ovl/{base_name}'
             shutil.rmtree(f'{new_dir}', ignore_errors = True)
             shutil.move(out_file_base, new_dir)
-            shutil.move(f'{new_dir}/gpmf.klv', f'{new_dir}/{base_name}_gpmf.klv')
-            shutil.move(f'{new_dir}/gpmf.kml', f'{new_dir}/{base_name}.kml')
-            shutil.move(f'{new_dir}/gpmf.gpx', f'{new_dir}/{base_name}.gpx')
-            shutil.move(f'{new_dir}/gpmf.bin', f'{new_dir}/{base_name}_gpmf.bin')
+            move_if_exists(f'{new_dir}/gpmf.klv', f'{new_dir}/{base_name}_gpmf.klv')
+            for f in EXPORT_FORMATS:
+                move_if_exists(f'{new_dir}/gpmf.{f}', f'{new_dir}/{base_name}.{f}')
+            move_if_exists(f'{new_dir}/gpmf.gpx', f'{new_dir}/{base_name}.gpx')
+            move_if_exists(f'{new_dir}/gpmf.bin', f'{new_dir}/{base_name}_gpmf.bin')
+            move_if_exists(f'{new_dir}/gpmf.idx', f'{new_dir}/{base_name}_gpmf.idx')
             shutil.rmtree(f'{new_dir}/tmp')
 
         dur = datetime.datetime.now()
@@ -0,0 +1,140 @@
+#
+# Throughput of the telemetry parser stages on synthetic GPMF (see
+# gopro2gpx.gpmfwriter): MB/s, samples/s and peak python memory of each stage.
+# Run from gopro.ovl:
+#
+#   PYTHONPATH=. python test/bench_parser.py [--hours H] [--save FILE] [--compare FILE]
+#
+# --compare fails (exit code 1) when a stage got slower than the saved run by
+# more than --tolerance.
+#
+
+import argparse
+import contextlib
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+from gopro2gpx import fourCC, gopro2gpx, gpmf, gpmftree, gpmfwriter, telemetry
+
+
+def scan(data):
+    return sum(1 for _ in gpmf.scanStream(data))
+
+
+def parse(data):
+    return gpmf.parseStream(data)
+
+
+def parse_gps(data):
+    return gpmf.parseStream(data, fourccs = gopro2gpx.GPS_LABELS)
+
+
+def manage(records):
+    for klv in records:
+        fourCC.Manage(klv)
+
+
+def build_points(records):
+    # BuildGPSPoints logs every payload
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        return gopro2gpx.BuildGPSPoints(records)
+
+
+def build_tree(data):
+    return gpmftree.buildTree(data)
+
+
+def decode_all(tree):
+    return telemetry.decodeAll(tree)
+
+
+def measure(function, source, repeat):
+    """
+    best time of repeat runs and the peak memory of one traced run. Each run
+    gets a fresh input from source, the decoded records cache their data
+    """
+    best = None
+    for _ in range(max(repeat, 1)):
+        argument = source()
+        start = time.perf_counter()
+        function(argument)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    argument = source()
+    tracemalloc.start()
+    function(argument)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best, peak
+
+
+def run(args):
+    writer = gpmfwriter.GpmfWriter(args.gps5, args.gps9, args.accl, args.gyro)
+    data = writer.write(int(args.hours * 3600))
+    samples = sum(writer.samples.values())
+    gps_records = parse_gps(data)
+    # input of each stage: the telemetry or the output of the stage before
+    stages = [
+        ("scanStream", scan, lambda: data),
+        ("parseStream", parse, lambda: data),
+        ("parseStream GPS", parse_gps, lambda: data),
+        ("fourCC.Manage", manage, lambda: parse(data)),
+        ("BuildGPSPoints", build_points, lambda: gps_records),
+        ("buildTree", build_tree, lambda: data),
+        ("decodeAll", decode_all, lambda: build_tree(data))
+    ]
+
+    print("%.2f h, %.1f MB, %d samples (GPS5 %d Hz, GPS9 %d Hz, ACCL %d Hz, GYRO %d Hz)" %
+          (args.hours, len(data) / 1e6, samples, args.gps5, args.gps9, args.accl, args.gyro))
+    print("%-16s %10s %10s %14s %12s" % ("stage", "seconds", "MB/s", "samples/s", "peak MB"))
+    results = {}
+    for name, function, source in stages:
+        if args.stage and name not in args.stage:
+            continue
+        best, peak = measure(function, source, args.repeat)
+        results[name] = { 'seconds': best, 'mb_s': len(data) / 1e6 / best, 'samples_s': samples / best, 'peak': peak }
+        print("%-16s %10.3f %10.1f %14.0f %12.1f" % (name, best, len(data) / 1e6 / best, samples / best, peak / 1e6))
+    return results
+
+
+def compare(results, saved, tolerance):
+    "names of the stages slower than saved by more than tolerance"
+    slower = []
+    for name, result in results.items():
+        before = saved.get(name)
+        if before and result['seconds'] > before['seconds'] * (1 + tolerance):
+            print("%s: %.3f s, was %.3f s" % (name, result['seconds'], before['seconds']), file = sys.stderr)
+            slower.append(name)
+    return slower
+
+
+def main():
+    parser = argparse.ArgumentParser(description = "benchmark of the GPMF parser stages on synthetic telemetry")
+    parser.add_argument("--hours", help = "duration of the telemetry (default 0.25)", type = float, default = 0.25)
+    parser.add_argument("--gps5", help = "GPS5 rate, 0 for none (default 18)", type = int, default = 18)
+    parser.add_argument("--gps9", help = "GPS9 rate, 0 for none (default 0)", type = int, default = 0)
+    parser.add_argument("--accl", help = "ACCL rate, 0 for none (default 200)", type = int, default = 200)
+    parser.add_argument("--gyro", help = "GYRO rate, 0 for none (default 200)", type = int, default = 200)
+    parser.add_argument("--repeat", help = "runs per stage, the best one counts (default 3)", type = int, default = 3)
+    parser.add_argument("--stage", help = "only these stages", nargs = "+")
+    parser.add_argument("--save", help = "write the results as json")
+    parser.add_argument("--compare", help = "compare with the results of --save")
+    parser.add_argument("--tolerance", help = "allowed slowdown for --compare (default 0.25)", type = float, default = 0.25)
+    args = parser.parse_args()
+
+    results = run(args)
+    if args.save:
+        with open(args.save, 'w') as fd:
+            json.dump(results, fd, indent = 1)
+    if args.compare:
+        with open(args.compare) as fd:
+            saved = json.load(fd)
+        if compare(results, saved, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+import concurrent.futures
+import contextlib
+import datetime
+import io
+import struct
+
+import numpy as np
+import pytest
+
+from gopro2gpx import gopro2gpx, gpmfwriter
+from gopro2gpx.gpmfwriter import klv, nested, string, value
+
+
+class LateFix(gpmfwriter.GpmfWriter):
+    "GPS9 without fix during the first second"
+
+    def gps9(self, second):
+        data = super().gps9(second)
+        if second:
+            return data
+        length = 32 * self.gps9_rate
+        records = np.frombuffer(data[-length:], dtype = '>u2').reshape(-1, 16).copy()
+        records[:, 15] = 0
+        return data[:-length] + records.tobytes()
+
+
+def readChapter(path, chunks):
+    path.write_bytes(gpmfwriter.mp4(chunks, video = bytes(100)))
+    with contextlib.redirect_stdout(io.StringIO()):
+        return gopro2gpx.readChapter(str(path))
+
+
+def test_gps5(tmp_path):
+    points, video_start, duration = readChapter(tmp_path / "GH010001.MP4", list(gpmfwriter.GpmfWriter().chunks(3)))
+    assert len(points) == 54
+    assert video_start == datetime.datetime(2023, 5, 1, 10, 0, 0)
+    assert duration == 3.0
+
+
+def test_gps9_anchor(tmp_path):
+    writer = LateFix(gps5_rate = 0, gps9_rate = 10, accl_rate = 0, gyro_rate = 0)
+    points, video_start, duration = readChapter(tmp_path / "GH010001.MP4", list(writer.chunks(3)))
+    # the first point is in the second sample, one second into the video
+    assert str(points.time[0]) == '2023-05-01T10:00:01.000000'
+    assert video_start == datetime.datetime(2023, 5, 1, 10, 0, 0)
+
+
+def test_no_gps_time(tmp_path):
+    # Karma GPRI points timed by SYST, without GPSU or GPS9
+    devc = nested('DEVC', [
+        string('DVNM', "Karma"),
+        nested('STRM', [ string('TYPE', 'JJ'), value('SCAL', 'l', 'l', 1000000, 1000),
+                         klv('SYST', '?', 16, 1, struct.pack('>QQ', 1682935200000000, 1682935200000)) ]),
+        nested('STRM', [ value('GPSF', 'L', 'L', 3), string('TYPE', 'JlllSSSSBB'),
+                         value('SCAL', 'l', 'l', 1000000, 10000000, 10000000, 1000, 100, 100, 100, 100, 1, 1),
+                         klv('GPRI', '?', 30, 1, struct.pack('>QlllHHHHBB', 0, 470000000, 150000000, 300000, 0, 0, 0, 0, 3, 0)) ])
+    ])
+    points, video_start, duration = readChapter(tmp_path / "GH010001.MP4", [ devc ])
+    assert len(points) == 0
+    assert video_start is None
+    assert duration == 1.0
+
+
+def test_failed_chapter():
+    failed = concurrent.futures.Future()
+    failed.set_exception(ValueError("damaged"))
+    pending = concurrent.futures.Future()
+    with pytest.raises(ValueError):
+        gopro2gpx.main_chapters([ ("a", 0, 0), ("b", 0, 0) ], [ failed, pending ], "out", None)
+    assert pending.cancelled()
+
+
+def test_video_start(tmp_path):
+    writer = LateFix(gps5_rate = 0, gps9_rate = 10, accl_rate = 0, gyro_rate = 0)
+    chunks = list(writer.chunks(3))
+    video = tmp_path / "concat.mp4"
+    video.write_bytes(gpmfwriter.mp4(chunks))
+    with contextlib.redirect_stdout(io.StringIO()):
+        points, start_time = gopro2gpx.main_core(b''.join(chunks), str(video), str(tmp_path), None)
+    # the first point comes one second into the video
+    assert str(points.time[0]) == '2023-05-01T10:00:01.000000'
+    assert start_time == datetime.datetime(2023, 5, 1, 10, 0, 0)
@@ -0,0 +1,103 @@
+import datetime
+import io
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+from gopro2gpx import gopro2gpx, gpmfindex, gpmfwriter, gpshelper
+
+
+def telemetry(path, seconds = 2):
+    path.parent.mkdir(parents = True, exist_ok = True)
+    path.write_bytes(gpmfwriter.GpmfWriter(gps5_rate = 18).write(seconds))
+    return str(path)
+
+
+def test_convert_mp4(tmp_path):
+    chunks = list(gpmfwriter.GpmfWriter(gps5_rate = 18).chunks(2))
+    video = tmp_path / "GX010001.MP4"
+    video.write_bytes(gpmfwriter.mp4(chunks, video = bytes(100)))
+    base = str(tmp_path / "out" / "GX010001")
+    files, count, points = gopro2gpx.convertFile(str(video), base, [ 'gpx', 'csv' ], klv_index = True, points_back = True)
+    assert count == len(points) == 36
+    assert files == [ f"{base}.bin", f"{base}.idx", f"{base}.gpx", f"{base}.csv" ]
+    assert len(gpmfindex.readIndex(gpmfindex.indexPath(f"{base}.bin"))) > 0
+
+
+def test_convert_bin(tmp_path):
+    source = telemetry(tmp_path / "a.bin")
+    files, count, points = gopro2gpx.convertFile(source, str(tmp_path / "a"), [ 'gpx' ])
+    assert (files, count, points) == ([ str(tmp_path / "a.gpx") ], 36, None)
+    # the telemetry is next to its index already
+    files, _, _ = gopro2gpx.convertFile(source, str(tmp_path / "a"), [], klv_index = True)
+    assert files == [ str(tmp_path / "a.idx") ]
+
+
+def test_convert_garbage(tmp_path):
+    source = tmp_path / "garbage.bin"
+    source.write_bytes(bytes(range(256)) * 4)
+    with pytest.raises(ValueError):
+        gopro2gpx.convertFile(str(source), str(tmp_path / "garbage"), [ 'gpx' ])
+    assert not os.path.exists(tmp_path / "garbage.gpx")
+
+
+def test_ndjson():
+    points = gpshelper.TrackArray.fromPoints([
+        gpshelper.GPSPoint(45.0, 7.0, 300.0, datetime.datetime(2024, 5, 1, 10, 0, 0), 1.5, None, 2.0),
+        gpshelper.GPSPoint(45.1, 7.1, 301.0, datetime.datetime(2024, 5, 1, 10, 0, 1), 2.5, None, 2.0)
+    ])
+    output = io.StringIO()
+    gopro2gpx.writeNDJSON(output, "a.bin", points, chunk_size = 1)
+    rows = [ json.loads(line) for line in output.getvalue().splitlines() ]
+    assert [ row['lat'] for row in rows ] == [ 45.0, 45.1 ]
+    assert rows[0]['file'] == "a.bin"
+    assert rows[0]['temp'] is None
+    assert set(rows[0]) == set(gopro2gpx.NDJSON_FIELDS) | { 'file' }
+
+
+def test_exit_status(tmp_path):
+    good = telemetry(tmp_path / "good.bin")
+    assert gopro2gpx.main([ good, '-o', str(tmp_path / "o"), '-j', '1' ]) == 0
+    assert os.path.exists(tmp_path / "o" / "good.gpx")
+    garbage = tmp_path / "garbage.bin"
+    garbage.write_bytes(bytes(1000))
+    assert gopro2gpx.main([ good, str(garbage), '-o', str(tmp_path / "o"), '-j', '1' ]) == 1
+
+
+def test_jobs(tmp_path, capsys):
+    with pytest.raises(SystemExit) as exit:
+        gopro2gpx.main([ telemetry(tmp_path / "a.bin"), '-j', '0' ])
+    assert exit.value.code == 2
+    assert "-j" in capsys.readouterr().err
+
+
+def test_same_names(tmp_path, capsys):
+    first = telemetry(tmp_path / "100GOPRO" / "GX010001.bin")
+    second = telemetry(tmp_path / "101GOPRO" / "GX010001.bin")
+    out = tmp_path / "o"
+    assert gopro2gpx.outputBases([ first, second ]) == [ first[:-4], second[:-4] ]
+    assert gopro2gpx.main([ first, second, '-o', str(out), '--index', '-j', '1' ]) == 0
+    for directory in ("100GOPRO", "101GOPRO"):
+        assert os.path.exists(out / directory / "GX010001.gpx")
+        # the telemetry goes next to its index
+        assert os.path.exists(out / directory / "GX010001.bin")
+        assert os.path.exists(out / directory / "GX010001.idx")
+    with pytest.raises(SystemExit):
+        gopro2gpx.main([ first, first, '-o', str(out) ])
+    assert "written over" in capsys.readouterr().err
+
+
+def test_ndjson_stdout(tmp_path):
+    # an unknown label makes fourCC.Report print a warning in the worker
+    source = tmp_path / "a.bin"
+    source.write_bytes(gpmfwriter.GpmfWriter(gps5_rate = 18).write(2).replace(b'DVID', b'XXID'))
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    result = subprocess.run([ sys.executable, "-m", "gopro2gpx", str(source), "-f", "--ndjson" ], cwd = root,
+                            capture_output = True, text = True, check = True)
+    lines = result.stdout.splitlines()
+    assert len(lines) == 36
+    assert all(json.loads(line)['file'] == str(source) for line in lines)
+    assert "XXID" in result.stderr
@@ -0,0 +1,52 @@
+import contextlib
+import io
+import os
+
+import pytest
+
+from gopro2gpx import columnar, gopro2gpx, gpmftree, gpmfwriter
+
+
+def tree():
+    return gpmftree.buildTree(gpmfwriter.GpmfWriter(gps5_rate = 18, accl_rate = 200).write(2))
+
+
+def test_without_pyarrow(tmp_path, monkeypatch):
+    monkeypatch.setattr(columnar, 'pyarrow', None)
+    assert columnar.unavailable(columnar.FORMATS) == [ 'parquet', 'arrow' ]
+    assert columnar.unavailable([ 'npz' ]) == []
+    # nothing written, not even the formats that could be
+    with pytest.raises(ImportError):
+        columnar.exportTelemetry(tree(), tmp_path / "telemetry", ('npz', 'parquet'))
+    assert os.listdir(tmp_path) == []
+
+
+def test_cli_without_pyarrow(tmp_path, monkeypatch, capsys):
+    monkeypatch.setattr(columnar, 'pyarrow', None)
+    source = tmp_path / "a.bin"
+    source.write_bytes(gpmfwriter.GpmfWriter().write(2))
+    with pytest.raises(SystemExit) as exit:
+        gopro2gpx.main([ str(source), '--telemetry', 'parquet', '-o', str(tmp_path / "o") ])
+    assert exit.value.code == 2
+    assert "pyarrow" in capsys.readouterr().err
+    assert not os.path.exists(tmp_path / "o")
+
+
+def test_arrow(tmp_path):
+    pyarrow = pytest.importorskip('pyarrow')
+    files = columnar.exportTelemetry(tree(), tmp_path / "telemetry", ('parquet', 'arrow'))
+    assert str(tmp_path / "telemetry.accl.arrow") in files
+    table = pyarrow.parquet.read_table(tmp_path / "telemetry.accl.parquet")
+    assert table.num_rows == 400
+    assert { 'values_x', 'values_y', 'values_z', 'time' } <= set(table.column_names)
+
+
+def test_streamed(tmp_path):
+    # as goproovl.read_metadata: gpmf.bin written while the chunks are parsed
+    chunks = list(gpmfwriter.GpmfWriter(gps5_rate = 18, accl_rate = 200).chunks(2))
+    (tmp_path / "gpmf.bin").write_bytes(b''.join(chunks))
+    with contextlib.redirect_stdout(io.StringIO()):
+        points, _ = gopro2gpx.main_core(iter(chunks), str(tmp_path / "concat.mp4"), str(tmp_path), None, telemetry_formats = ('npz',))
+    assert len(points) == 36
+    columns, _ = columnar.load(tmp_path / "telemetry.npz")
+    assert columns['accl_values'].shape == (400, 3)
@@ -0,0 +1,41 @@
+import contextlib
+import io
+import json
+import os
+
+import numpy as np
+
+from gopro2gpx import export, gopro2gpx, gpmf, gpmfwriter, gpshelper
+
+
+def test_empty(tmp_path):
+    assert export.export(gpshelper.TrackArray(), tmp_path / "track", export.FORMATS) == []
+    assert export.export(iter([]), tmp_path / "track", [ 'gpx' ]) == []
+    assert os.listdir(tmp_path) == []
+
+
+def track():
+    data = gpmfwriter.GpmfWriter(gps5_rate = 18).write(3)
+    with contextlib.redirect_stdout(io.StringIO()):
+        points, start_time, _ = gopro2gpx.BuildGPSPoints(gpmf.parseStream(data, fourccs = gopro2gpx.GPS_LABELS))
+    return points, start_time
+
+
+def test_same_as_generate(tmp_path):
+    points, start_time = track()
+    files = export.export(points, tmp_path / "track", [ 'gpx', 'kml', 'csv' ], start_time, "exercise", chunk_size = 10)
+    expected = [ gpshelper.generate_GPX(points, start_time, "exercise"), gpshelper.generate_KML(points), gpshelper.generate_CSV(points) ]
+    for name, text in zip(files, expected):
+        with open(name, newline = '') as fd:
+            assert fd.read() == text
+
+
+def test_geojson_nan(tmp_path):
+    points, start_time = track()
+    points.elevation[0] = np.nan
+    files = export.export(points, tmp_path / "track", [ 'geojson' ], start_time)
+    with open(files[0]) as fd:
+        geojson = json.load(fd)
+    coordinates = geojson['geometry']['coordinates']
+    assert len(coordinates) == len(points) == len(geojson['properties']['coordTimes'])
+    assert coordinates[0][2] is None and coordinates[1][2] is not None
@@ -0,0 +1,33 @@
+import struct
+
+from gopro2gpx import fourCC
+from gopro2gpx.klvdata import KLVData
+
+
+def record(label, size, payload, typedef = None):
+    klv = KLVData.fromScan(0, label, ord('?'), size, 1, payload)
+    klv.typedef = typedef
+    return klv
+
+
+def test_complex():
+    payload = struct.pack('>QQ', 1500000000, 1500000000123)
+    assert record('SYST', 16, payload, 'JJ').data == fourCC.SYSTData(1500000000, 1500000000123)
+    gpri = struct.pack('>QlllHHHHBB', 1, 470000000, 80000000, 500000, 0, 0, 0, 0, 3, 0) + b'\0\0'
+    assert record('GPRI', 30, gpri).data.lat == 470000000
+    # label without decoder of complex type, read with its TYPE
+    assert record('GRAV', 8, struct.pack('>ll', 1, -2), 'll').data == (1, -2)
+
+
+def test_type_mismatch():
+    # the TYPE describes 16 bytes, the records are 8
+    assert record('SYST', 8, b'\1' * 8, 'JJ').data == b'\1' * 8
+    assert record('GPRI', 12, b'\2' * 12).data == b'\2' * 12
+    assert record('GPS9', 12, b'\2' * 12).data == []
+
+
+def test_bounded_caches():
+    for i in range(fourCC.CACHE_SIZE + 10):
+        record(f"Z{i:03d}", 4, b'\0' * 4).data
+    assert fourCC.labelDecoder.cache_info().currsize <= fourCC.CACHE_SIZE
+    assert fourCC.labelDecoder.cache_info().maxsize == fourCC.compiled.cache_info().maxsize == fourCC.CACHE_SIZE
@@ -0,0 +1,126 @@
+import contextlib
+import io
+
+from gopro2gpx import fourCC, gopro2gpx, gpmf, gpmfwriter
+
+
+def test_skip_streams():
+    data = gpmfwriter.GpmfWriter(gps5_rate = 0, accl_rate = 200, gyro_rate = 0, tmpc = False).write(2)
+    assert [ klv.fourCC for klv in gpmf.parseStream(data, fourccs = gopro2gpx.GPS_LABELS) if klv.fourCC != 'DEVC' ] == [ 'DVID', 'DVNM' ] * 2
+    # only the context labels asked for: the STRM is still jumped over
+    assert not [ klv for klv in gpmf.parseStream(data, fourccs = { 'SCAL', 'TSMP' }) if klv.fourCC == 'STRM' ]
+
+
+def test_keep_context():
+    data = gpmfwriter.GpmfWriter(gps5_rate = 18, accl_rate = 200).write(2)
+    labels = { klv.fourCC for klv in gpmf.parseStream(data, fourccs = gopro2gpx.GPS_LABELS) }
+    assert { 'SCAL', 'TSMP', 'GPS5', 'GPSU' } <= labels
+    assert 'ACCL' not in labels
+    with contextlib.redirect_stdout(io.StringIO()):
+        points, _, _ = gopro2gpx.BuildGPSPoints(gpmf.parseStream(data, fourccs = gopro2gpx.GPS_LABELS))
+    assert len(points) == 36
+    assert fourCC.context_labels.isdisjoint(gopro2gpx.GPS_LABELS)
+
+
+def labels(blocks):
+    return [ (klv.offset, klv.fourCC) for block in blocks for klv in block ]
+
+
+def test_split_chunks():
+    data = gpmfwriter.GpmfWriter(gps5_rate = 18, accl_rate = 200).write(3)
+    whole = [ (klv.offset, klv.fourCC) for klv in gpmf.parseStream(data) ]
+    for size in (1, 7, 1000, len(data)):
+        chunks = [ data[i:i + size] for i in range(0, len(data), size) ]
+        blocks = list(gpmf.parseChunks(chunks))
+        assert len(blocks) == 3
+        assert labels(blocks) == whole
+
+
+def test_resync():
+    writer = gpmfwriter.GpmfWriter(gps5_rate = 18, accl_rate = 0, gyro_rate = 0)
+    blocks = [ writer.write(1) for i in range(3) ]
+    # garbage, then a DEVC header claiming 16 MB
+    damaged = blocks[0] + b'\xff' * 13 + b'DEVC\0\xff\xff\xff' + blocks[1] + blocks[2]
+    skipped = []
+    parser = gpmf.StreamParser(skipped = skipped)
+    found = []
+    for i in range(0, len(damaged), 64):
+        found += parser.feed(damaged[i:i + 64])
+    # every block out before the end of the stream, nothing left to buffer
+    assert len(found) == 3
+    assert parser.close() == []
+    start = len(blocks[0])
+    assert skipped == [ (start, start + 13), (start + 13, start + 21) ]
+    assert [ klv.fourCC for klv in found[2] ] == [ klv.fourCC for klv in gpmf.parseStream(blocks[2]) ]
+
+
+def test_close():
+    data = gpmfwriter.GpmfWriter(gps5_rate = 18).write(2)
+    cut = data[:len(data) - 10]
+    with contextlib.redirect_stdout(io.StringIO()):
+        parser = gpmf.StreamParser(skipped = [])
+        assert len(list(parser.feed(cut))) == 1
+        trailing = parser.close()
+        assert trailing and trailing[0].fourCC == 'DEVC'
+        # without recovery the cut block is only reported
+        parser = gpmf.StreamParser()
+        list(parser.feed(cut))
+        assert parser.close() == []
+
+
+def test_map_binary(tmp_path):
+    data = gpmfwriter.GpmfWriter(gps5_rate = 18).write(2)
+    path = tmp_path / "gpmf.bin"
+    path.write_bytes(data)
+    reader = gpmf.GpmfFileReader(None)
+    mapped = reader.mapRawTelemetryFromBinary(path)
+    assert not isinstance(mapped, bytes)
+    assert [ (klv.offset, klv.fourCC, klv.data) for klv in gpmf.parseStream(mapped, fourccs = gopro2gpx.GPS_LABELS) ] == \
+           [ (klv.offset, klv.fourCC, klv.data) for klv in gpmf.parseStream(data, fourccs = gopro2gpx.GPS_LABELS) ]
+    (tmp_path / "empty.bin").write_bytes(b'')
+    assert reader.mapRawTelemetryFromBinary(tmp_path / "empty.bin") == b''
+
+
+def test_lazy_decode():
+    data = gpmfwriter.GpmfWriter(gps5_rate = 18).write(1)
+    gps5 = [ klv for klv in gpmf.parseStream(data) if klv.fourCC == 'GPS5' ][0]
+    # a view of the telemetry, decoded on first access
+    assert isinstance(gps5.rawdata, memoryview) and gps5.rawdata.obj is data
+    assert 'data' not in vars(gps5)
+    assert gps5.data[0].lat == 470000000
+    assert 'data' in vars(gps5)
+
+
+def test_recovery():
+    writer = gpmfwriter.GpmfWriter(gps5_rate = 18, accl_rate = 0, gyro_rate = 0)
+    first, second = writer.write(1), writer.write(1)
+    # a bad header inside the first DEVC, then the second DEVC cut short
+    damaged = bytearray(first + second[:len(second) - 40])
+    damaged[200:204] = b'\xff\xff\xff\xff'
+    damaged = bytes(damaged)
+    skipped = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        records = gpmf.parseStream(damaged, skipped = skipped)
+    assert skipped[0] == (200, len(first))
+    assert [ klv.offset for klv in records if klv.fourCC == 'DEVC' ] == [ 0, len(first) ]
+    # the complete records of the cut DEVC are kept
+    assert 'GPSU' in [ klv.fourCC for klv in records if klv.offset > len(first) ]
+
+
+def test_recovery_filtered():
+    # the labels of the GPS track, as gopro2gpx.parseTelemetry parses them
+    data = gpmfwriter.GpmfWriter().write(3)
+    with contextlib.redirect_stdout(io.StringIO()):
+        for cut in range(0, len(data), 7):
+            skipped = []
+            records = gpmf.parseStream(data[:cut], fourccs = gopro2gpx.GPS_LABELS, skipped = skipped)
+            assert all(klv.offset + 8 <= cut for klv in records)
+            assert sum(len(block) for block in gpmf.parseChunks([ data[:cut] ], fourccs = gopro2gpx.GPS_LABELS, skipped = [])) == len(records)
+        # a label no longer text, in the STRM of ACCL
+        damaged = bytearray(data)
+        accl = data.find(b'ACCL')
+        damaged[accl:accl + 4] = b'\xff\x00w\x03'
+        skipped = []
+        records = gpmf.parseStream(bytes(damaged), fourccs = gopro2gpx.GPS_LABELS, skipped = skipped)
+    assert skipped and skipped[0][0] == accl
+    assert [ klv.offset for klv in records if klv.fourCC == 'DEVC' ][1:] == [ klv.offset for klv in gpmf.parseStream(data) if klv.fourCC == 'DEVC' ][1:]
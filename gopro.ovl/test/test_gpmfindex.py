@@ -0,0 +1,42 @@
+import struct
+
+from gopro2gpx import gpmfindex, gpmfwriter
+from gopro2gpx.gpmfwriter import klv, nested, string
+
+
+def test_stream_types(tmp_path, capsys):
+    data = gpmfwriter.GpmfWriter(gps5_rate = 0, gps9_rate = 10, accl_rate = 0, gyro_rate = 0).write(2)
+    index = gpmfindex.buildIndex(data)
+    types = gpmfindex.streamTypes(index)
+    gps9 = gpmfindex.select(index, [ 'GPS9' ])
+    assert index['fourCC'][types[gps9]].tolist() == [ b'TYPE', b'TYPE' ]
+    # records out of a STRM with a TYPE have none
+    assert types[gpmfindex.select(index, [ 'DVNM', 'TMPC' ])].tolist() == [ -1 ] * 4
+
+
+def test_complex_record(tmp_path, capsys):
+    # a complex record only its TYPE can decode
+    data = nested('DEVC', [ nested('STRM', [ string('TYPE', 'ls'), klv('GRAV', '?', 6, 1, struct.pack('>lh', 7, -3)) ]) ])
+    path = tmp_path / "gpmf.bin"
+    path.write_bytes(data)
+    gpmfindex.main([ str(path), '--fourcc', 'GRAV' ])
+    assert capsys.readouterr().out.split() == [ '3', '28', 'GRAV', '?', '6', 'x', '1', '(7,', '-3)' ]
+    assert (tmp_path / "gpmf.idx").exists()
+
+
+def test_stale_index(tmp_path, capsys):
+    path = tmp_path / "gpmf.bin"
+    path.write_bytes(gpmfwriter.GpmfWriter(gps5_rate = 18).write(2))
+    gpmfindex.main([ str(path), '--fourcc', 'GPS5' ])
+    assert len(capsys.readouterr().out.splitlines()) == 2
+    assert gpmfindex.indexSource(tmp_path / "gpmf.idx") == gpmfindex.sourceStamp(path)
+    # the telemetry changed since, its index is built again
+    path.write_bytes(gpmfwriter.GpmfWriter(gps5_rate = 18).write(3))
+    gpmfindex.main([ str(path), '--fourcc', 'GPS5' ])
+    assert len(capsys.readouterr().out.splitlines()) == 3
+    assert len(gpmfindex.readIndex(tmp_path / "gpmf.idx")) == len(gpmfindex.buildIndex(path.read_bytes()))
+    # an index saved without its source is rebuilt too
+    gpmfindex.writeIndex(tmp_path / "gpmf.idx", gpmfindex.buildIndex(path.read_bytes()[:0]))
+    assert gpmfindex.indexSource(tmp_path / "gpmf.idx") is None
+    gpmfindex.main([ str(path), '--fourcc', 'GPS5' ])
+    assert len(capsys.readouterr().out.splitlines()) == 3
@@ -0,0 +1,26 @@
+from gopro2gpx import gpmftree, gpmfwriter
+
+
+def test_tree():
+    data = gpmfwriter.GpmfWriter(gps5_rate = 18, accl_rate = 200, gyro_rate = 200).write(3)
+    tree = gpmftree.buildTree(data)
+    assert len(tree.devices) == 3
+    assert tree.devices[0].get('DVNM') == "Hero8 Black"
+    assert [ s.decode() for s in tree.index['fourCC'][:4] ] == [ 'ACCL', 'GYRO', 'GPS5', 'TMPC' ]
+    assert tree.index['repeat'][tree.rows('GPS5')].tolist() == [ 18, 18, 18 ]
+    accl = tree.streams('ACCL')
+    assert [ s.devc for s in accl ] == [ 0, 1, 2 ]
+    assert tree.stream(1, 0) is accl[1]
+    assert tree.payloads('GYRO')[2].repeat == 200
+
+
+def test_filtered_numbers():
+    data = gpmfwriter.GpmfWriter(gps5_rate = 18, accl_rate = 200, gyro_rate = 200).write(2)
+    full = gpmftree.buildTree(data)
+    gps = gpmftree.buildTree(data, fourccs = { 'GPS5' })
+    assert [ s.decode() for s in gps.index['fourCC'] ] == [ 'GPS5', 'GPS5' ]
+    # same numbers, and offsets, as without the filter
+    rows = full.index[full.rows('GPS5')]
+    assert gps.index['strm'].tolist() == rows['strm'].tolist() == [ 2, 2 ]
+    assert gps.index['offset'].tolist() == rows['offset'].tolist()
+    assert gps.stream(1, 2).samples.offset == full.stream(1, 2).samples.offset
@@ -0,0 +1,67 @@
+import contextlib
+import io
+import json
+
+from gopro2gpx import columnar, export, gopro2gpx, gpmf, gpmfindex, gpmftree, gpmfwriter, gpshelper, metrics, simplify, telemetry
+
+
+def test_gps5_points():
+    data = gpmfwriter.GpmfWriter(gps5_rate = 18).write(10)
+    with contextlib.redirect_stdout(io.StringIO()):
+        points, start, device = gopro2gpx.BuildGPSPoints(gpmf.parseStream(data, fourccs = gopro2gpx.GPS_LABELS))
+    assert len(points) == 180
+    assert device == "Hero8 Black"
+    assert points[0].latitude == 47.0
+
+    derived = metrics.trackMetrics(points, 18)
+    assert abs(derived.distance[-1] - 179 / 18 * 10) < 0.5
+    assert abs(derived.bearing[90] - 17.2) < 0.5
+    assert abs(derived.vertical_speed[90] - 0.1) < 0.01
+
+    # a straight line
+    assert len(simplify.simplify(points, 1.0, 'dp')) == len(simplify.simplify(points, 1.0, 'vw')) == 2
+
+
+def test_columns():
+    writer = gpmfwriter.GpmfWriter(gps5_rate = 10, gps9_rate = 10, accl_rate = 200, gyro_rate = 0)
+    columns = telemetry.decodeAll(gpmftree.buildTree(writer.write(3)))
+    assert len(columns['gps5_lat']) == len(columns['gps9_lat']) == 30
+    assert columns['accl_values'].shape == (600, 3)
+    assert 'gyro_values' not in columns
+    assert str(columns['gps9_time'][10]) == '2023-05-01T10:00:01.000000'
+
+
+def test_export(tmp_path):
+    data = gpmfwriter.GpmfWriter(gps5_rate = 18).write(5)
+    with contextlib.redirect_stdout(io.StringIO()):
+        points, start, device = gopro2gpx.BuildGPSPoints(gpmf.parseStream(data, fourccs = gopro2gpx.GPS_LABELS))
+    names = export.export(points, tmp_path / "track", export.FORMATS, start, device, { 'geojson': 1.0 })
+    assert [ name.rsplit('.', 1)[1] for name in names ] == list(export.FORMATS)
+    with open(tmp_path / "track.gpx", newline = "") as fd:
+        assert fd.read() == gpshelper.generate_GPX(points.points(), start, device)
+    with open(tmp_path / "track.geojson") as fd:
+        assert len(json.load(fd)['geometry']['coordinates']) == 2
+
+
+def test_columnar(tmp_path):
+    tree = gpmftree.buildTree(gpmfwriter.GpmfWriter(gps5_rate = 18, accl_rate = 200).write(3))
+    columnar.exportTelemetry(tree, tmp_path / "telemetry", ('npz', 'npy'))
+    columns, metadata = columnar.load(tmp_path / "telemetry")
+    assert metadata['device'] == "Hero8 Black"
+    assert metadata['streams']['TMPC'] == "Camera temperature"
+    assert columns['accl_values'].shape == (600, 3)
+    assert columns['gps5_time'][18] == 1.0
+    assert list(columnar.tables(columns)['tmpc_payloads']['time']) == [ 0.0, 1.0, 2.0 ]
+    npz, _ = columnar.load(f"{tmp_path}/telemetry.npz")
+    assert sorted(npz) == sorted(columns)
+
+
+def test_index(tmp_path):
+    data = gpmfwriter.GpmfWriter(gps5_rate = 18).write(3)
+    gpmfindex.writeIndex(tmp_path / "gpmf.idx", gpmfindex.buildIndex(data))
+    index = gpmfindex.readIndex(tmp_path / "gpmf.idx")
+    assert len(index) == len(list(gpmf.scanStream(data)))
+    rows = gpmfindex.select(index, [ 'GPS5' ])
+    assert len(rows) == 3
+    klv = gpmfindex.record(memoryview(data), index[rows[0]].tolist())
+    assert klv.repeat == 18 and klv.data[0].lat == 470000000  # not scaled
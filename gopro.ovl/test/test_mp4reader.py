@@ -0,0 +1,31 @@
+import numpy as np
+
+from gopro2gpx import gpmfwriter, mp4reader
+
+
+def test_read_telemetry(tmp_path):
+    chunks = list(gpmfwriter.GpmfWriter().chunks(3))
+    path = tmp_path / "GH010001.MP4"
+    path.write_bytes(gpmfwriter.mp4(chunks, duration = 1.001, timescale = 1000, video = bytes(500)))
+    data, track = mp4reader.readTelemetry(str(path))
+    assert data == b''.join(chunks)
+    assert track.sizes.tolist() == [ len(c) for c in chunks ]
+    assert np.allclose(track.times, [ 0, 1.001, 2.002 ])
+    assert np.allclose(track.durations, 1.001)
+    assert track.timescale == 1000
+    # the samples are read where the table says, after the video
+    assert mp4reader.readSampleTable(str(path)).offsets.tolist() == track.offsets.tolist()
+    assert track.offsets[1] - track.offsets[0] == len(chunks[0]) + 500
+
+
+def test_not_mp4(tmp_path):
+    path = tmp_path / "gpmf.bin"
+    path.write_bytes(gpmfwriter.GpmfWriter().write(1))
+    assert mp4reader.readTelemetry(str(path)) == (None, None)
+    assert mp4reader.readSampleTable(str(path)) is None
+    # a failed concat
+    path.write_bytes(b'')
+    assert mp4reader.readTelemetry(str(path)) == (None, None)
+    # no gpmd track
+    path.write_bytes(gpmfwriter.box('ftyp', b'mp41') + gpmfwriter.box('moov', gpmfwriter.box('trak')))
+    assert mp4reader.readTelemetry(str(path)) == (None, None)
@@ -0,0 +1,53 @@
+import datetime
+
+import numpy as np
+import pytest
+
+from gopro2gpx import gpshelper, resample
+
+START = datetime.datetime(2023, 5, 1, 10, 0, 0)
+
+
+def track():
+    # 1 Hz, then a 5 s hole
+    seconds = np.array([ 0, 1, 2, 3, 8, 9 ])
+    time = np.datetime64(START, 'us') + (seconds * 1000000).astype('timedelta64[us]')
+    return gpshelper.TrackArray(time, 47 + seconds * 0.001, 15 + seconds * 0.001, 300 + seconds, np.full(6, 10.0),
+                                np.full(6, 40.0), np.full(6, 1.5))
+
+
+def test_target_times():
+    times = resample.targetTimes(START, 2, 4)
+    assert len(times) == 8
+    assert str(times[1]) == '2023-05-01T10:00:00.250000'
+
+
+def test_nearest():
+    points, valid = resample.resample(track(), resample.targetTimes(START, 10), 'nearest', 0.5)
+    assert valid.tolist() == [ True ] * 4 + [ False ] * 4 + [ True ] * 2
+    assert points.elevation[9] == 309
+    assert np.isnan(points.latitude[5])
+
+
+def test_linear_gap():
+    times = resample.targetTimes(START, 10, 2)
+    points, valid = resample.resample(track(), times, 'linear', 0.5)
+    assert valid.all()
+    assert points.elevation[1] == 300.5
+    assert points.elevation[11] == 305.5
+    points, valid = resample.resample(track(), times, 'gap', 1.0)
+    assert valid[1] and not valid[11]
+    # on the points around the hole, the last one included
+    points, valid = resample.resample(track(), times[[ 6, 16, 18 ]], 'gap', 0.5)
+    assert valid.tolist() == [ True, True, True ]
+    assert points.elevation.tolist() == [ 303, 308, 309 ]
+    # out of the track by more than max_gap
+    points, valid = resample.resample(track(), resample.targetTimes(START, 12), 'linear', 0.5)
+    assert not valid[11]
+
+
+def test_empty():
+    points, valid = resample.resample(gpshelper.TrackArray(), resample.targetTimes(START, 3))
+    assert len(points) == 3 and not valid.any()
+    with pytest.raises(ValueError):
+        resample.resample(track(), resample.targetTimes(START, 3), 'cubic')
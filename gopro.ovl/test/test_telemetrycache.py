@@ -0,0 +1,58 @@
+import os
+
+import numpy as np
+
+from gopro2gpx import telemetrycache
+
+
+def source(tmp_path, name, size = 100000):
+    path = tmp_path / name
+    path.write_bytes(os.urandom(size))
+    return str(path)
+
+
+def test_store_load(tmp_path):
+    cache = telemetrycache.TelemetryCache(str(tmp_path / "cache"))
+    video = source(tmp_path, "GH010001.MP4")
+    assert cache.load(video) is None
+    cache.store(video, { 'lat': np.arange(5.0) })
+    assert cache.load(video)['lat'].tolist() == [ 0.0, 1.0, 2.0, 3.0, 4.0 ]
+    assert [ name for name in os.listdir(cache.directory) if name.endswith('.tmp') ] == []
+    # another content is another entry
+    with open(video, 'r+b') as fd:
+        fd.write(b'changed')
+    assert cache.load(video) is None
+    assert cache.invalidate(video) is False
+
+
+def test_damaged(tmp_path):
+    cache = telemetrycache.TelemetryCache(str(tmp_path / "cache"))
+    video = source(tmp_path, "GH010001.MP4")
+    cache.store(video, { 'lat': np.arange(5.0) })
+    path = cache.path(video)
+    with open(path, 'r+b') as fd:
+        fd.truncate(os.path.getsize(path) // 2)
+    assert cache.load(video) is None
+    assert not os.path.exists(path)
+
+
+def test_evict(tmp_path):
+    cache = telemetrycache.TelemetryCache(str(tmp_path / "cache"), max_size = 30000)
+    videos = [ source(tmp_path, f"GH01000{i}.MP4") for i in range(3) ]
+    for i, video in enumerate(videos):
+        cache.store(video, { 'lat': np.zeros(1500) })
+        os.utime(cache.path(video), (i, i))
+    cache.store(videos[0], { 'lat': np.zeros(1500) })
+    assert cache.load(videos[1]) is None
+    assert cache.load(videos[0]) is not None
+
+
+def test_evict_race(tmp_path, monkeypatch):
+    cache = telemetrycache.TelemetryCache(str(tmp_path / "cache"), max_size = 0)
+    video = source(tmp_path, "GH010001.MP4")
+    cache.store(video, { 'lat': np.zeros(10) })
+    # removed by another worker between the listing and the removal
+    gone = os.path.join(cache.directory, "gone.npz")
+    monkeypatch.setattr(cache, 'entries', lambda: [ (gone, 1000, 0) ])
+    cache.evict()
+    cache.clear()
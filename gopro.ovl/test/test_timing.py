@@ -0,0 +1,57 @@
+import numpy as np
+
+from gopro2gpx import gpmftree, gpmfwriter, mp4reader, timing
+
+
+def test_payload_starts():
+    track = mp4reader.MetadataTrack(np.array([ 0, 100 ]), np.array([ 100, 100 ]), np.array([ 0.0, 1.001 ]), np.array([ 1.001, 1.001 ]), 1000)
+    # by the MP4 sample holding the payload
+    assert timing.payloadStarts([ 10, 150 ], [ -1, -1 ], [ 0, 1 ], track).tolist() == [ 0.0, 1.001 ]
+    # STMP on the video clock
+    assert timing.payloadStarts([ 10, 150 ], [ 5000000, 6000000 ], [ 0, 1 ], track).tolist() == [ 0.0, 1.0 ]
+    assert timing.payloadStarts([ 10, 150 ], [ 5000000, 6000000 ], [ 0, 1 ]).tolist() == [ 5.0, 6.0 ]
+    # no STMP, no track: the DEVC number
+    assert timing.payloadStarts([ 10, 150 ], [ -1, -1 ], [ 0, 1 ]).tolist() == [ 0.0, 1.0 ]
+
+
+def test_sample_numbers():
+    # a lost payload of 10 samples leaves a gap
+    assert timing.sampleNumbers([ 10, 10, 10 ], [ 10, 20, 40 ]).tolist() == [ 0, 10, 30 ]
+    # TSMP missing
+    assert timing.sampleNumbers([ 10, 10, 10 ], [ 0, 0, 0 ]).tolist() == [ 0, 10, 20 ]
+
+
+def test_sample_clock():
+    clock = timing.sampleClock([ 0.0, 1.0, 3.0 ], np.array([ 0, 10, 30 ]), [ 10, 10, 10 ])
+    assert len(clock) == 30
+    assert np.allclose(clock[0:3], [ 0.0, 0.1, 0.2 ])
+    assert np.allclose(clock[10:12], [ 1.0, 1.1 ])
+    assert np.allclose(clock[20:22], [ 3.0, 3.1 ])
+    assert len(timing.sampleClock([ 0.0 ], np.array([ 0 ]), [ 0 ])) == 0
+
+
+def test_stream_clock():
+    tree = gpmftree.buildTree(gpmfwriter.GpmfWriter(gps5_rate = 18, accl_rate = 200).write(3))
+    accl = timing.streamClock(tree.streams('ACCL'))
+    assert len(accl) == 600
+    assert np.allclose(accl, np.arange(600) / 200)
+    assert np.allclose(timing.streamClock(tree.streams('GPS5'))[18:20], [ 1.0, 1 + 1 / 18 ])
+
+
+def test_sample_lookup():
+    tree = gpmftree.buildTree(gpmfwriter.GpmfWriter(gps5_rate = 18, accl_rate = 200).write(3))
+    clock = timing.streamClock(tree.streams('ACCL'))
+    pts = np.array([ -0.1, 0.0, 1.0 / 30, 1.5, 10.0 ])
+    assert timing.sampleAt(clock, pts).tolist() == [ -1, 0, 6, 300, 599 ]
+    assert timing.nearest(clock, pts).tolist() == [ 0, 0, 7, 300, 599 ]
+    assert timing.nearest(np.empty(0), pts).tolist() == [ -1 ] * 5
+
+
+def test_utc_fit():
+    starts = np.array([ 0.0, 1.0, 2.0, 3.0 ])
+    utc = np.array([ 'NaT', '2023-05-01T10:00:01', '2023-05-01T10:00:02', 'NaT' ], dtype = 'datetime64[us]')
+    a, b = timing.utcFit(starts, utc)
+    assert np.allclose(b, 1.0)
+    assert (a + b * 3e6).astype(np.int64).astype('datetime64[us]')[3] == np.datetime64('2023-05-01T10:00:03')
+    a, b = timing.utcFit(starts, np.full(4, np.datetime64('NaT'), dtype = 'datetime64[us]'))
+    assert np.isnan(a).all()